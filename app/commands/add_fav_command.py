@@ -1,15 +1,19 @@
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, Tuple
+import asyncio
 import json
 import logging
 from urllib.parse import urlencode
 
 from .fetch_command import FetchCommand, FetchCommandData
-from fastapi import WebSocket
+from app.websocket.channel import WebSocketChannel
 from app.models.message import Message, CommandType, MessageType
 from app.exceptions import ParamTypeError
+from app.logging_config import Payload
 
 logger = logging.getLogger(__name__)
 
+FAV_DEAL_URL = "https://api.bilibili.com/x/v3/fav/resource/deal"
+
 
 class AddFavCommand(FetchCommand):
     command_name = CommandType.ADD_FAV
@@ -30,7 +34,7 @@ class AddFavCommand(FetchCommand):
         }
     ]
 
-    async def get_params(self, websocket: WebSocket) -> str:
+    async def get_params(self, websocket: WebSocketChannel) -> str:
         """从 WebSocket 获取参数并使用 urllib 进行参数拼接"""
         try:
             params = {}
@@ -46,45 +50,134 @@ class AddFavCommand(FetchCommand):
                 )
                 params[param["name"]] = value
             
-            # 添加固定的空参数
-            params["del_media_ids"] = ""
-            params["platform"] = "web"
-            params["type"] = 42
-            
-            return urlencode(params)
+            return self.build_form(params["rid"], params["add_media_ids"])
             
         except ParamTypeError as e:
             await self.send_error(websocket, str(e))
             raise
 
-    async def execute(self, websocket: WebSocket, message: Message, conversation_id: str) -> None:
+    def build_form(self, rid: str, add_media_ids: str) -> str:
+        """拼接收藏接口的表单参数"""
+        params = {"rid": rid, "add_media_ids": add_media_ids}
+        # 添加固定的空参数
+        params["del_media_ids"] = ""
+        params["platform"] = "web"
+        params["type"] = 42
+        return urlencode(params)
+
+    def build_fetch_data(self, command_data: str) -> FetchCommandData:
+        """构建收藏接口的请求数据"""
+        return FetchCommandData(
+            url=FAV_DEAL_URL,
+            method="POST",
+            headers={
+                "Content-Type": "application/x-www-form-urlencoded",
+            },
+            data=command_data
+        )
+
+    async def execute(self, websocket: WebSocketChannel, message: Message, conversation_id: str) -> None:
         try:
             # 获取参数
-            logger.debug("开始获取添加收藏命令参数")
             command_data = await self.get_params(websocket)
-            logger.debug(f"获取到参数: {command_data}")
-            
-            # 构建请求数据
-            logger.debug("构建请求数据")
-            fetch_data = FetchCommandData(
-                url="https://api.bilibili.com/x/v3/fav/resource/deal",
-                method="POST",
-                headers={
-                    "Content-Type": "application/x-www-form-urlencoded",
-                },
-                data=command_data
-            )
-            logger.debug(f"构建的请求数据: {fetch_data}")
-
-            # 使用 FetchCommand 发送请求
-            logger.debug("开始发送请求")
-            await self.send_fetch_request(websocket, fetch_data)
-            fetch_response = await self.handle_fetch_response(websocket)
-            logger.debug(f"收到响应: {fetch_response}")
+            logger.debug("获取到参数: %s", Payload(command_data))
+
+            # 构建请求数据并使用 FetchCommand 发送请求
+            fetch_data = self.build_fetch_data(command_data)
+            fetch_response = await self.fetch(websocket, fetch_data)
+            logger.debug("收到响应: request_id=%s, data=%s", fetch_response.request_id, Payload(fetch_response.data))
 
             # 发送响应
-            logger.debug("发送成功响应")
             await self.send_response(websocket, content="收藏添加完成", data=fetch_response.data) 
         except ParamTypeError:
             logger.debug("参数错误")
-            return  # 参数错误已经发送了错误消息，直接返回
\ No newline at end of file
+            return  # 参数错误已经发送了错误消息，直接返回
+
+
+class AddFavBulkCommand(AddFavCommand):
+    """批量添加收藏
+
+    用法: /add_fav_bulk <收藏夹ID> [rid ...] [--window=N]
+    收藏夹ID必须在命令中给出，--window 可以出现在任意位置。未在命令中给出 rid 时，会请求参数 rids，客户端可以回复以逗号或空白分隔的文本，
+    也可以在回复的 data.items 中上传列表。
+    所有请求通过扩展流水线发送，同时在途的请求数不超过 window。
+    """
+    command_name = CommandType.ADD_FAV_BULK
+
+    # 默认同时在途的请求数
+    default_window = 8
+    max_window = 64
+
+    @property
+    def help_text(self) -> str:
+        return "/add_fav_bulk <收藏夹ID> [rid ...] [--window=N] - 批量添加收藏"
+
+    def parse_args(self, args: List[str]) -> Tuple[List[str], int]:
+        """解析命令参数，返回 (rid 列表, 窗口大小)"""
+        rids = []
+        window = self.default_window
+        for arg in args:
+            if arg.startswith("--window="):
+                try:
+                    window = int(arg.split("=", 1)[1])
+                except ValueError:
+                    raise ParamTypeError(f"窗口大小 '{arg}' 不是整数")
+            else:
+                rids.extend(item for item in arg.split(",") if item)
+        return rids, max(1, min(window, self.max_window))
+
+    async def add_one(
+        self,
+        websocket: WebSocketChannel,
+        semaphore: asyncio.Semaphore,
+        rid: str,
+        add_media_ids: str
+    ) -> Optional[str]:
+        """添加单个收藏，成功返回 None，失败返回错误信息"""
+        async with semaphore:
+            try:
+                fetch_response = await self.fetch(
+                    websocket,
+                    self.build_fetch_data(self.build_form(rid, add_media_ids))
+                )
+            except Exception as e:
+                return str(e) or e.__class__.__name__
+
+        data = fetch_response.data or {}
+        if isinstance(data, dict) and data.get("code", 0) != 0:
+            return str(data.get("message") or f"code={data.get('code')}")
+        return None
+
+    async def execute(self, websocket: WebSocketChannel, message: Message, conversation_id: str) -> None:
+        try:
+            add_media_ids = (message.data or {}).get("add_media_ids")
+            if not add_media_ids:
+                await self.send_error(websocket, f"缺少收藏夹ID，用法: {self.help_text}")
+                return
+
+            rids, window = self.parse_args((message.data or {}).get("rids") or [])
+            if not rids:
+                rids = await self.get_command_param(websocket, "rids", "视频/专栏ID列表", list)
+        except ParamTypeError as e:
+            await self.send_error(websocket, str(e))
+            return
+
+        # 去重并保持顺序
+        rids = list(dict.fromkeys(str(rid) for rid in rids))
+        if not rids:
+            await self.send_error(websocket, "请指定至少一个视频/专栏ID")
+            return
+
+        logger.debug("开始批量添加收藏: count=%d, window=%d", len(rids), window)
+        semaphore = asyncio.Semaphore(window)
+        errors = await asyncio.gather(*(
+            self.add_one(websocket, semaphore, rid, add_media_ids) for rid in rids
+        ))
+
+        succeeded = [rid for rid, error in zip(rids, errors) if error is None]
+        failed = [{"rid": rid, "error": error} for rid, error in zip(rids, errors) if error is not None]
+        await self.send_response(
+            websocket,
+            content=f"批量收藏完成: 成功 {len(succeeded)}，失败 {len(failed)}",
+            data={"succeeded": succeeded, "failed": failed}
+        )
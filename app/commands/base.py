@@ -1,16 +1,24 @@
 from abc import ABC, abstractmethod
 from typing import Dict, Any, Optional, Type, Union
-from fastapi import WebSocket
+from app.websocket.channel import WebSocketChannel, REQUEST_PARAMS
 from app.exceptions import ParamTypeError
 from app.models.message import Message, CommandType, MessageType
 from app.websocket.context import ContextManager
-import json
+from app.logging_config import Payload
+from app.tracing import default_tracer
 import logging
+import re
 
 logger = logging.getLogger(__name__)
 
+# 等待用户输入参数的超时时间（秒）
+PARAM_TIMEOUT = 300.0
+
 class BaseCommand(ABC):
     """命令处理器的基类"""
+    # 参数收集、发送响应等阶段的追踪
+    tracer = default_tracer
+
     def __init__(self, context_manager: ContextManager):
         self.context_manager = context_manager
 
@@ -27,16 +35,16 @@ class BaseCommand(ABC):
 
     async def get_command_param(
         self,
-        websocket: WebSocket,
+        websocket: WebSocketChannel,
         name: str,
         help_text: str,
         d_type: Type,
         default: Any = None
     ) -> Any:
-        """获取命令参数
+        """获取命令参数，等待用户输入的时间记录在 command.param 区间中
         
         Args:
-            websocket: WebSocket 连接
+            websocket: WebSocketChannel 连接
             name: 参数名称
             help_text: 参数说明
             d_type: 参数类型
@@ -48,15 +56,27 @@ class BaseCommand(ABC):
         Raises:
             ParamTypeError: 参数类型错误
         """
+        with self.tracer.span("command.param", param=name):
+            return await self._get_command_param(websocket, name, help_text, d_type, default)
+
+    async def _get_command_param(
+        self,
+        websocket: WebSocketChannel,
+        name: str,
+        help_text: str,
+        d_type: Type,
+        default: Any
+    ) -> Any:
         logger.debug(
             "开始获取参数: name=%s, type=%s, required=%s, default=%s",
             name,
             d_type.__name__,
             default is None,
-            default
+            Payload(default)
         )
         
-        # 构建参数请求消息
+        # 构建参数请求消息，客户端回复时需带回同一个请求ID
+        request_id, _ = websocket.create_request(REQUEST_PARAMS)
         param_request = Message.create_system_command(
             CommandType.PARAMS_REQUEST,
             data={
@@ -64,27 +84,38 @@ class BaseCommand(ABC):
                 "description": help_text,
                 "required": default is None,
                 "default": default
-            }
+            },
+            request_id=request_id
         )
-        await websocket.send_text(param_request.to_json())
+        try:
+            await websocket.send_message(param_request)
+        except Exception:
+            websocket.discard_request(request_id)
+            raise
         
-        # 接收参数值
-        response = await websocket.receive_text()
-        logger.debug("收到参数响应: %s", response)
-        param_data = json.loads(response)
-        logger.debug("解析后的参数数据: %s", param_data)
+        # 等待读取任务把对应的参数回复交给当前请求
+        param_data = await websocket.wait_response(request_id, PARAM_TIMEOUT)
+        logger.debug("收到参数响应: name=%s, data=%s", name, Payload(param_data))
         
         try:
             # 获取参数值
             value = param_data.get('content', default)
             
+            # 列表参数可以在 data.items 中直接上传
+            if d_type == list:
+                items = (param_data.get('data') or {}).get('items')
+                if items is not None:
+                    value = items
+
             # 如果是必需参数但没有提供值
             if value is None and default is None:
                 raise ParamTypeError(f"必需参数 {name} 未提供值")
                 
             # 尝试转换类型
             if value is not None:
-                if d_type == bool and isinstance(value, str):
+                if d_type == list and isinstance(value, str):
+                    value = [item for item in re.split(r'[\s,]+', value) if item]
+                elif d_type == bool and isinstance(value, str):
                     value = value.lower() in ('true', '1', 'yes', 'y')
                 else:
                     value = d_type(value)
@@ -95,16 +126,17 @@ class BaseCommand(ABC):
             raise ParamTypeError(f"参数 {name} 的值 '{value}' 无法转换为 {d_type.__name__} 类型")
 
     @abstractmethod
-    async def execute(self, websocket: WebSocket, message: Message, conversation_id: str) -> None:
+    async def execute(self, websocket: WebSocketChannel, message: Message, conversation_id: str) -> None:
         """执行命令"""
         pass
 
-    async def send_response(self, websocket: WebSocket, content: str, data: Optional[Dict[str, Any]] = None) -> None:
+    async def send_response(self, websocket: WebSocketChannel, content: str, data: Optional[Dict[str, Any]] = None) -> None:
         """发送响应消息"""
-        response = Message.create_response(content, data)
-        await websocket.send_text(response.to_json())
+        with self.tracer.span("command.respond"):
+            response = Message.create_response(content, data)
+            await websocket.send_message(response)
 
-    async def send_error(self, websocket: WebSocket, error_message: str) -> None:
+    async def send_error(self, websocket: WebSocketChannel, error_message: str) -> None:
         """发送错误消息"""
         error = Message.create_error(error_message)
-        await websocket.send_text(error.to_json()) 
\ No newline at end of file
+        await websocket.send_message(error) 
\ No newline at end of file
@@ -1,5 +1,5 @@
 from .base import BaseCommand
-from fastapi import WebSocket
+from app.websocket.channel import WebSocketChannel
 from app.models.message import Message, CommandType
 
 class ClearCommand(BaseCommand):
@@ -9,8 +9,8 @@ class ClearCommand(BaseCommand):
     def help_text(self) -> str:
         return "/clear - 清除聊天记录"
 
-    async def execute(self, websocket: WebSocket, message: Message, conversation_id: str) -> None:
+    async def execute(self, websocket: WebSocketChannel, message: Message, conversation_id: str) -> None:
         context = self.context_manager.get_context(conversation_id)
         if context:
-            context.clear_history()
+            await context.clear_history()
             await self.send_response(websocket, "聊天记录已清除") 
\ No newline at end of file
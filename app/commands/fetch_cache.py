@@ -0,0 +1,196 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from enum import Enum
+from typing import Any, Dict, Iterable, Optional, Tuple, Union
+from urllib.parse import urlsplit
+import json
+import os
+import time
+
+from app import metrics
+
+
+class CacheMode(str, Enum):
+    DEFAULT = "default"    # 先查缓存，未命中时请求并写入缓存
+    BYPASS = "bypass"      # 不读也不写缓存
+    REFRESH = "refresh"    # 跳过缓存直接请求，并用结果刷新缓存
+
+
+# 默认缓存过期时间（秒）
+FETCH_CACHE_TTL = float(os.environ.get("FETCH_CACHE_TTL", "30"))
+# 默认缓存的最大条数
+FETCH_CACHE_MAX_ENTRIES = int(os.environ.get("FETCH_CACHE_MAX_ENTRIES", "1024"))
+# 默认缓存的最大字节数
+FETCH_CACHE_MAX_BYTES = int(os.environ.get("FETCH_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+
+CACHE_HITS = metrics.registry.counter("fetch_cache_hits_total", "获取数据缓存命中次数")
+CACHE_MISSES = metrics.registry.counter("fetch_cache_misses_total", "获取数据缓存未命中次数")
+CACHE_EVICTIONS = metrics.registry.counter("fetch_cache_evictions_total", "获取数据缓存因超出上限淘汰的条目数")
+CACHE_ENTRIES = metrics.registry.gauge("fetch_cache_entries", "默认获取数据缓存的条目数")
+CACHE_BYTES = metrics.registry.gauge("fetch_cache_bytes", "默认获取数据缓存占用的字节数")
+
+# 只缓存幂等请求
+CACHEABLE_METHODS = frozenset({"GET", "HEAD"})
+
+# 参与缓存键计算的请求头，其余请求头不影响响应内容
+DEFAULT_KEY_HEADERS = ("accept", "accept-language", "content-type", "range")
+
+# (方法, URL, 请求头, 请求体, 作用域)
+CacheKey = Tuple[str, str, Tuple[Tuple[str, str], ...], str, Optional[str]]
+
+
+@dataclass
+class CacheEntry:
+    # 以 JSON 文本保存，调用方修改读到的数据不会影响缓存
+    text: str
+    expires_at: float
+    size: int
+
+
+class FetchCache:
+    """获取数据响应缓存
+
+    按请求方法、URL、部分请求头和请求体缓存扩展返回的数据，
+    每条缓存有过期时间，总条数和总字节数超出上限时淘汰最久未使用的条目。
+    缓存保存的是写入时数据的副本，每次命中都返回新的副本。
+    过期时间可以按域名或路径前缀单独配置，例如::
+
+        FetchCache(ttl_rules={"api.bilibili.com": 60, "api.bilibili.com/x/v3/fav": 5})
+    """
+    def __init__(
+        self,
+        default_ttl: float = FETCH_CACHE_TTL,
+        ttl_rules: Optional[Dict[str, float]] = None,
+        max_entries: int = FETCH_CACHE_MAX_ENTRIES,
+        max_bytes: int = FETCH_CACHE_MAX_BYTES,
+        key_headers: Iterable[str] = DEFAULT_KEY_HEADERS
+    ):
+        self.default_ttl = default_ttl
+        self.ttl_rules: Dict[str, float] = {}
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.key_headers = frozenset(header.lower() for header in key_headers)
+        self._entries: "OrderedDict[CacheKey, CacheEntry]" = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        for pattern, ttl in (ttl_rules or {}).items():
+            self.set_ttl(pattern, ttl)
+
+    def set_ttl(self, pattern: str, ttl: float) -> None:
+        """为域名或 域名/路径前缀 设置过期时间，ttl 为 0 表示不缓存"""
+        self.ttl_rules[pattern.rstrip("/")] = ttl
+
+    def ttl_for(self, url: str) -> float:
+        """按最长匹配的规则获取 URL 的过期时间"""
+        if not self.ttl_rules:
+            return self.default_ttl
+        parts = urlsplit(url)
+        target = f"{parts.hostname or ''}{parts.path}"
+        best, best_length = self.default_ttl, -1
+        for pattern, ttl in self.ttl_rules.items():
+            if len(pattern) > best_length and (
+                target == pattern or target.startswith(pattern + "/")
+            ):
+                best, best_length = ttl, len(pattern)
+        return best
+
+    def make_key(
+        self,
+        method: str,
+        url: str,
+        headers: Optional[Dict[str, str]] = None,
+        data: Optional[Union[Dict[str, Any], str]] = None,
+        scope: Optional[str] = None
+    ) -> CacheKey:
+        """计算缓存键，请求头名称不区分大小写
+
+        scope 不同的请求互不共享缓存，例如发给不同扩展（登录不同账号）的请求。
+        """
+        key_headers = tuple(sorted(
+            (name.lower(), value.strip())
+            for name, value in (headers or {}).items()
+            if name.lower() in self.key_headers
+        ))
+        if data is None or isinstance(data, str):
+            body = data or ""
+        else:
+            body = json.dumps(data, sort_keys=True)
+        return (method.upper(), url, key_headers, body, scope)
+
+    def is_cacheable(self, method: str) -> bool:
+        return method.upper() in CACHEABLE_METHODS
+
+    def get(self, key: CacheKey) -> Optional[Dict[str, Any]]:
+        """读取缓存，返回数据的独立副本，过期或不存在时返回 None"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            CACHE_MISSES.inc()
+            return None
+        if entry.expires_at <= time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            CACHE_MISSES.inc()
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        CACHE_HITS.inc()
+        return json.loads(entry.text)
+
+    def set(self, key: CacheKey, value: Dict[str, Any], ttl: Optional[float] = None) -> None:
+        """写入缓存，ttl 默认按 URL 规则计算"""
+        if ttl is None:
+            ttl = self.ttl_for(key[1])
+        if ttl <= 0:
+            return
+        text = json.dumps(value)
+        size = len(text) + len(key[1]) + len(key[3])
+        if size > self.max_bytes:
+            return
+
+        self._remove(key)
+        self._entries[key] = CacheEntry(text=text, expires_at=time.monotonic() + ttl, size=size)
+        self.total_bytes += size
+        while len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+            CACHE_EVICTIONS.inc()
+
+    def _remove(self, key: CacheKey) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry.size
+
+    def clear(self) -> None:
+        """清空缓存"""
+        self._entries.clear()
+        self.total_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, int]:
+        """缓存统计信息"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "bytes": self.total_bytes
+        }
+
+
+# 所有连接共享的默认缓存
+default_fetch_cache = FetchCache()
+
+
+def collect_cache() -> None:
+    """导出前记录默认缓存的条目数和字节数"""
+    CACHE_ENTRIES.set(len(default_fetch_cache))
+    CACHE_BYTES.set(default_fetch_cache.total_bytes)
+
+
+metrics.registry.add_collector(collect_cache)
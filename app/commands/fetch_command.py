@@ -1,11 +1,32 @@
-from typing import Dict, Any, Optional, Union
-import json
+from typing import Dict, Any, AsyncIterator, List, Optional, Tuple, Union
+from dataclasses import dataclass
+import asyncio
+import time
 
-import httpx
 from .base import BaseCommand
-from fastapi import WebSocket
-from app.models.message import Message, CommandType, MessageType
-from pydantic import BaseModel
+from app import metrics
+from app.models.message import Message, CommandType
+from app.websocket.channel import WebSocketChannel, REQUEST_FETCH
+from app.websocket.stream import DEFAULT_STREAM_WINDOW, FetchStream
+from app.exceptions import FetchError, FetchTimeoutError, RequestTimeoutError
+from .fetch_cache import CacheKey, CacheMode, FetchCache, default_fetch_cache
+from .singleflight import SingleFlight, default_single_flight
+from pydantic import BaseModel, Field
+
+# 等待扩展返回数据的默认超时时间（秒）
+FETCH_TIMEOUT = 30.0
+
+FETCH_SECONDS = metrics.registry.histogram(
+    "fetch_rtt_seconds", "获取数据请求从发出到收到响应的时间", ("outcome",),
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+)
+FETCH_IN_FLIGHT = metrics.registry.gauge("fetch_in_flight", "等待扩展响应的获取数据请求数")
+
+
+def _outcome(error: Optional[BaseException]) -> str:
+    if error is None:
+        return "ok"
+    return "timeout" if isinstance(error, RequestTimeoutError) else "error"
 
 class FetchCommandData(BaseModel):
     """获取数据命令数据"""
@@ -13,27 +34,249 @@ class FetchCommandData(BaseModel):
     method: str
     headers: Dict[str, str] = {}
     data: Optional[Union[Dict[str, Any], str]] = None
+    # 缓存策略只在服务端使用，不发送给扩展
+    cache: CacheMode = Field(default=CacheMode.DEFAULT, exclude=True)
+
+@dataclass
+class BatchFetchResult:
+    """批量获取中单个请求的结果"""
+    index: int
+    request: FetchCommandData
+    response: Optional[Message] = None
+    error: Optional[Exception] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
 
 class FetchCommand(BaseCommand):
     command_name = CommandType.FETCH
+    cache: FetchCache = default_fetch_cache
+    flights: SingleFlight = default_single_flight
 
-    async def execute(self, websocket: WebSocket, message: Message, conversation_id: str) -> None:
+    async def execute(self, websocket: WebSocketChannel, message: Message, conversation_id: str) -> None:
         data = FetchCommandData(
             url="https://example.com",
             method="GET",
         )
-        await self.send_fetch_request(websocket, data)
-        fetch_response = await self.handle_fetch_response(websocket)
+        fetch_response = await self.fetch(websocket, data)
         await self.send_response(websocket, content="", data=fetch_response.data)
 
-    async def send_fetch_request(self, websocket: WebSocket, data: FetchCommandData) -> None:
-        """发送获取数据请求"""
-        fetch_command = Message.create_system_command(CommandType.FETCH, data=data.model_dump())
-        await websocket.send_text(fetch_command.to_json())
+    async def send_fetch_request(self, websocket: WebSocketChannel, data: FetchCommandData) -> str:
+        """发送获取数据请求，返回请求ID"""
+        with self.tracer.span("fetch.send", url=data.url, method=data.method) as span:
+            request_id, _ = websocket.create_request(REQUEST_FETCH)
+            if span is not None:
+                span.set(request_id=request_id)
+            fetch_command = Message.create_system_command(
+                CommandType.FETCH,
+                data=data.model_dump(),
+                request_id=request_id
+            )
+            try:
+                await websocket.send_message(fetch_command)
+            except Exception:
+                websocket.discard_request(request_id)
+                raise
+            return request_id
+
+    async def handle_fetch_response(
+        self,
+        websocket: WebSocketChannel,
+        request_id: str,
+        timeout: Optional[float] = FETCH_TIMEOUT
+    ) -> Message:
+        """等待并处理指定请求的获取数据响应"""
+        try:
+            with self.tracer.span("fetch.wait", request_id=request_id):
+                response = await websocket.wait_response(request_id, timeout)
+        except RequestTimeoutError:
+            raise FetchTimeoutError(f"获取数据请求 {request_id} 超时")
+        data = response.get("data")
+        if data is None:
+            raise FetchError(f"获取数据请求 {request_id} 的响应缺少数据")
+        return Message.create_fetch_response(data, request_id=request_id)
+
+    async def fetch(
+        self,
+        websocket: WebSocketChannel,
+        data: FetchCommandData,
+        timeout: Optional[float] = FETCH_TIMEOUT,
+        scope: Optional[str] = None
+    ) -> Message:
+        """发送获取数据请求并等待对应的响应
+
+        幂等请求优先使用缓存；未命中时，所有连接上相同的并发请求合并为一次发送。
+        给定 scope 时只与 scope 相同的请求共享缓存和合并。
+        """
+        response, _ = await self.fetch_with_source(websocket, data, timeout, scope)
+        return response
+
+    async def fetch_with_source(
+        self,
+        websocket: WebSocketChannel,
+        data: FetchCommandData,
+        timeout: Optional[float] = FETCH_TIMEOUT,
+        scope: Optional[str] = None
+    ) -> Tuple[Message, bool]:
+        """与 fetch 相同，同时返回响应是否直接来自缓存（没有经过扩展往返）"""
+        if not self.cache.is_cacheable(data.method):
+            return await self._fetch_upstream(websocket, data, timeout), False
+
+        cache_key = self.cache.make_key(data.method, data.url, data.headers, data.data, scope)
+        if data.cache == CacheMode.DEFAULT:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return Message.create_fetch_response(cached), True
+        if data.cache == CacheMode.BYPASS:
+            return await self._fetch_upstream(websocket, data, timeout), False
+
+        response = await self.flights.do(
+            cache_key,
+            lambda: self._fetch_upstream(websocket, data, timeout, cache_key)
+        )
+        return response, False
 
-    async def handle_fetch_response(self, websocket: WebSocket) -> Message:
-        """处理获取数据响应"""
-        data = await websocket.receive_text()
-        fetch_response = Message.create_fetch_response(json.loads(data)['data'])
+    async def _fetch_upstream(
+        self,
+        websocket: WebSocketChannel,
+        data: FetchCommandData,
+        timeout: Optional[float],
+        cache_key: Optional[CacheKey] = None
+    ) -> Message:
+        """通过扩展发送请求，给定 cache_key 时把结果写入缓存"""
+        started = time.perf_counter()
+        error: Optional[BaseException] = None
+        FETCH_IN_FLIGHT.inc()
+        try:
+            request_id = await self.send_fetch_request(websocket, data)
+            fetch_response = await self.handle_fetch_response(websocket, request_id, timeout)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            FETCH_IN_FLIGHT.dec()
+            FETCH_SECONDS.observe(time.perf_counter() - started, outcome=_outcome(error))
+        if cache_key is not None and fetch_response.data is not None:
+            self.cache.set(cache_key, fetch_response.data)
         return fetch_response
-        
+
+    async def fetch_stream(
+        self,
+        websocket: WebSocketChannel,
+        data: FetchCommandData,
+        window: int = DEFAULT_STREAM_WINDOW
+    ) -> FetchStream:
+        """发送获取数据请求，响应体以分块形式流式返回
+
+        扩展最多连续发送 window 个未确认的分块，返回的流可以逐块读取或写入文件。
+        分块响应不经过缓存，也不与其他请求合并。
+        """
+        request_id, stream = websocket.open_stream(window)
+        fetch_command = Message.create_system_command(
+            CommandType.FETCH,
+            data={**data.model_dump(), "stream": {"window": window}},
+            request_id=request_id
+        )
+        try:
+            await websocket.send_message(fetch_command)
+        except Exception:
+            websocket.close_stream(request_id)
+            raise
+        return stream
+
+    async def fetch_many(
+        self,
+        websocket: WebSocketChannel,
+        requests: List[FetchCommandData],
+        timeout: Optional[float] = FETCH_TIMEOUT
+    ) -> List[Message]:
+        """在同一连接上并发发送多个请求，按请求顺序返回响应"""
+        return await asyncio.gather(*(
+            self.fetch(websocket, data, timeout) for data in requests
+        ))
+
+    async def fetch_batch(
+        self,
+        websocket: WebSocketChannel,
+        requests: List[FetchCommandData],
+        timeout: Optional[float] = FETCH_TIMEOUT
+    ) -> AsyncIterator[BatchFetchResult]:
+        """用一条消息发送多个请求，按完成顺序逐个产出结果
+
+        发出的 fetch_batch 消息中每个请求都带有自己的 request_id，
+        扩展并行执行后为每个请求单独回复一条 fetch_response。
+        单个请求超时或失败只体现在对应结果的 error 上，不影响其他请求。
+        """
+        request_ids = [websocket.create_request(REQUEST_FETCH)[0] for _ in requests]
+        batch_command = Message.create_system_command(
+            CommandType.FETCH_BATCH,
+            data={"requests": [
+                {"request_id": request_id, **data.model_dump()}
+                for request_id, data in zip(request_ids, requests)
+            ]}
+        )
+        try:
+            await websocket.send_message(batch_command)
+        except Exception:
+            for request_id in request_ids:
+                websocket.discard_request(request_id)
+            raise
+
+        started = time.perf_counter()
+        FETCH_IN_FLIGHT.inc(len(request_ids))
+        waiters = {
+            asyncio.ensure_future(self.handle_fetch_response(websocket, request_id, timeout)): index
+            for index, request_id in enumerate(request_ids)
+        }
+        try:
+            while waiters:
+                done, _ = await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+                for waiter in done:
+                    index = waiters.pop(waiter)
+                    result = BatchFetchResult(index=index, request=requests[index])
+                    if waiter.exception() is not None:
+                        result.error = waiter.exception()
+                    else:
+                        result.response = waiter.result()
+                    FETCH_IN_FLIGHT.dec()
+                    FETCH_SECONDS.observe(time.perf_counter() - started, outcome=_outcome(result.error))
+                    yield result
+        finally:
+            # 调用方提前结束迭代时，取消剩余等待并清理请求表
+            FETCH_IN_FLIGHT.dec(len(waiters))
+            for waiter in waiters:
+                waiter.cancel()
+            for request_id in request_ids:
+                websocket.discard_request(request_id)
+
+
+class FetchBatchCommand(FetchCommand):
+    command_name = CommandType.FETCH_BATCH
+
+    @property
+    def help_text(self) -> str:
+        return "/fetch_batch <url> [url ...] - 批量获取数据"
+
+    async def execute(self, websocket: WebSocketChannel, message: Message, conversation_id: str) -> None:
+        urls = (message.data or {}).get("urls") or []
+        if not urls:
+            await self.send_error(websocket, "请指定至少一个URL")
+            return
+
+        requests = [FetchCommandData(url=url, method="GET") for url in urls]
+        failed = 0
+        async for result in self.fetch_batch(websocket, requests):
+            if result.ok:
+                await self.send_response(
+                    websocket,
+                    content=f"[{result.index + 1}/{len(requests)}] {result.request.url}",
+                    data=result.response.data
+                )
+            else:
+                failed += 1
+                await self.send_error(
+                    websocket,
+                    f"[{result.index + 1}/{len(requests)}] {result.request.url} 获取失败: {result.error}"
+                )
+        await self.send_response(websocket, f"批量获取完成: 成功 {len(requests) - failed}，失败 {failed}")
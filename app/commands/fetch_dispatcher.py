@@ -0,0 +1,175 @@
+import time
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Iterable, List, Optional, Set
+
+from app.exceptions import ChannelClosedError, ExtensionUnavailableError, FetchTimeoutError
+from app.models.message import Message
+from app.websocket.registry import CLIENT_EXTENSION, SessionRegistry
+from app.websocket.stream import DEFAULT_STREAM_WINDOW, FetchStream
+from .fetch_command import FETCH_TIMEOUT, FetchCommand, FetchCommandData
+
+if TYPE_CHECKING:
+    from app.websocket.connection import WebSocketConnection
+
+# 重复执行不会产生额外副作用的方法，扩展断开时可以换一个扩展重试
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+# 没有延迟数据时使用的估计值（秒）
+DEFAULT_LATENCY = 1.0
+# 最多保留的亲和绑定数
+MAX_AFFINITY_BINDINGS = 10000
+
+
+@dataclass
+class ExtensionStats:
+    """单个扩展连接的负载统计"""
+    in_flight: int = 0
+    latency: Optional[float] = None
+    completed: int = 0
+    failures: int = 0
+
+
+class FetchDispatcher:
+    """把获取数据请求分发给多个在线扩展
+
+    每次选择预计等待时间最短的扩展：(进行中的请求数 + 1) × 最近延迟的指数移动平均。
+    需要复用登录状态的请求可以指定亲和键（例如站点域名或账号），同一个键固定发给同一个扩展，
+    直到该扩展断开。请求进行中扩展断开时，幂等请求自动换一个扩展重试。
+    不同扩展可能登录了不同账号，缓存和请求合并都以扩展为作用域，不会把一个扩展的响应交给另一个扩展的请求。
+    """
+    def __init__(
+        self,
+        registry: SessionRegistry,
+        fetch_command: FetchCommand,
+        kind: str = CLIENT_EXTENSION,
+        alpha: float = 0.2,
+        max_attempts: int = 3
+    ):
+        self.registry = registry
+        self.fetch_command = fetch_command
+        self.kind = kind
+        self.alpha = alpha
+        self.max_attempts = max_attempts
+        # 会话断开并被回收后统计自动移除
+        self.stats: "weakref.WeakKeyDictionary[WebSocketConnection, ExtensionStats]" = weakref.WeakKeyDictionary()
+        self._affinity: "OrderedDict[str, weakref.ref]" = OrderedDict()
+
+    def extensions(self) -> List["WebSocketConnection"]:
+        """当前可用的扩展连接"""
+        return [session for session in self.registry.get_by_kind(self.kind) if session.websocket is not None]
+
+    def stats_for(self, session: "WebSocketConnection") -> ExtensionStats:
+        stats = self.stats.get(session)
+        if stats is None:
+            stats = self.stats[session] = ExtensionStats()
+        return stats
+
+    def select(self, affinity: Optional[str] = None, exclude: Iterable["WebSocketConnection"] = ()) -> "WebSocketConnection":
+        """选择一个扩展，有亲和绑定且绑定的扩展可用时优先使用
+
+        Raises:
+            ExtensionUnavailableError: 没有可用的扩展
+        """
+        excluded: Set[int] = {id(session) for session in exclude}
+        candidates = [session for session in self.extensions() if id(session) not in excluded]
+        if not candidates:
+            raise ExtensionUnavailableError("没有在线的扩展")
+
+        if affinity is not None:
+            ref = self._affinity.get(affinity)
+            bound = ref() if ref is not None else None
+            if bound is not None and any(bound is session for session in candidates):
+                self._affinity.move_to_end(affinity)
+                return bound
+
+        latencies = [s.latency for s in (self.stats.get(c) for c in candidates) if s and s.latency is not None]
+        default_latency = sum(latencies) / len(latencies) if latencies else DEFAULT_LATENCY
+
+        def expected_wait(session: "WebSocketConnection") -> float:
+            stats = self.stats_for(session)
+            latency = stats.latency
+            if latency is None:
+                # 还没有完成过请求时参考心跳往返时间
+                latency = getattr(session.websocket, "rtt_avg", None) or default_latency
+            return (stats.in_flight + 1) * latency
+
+        session = min(candidates, key=expected_wait)
+        if affinity is not None:
+            self._affinity[affinity] = weakref.ref(session)
+            self._affinity.move_to_end(affinity)
+            while len(self._affinity) > MAX_AFFINITY_BINDINGS:
+                self._affinity.popitem(last=False)
+        return session
+
+    def _record_latency(self, stats: ExtensionStats, elapsed: float) -> None:
+        if stats.latency is None:
+            stats.latency = elapsed
+        else:
+            stats.latency += self.alpha * (elapsed - stats.latency)
+
+    async def fetch(
+        self,
+        data: FetchCommandData,
+        timeout: Optional[float] = FETCH_TIMEOUT,
+        affinity: Optional[str] = None,
+        retry_non_idempotent: bool = False
+    ) -> Message:
+        """选择扩展发送请求并等待响应，扩展中途断开时按需换一个扩展重试"""
+        can_retry = retry_non_idempotent or data.method.upper() in IDEMPOTENT_METHODS
+        tried: List["WebSocketConnection"] = []
+        while True:
+            session = self.select(affinity, exclude=tried)
+            # 只处理网关请求的扩展不发聊天消息，需要单独刷新活跃时间
+            session.touch()
+            stats = self.stats_for(session)
+            stats.in_flight += 1
+            started = time.monotonic()
+            try:
+                response, from_cache = await self.fetch_command.fetch_with_source(
+                    session.websocket, data, timeout, scope=session.current_context
+                )
+            except ChannelClosedError:
+                stats.failures += 1
+                tried.append(session)
+                if not can_retry or len(tried) >= self.max_attempts:
+                    raise
+                continue
+            except FetchTimeoutError:
+                # 超时计入延迟，后续请求会少分给这个扩展
+                stats.failures += 1
+                self._record_latency(stats, time.monotonic() - started)
+                raise
+            finally:
+                stats.in_flight -= 1
+            stats.completed += 1
+            if not from_cache:
+                # 缓存命中没有经过扩展，不能反映扩展的延迟
+                self._record_latency(stats, time.monotonic() - started)
+            return response
+
+    async def fetch_stream(
+        self,
+        data: FetchCommandData,
+        window: int = DEFAULT_STREAM_WINDOW,
+        affinity: Optional[str] = None
+    ) -> FetchStream:
+        """选择扩展发送分块请求；已开始传输的流无法重试，不做故障转移
+
+        流在扩展发送完最后一块或失败之前计入该扩展的进行中请求数。
+        """
+        session = self.select(affinity)
+        session.touch()
+        stats = self.stats_for(session)
+        stats.in_flight += 1
+        try:
+            stream = await self.fetch_command.fetch_stream(session.websocket, data, window)
+        except BaseException:
+            stats.in_flight -= 1
+            raise
+
+        def finished() -> None:
+            stats.in_flight -= 1
+
+        stream.add_done_callback(finished)
+        return stream
@@ -1,5 +1,5 @@
 from .base import BaseCommand
-from fastapi import WebSocket
+from app.websocket.channel import WebSocketChannel
 from app.models.message import Message, CommandType
 
 class HelpCommand(BaseCommand):
@@ -9,12 +9,16 @@ class HelpCommand(BaseCommand):
     def help_text(self) -> str:
         return "/help - 显示此帮助信息"
 
-    async def execute(self, websocket: WebSocket, message: Message, conversation_id: str) -> None:
+    async def execute(self, websocket: WebSocketChannel, message: Message, conversation_id: str) -> None:
         help_text = """可用命令：
         /help - 显示此帮助信息
         /clear - 清除聊天记录
         /rename <新名字> - 修改用户名
         /status - 显示系统状态
         /history <数量> - 显示历史消息
+        /join <聊天室> - 加入聊天室
+        /leave [聊天室] - 离开聊天室，不指定时离开所有聊天室
+        /fetch_batch <url> [url ...] - 批量获取数据
+        /add_fav_bulk <收藏夹ID> [rid ...] [--window=N] - 批量添加收藏
         """
         await self.send_response(websocket, help_text) 
\ No newline at end of file
@@ -1,32 +1,40 @@
 from .base import BaseCommand
-from fastapi import WebSocket
+from app.websocket.channel import WebSocketChannel
 from app.models.message import Message, CommandType
 
+# 单页最多显示的消息数
+MAX_HISTORY_PAGE = 100
+
 class HistoryCommand(BaseCommand):
     command_name = CommandType.HISTORY
 
     @property
     def help_text(self) -> str:
-        return "/history <数量> - 显示历史消息"
+        return "/history <数量> [游标] - 显示历史消息，使用上一页返回的游标继续向前翻页"
 
-    async def execute(self, websocket: WebSocket, message: Message, conversation_id: str) -> None:
+    async def execute(self, websocket: WebSocketChannel, message: Message, conversation_id: str) -> None:
         try:
-            count = int(message.data.get("count", "5"))
+            count = min(int(message.data.get("count") or "5"), MAX_HISTORY_PAGE)
         except ValueError:
             count = 5
+        try:
+            cursor = int(message.data["cursor"]) if message.data.get("cursor") else None
+        except ValueError:
+            await self.send_error(websocket, "游标格式错误")
+            return
 
         context = self.context_manager.get_context(conversation_id)
         if not context:
             await self.send_error(websocket, "无法找到聊天上下文")
             return
 
-        messages = context.get_last_n_messages(count)
+        page = await self.context_manager.read_history(conversation_id, count, cursor)
         history_text = "\n".join([
             f"[{msg.timestamp.strftime('%H:%M:%S')}] {msg.sender}: {msg.content}"
-            for msg in messages
+            for _, msg in page.messages
         ])
-        
-        await self.send_response(
-            websocket,
-            f"最近 {len(messages)} 条消息:\n{history_text}" if messages else "没有历史消息"
-        ) 
\ No newline at end of file
+        text = f"最近 {len(page.messages)} 条消息:\n{history_text}" if page.messages else "没有历史消息"
+        if page.next_cursor is not None:
+            text += f"\n更早的消息: /history {count} {page.next_cursor}"
+
+        await self.send_response(websocket, text, {"next_cursor": page.next_cursor})
@@ -0,0 +1,49 @@
+from .base import BaseCommand
+from app.websocket.channel import WebSocketChannel
+from app.websocket.rooms import RoomManager, default_room_manager
+from app.models.message import Message, CommandType
+
+# 聊天室名称的最大长度
+MAX_ROOM_NAME = 64
+
+class JoinCommand(BaseCommand):
+    command_name = CommandType.JOIN
+    rooms: RoomManager = default_room_manager
+
+    @property
+    def help_text(self) -> str:
+        return "/join <聊天室> - 加入聊天室，之后的聊天消息发送给聊天室所有成员"
+
+    async def execute(self, websocket: WebSocketChannel, message: Message, conversation_id: str) -> None:
+        room = (message.data or {}).get("room")
+        if not room:
+            await self.send_error(websocket, "请指定聊天室")
+            return
+        if len(room) > MAX_ROOM_NAME:
+            await self.send_error(websocket, f"聊天室名称不能超过 {MAX_ROOM_NAME} 个字符")
+            return
+
+        self.rooms.join(room, conversation_id, websocket)
+        await self.send_response(
+            websocket,
+            f"已加入聊天室: {room}",
+            {"room": room, "members": len(self.rooms.members(room))}
+        )
+
+class LeaveCommand(BaseCommand):
+    command_name = CommandType.LEAVE
+    rooms: RoomManager = default_room_manager
+
+    @property
+    def help_text(self) -> str:
+        return "/leave [聊天室] - 离开聊天室，不指定时离开所有聊天室"
+
+    async def execute(self, websocket: WebSocketChannel, message: Message, conversation_id: str) -> None:
+        room = (message.data or {}).get("room")
+        if room is None:
+            self.rooms.leave_all(conversation_id)
+            await self.send_response(websocket, "已离开所有聊天室")
+        elif self.rooms.leave(room, conversation_id):
+            await self.send_response(websocket, f"已离开聊天室: {room}")
+        else:
+            await self.send_error(websocket, f"不在聊天室 {room} 中")
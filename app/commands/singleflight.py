@@ -0,0 +1,43 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """合并相同键的并发调用
+
+    同一个键在执行期间的后续调用不会再次执行，而是等待第一次调用的结果，
+    所有等待者得到同一个结果或同一个异常。调用结束后立即移除，失败不会被缓存。
+    """
+    def __init__(self):
+        self._flights: Dict[Hashable, asyncio.Future] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        """执行或加入键为 key 的调用"""
+        flight = self._flights.get(key)
+        if flight is None:
+            self.calls += 1
+            flight = asyncio.ensure_future(func())
+            self._flights[key] = flight
+            flight.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            self.coalesced += 1
+        # 单个等待者被取消不影响共享的调用
+        return await asyncio.shield(flight)
+
+    def _finish(self, key: Hashable, flight: asyncio.Future) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        if not flight.cancelled():
+            # 所有等待者都已取消时避免 "exception was never retrieved"
+            flight.exception()
+
+    def in_flight(self) -> int:
+        return len(self._flights)
+
+
+# 所有连接共享的默认实例
+default_single_flight = SingleFlight()
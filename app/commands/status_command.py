@@ -1,5 +1,5 @@
 from .base import BaseCommand
-from fastapi import WebSocket
+from app.websocket.channel import WebSocketChannel
 from app.models.message import Message, CommandType
 from datetime import datetime
 
@@ -10,20 +10,25 @@ class StatusCommand(BaseCommand):
     def help_text(self) -> str:
         return "/status - 显示系统状态"
 
-    async def execute(self, websocket: WebSocket, message: Message, conversation_id: str) -> None:
+    async def execute(self, websocket: WebSocketChannel, message: Message, conversation_id: str) -> None:
         context = self.context_manager.get_context(conversation_id)
         if not context or not context.user_context:
             await self.send_error(websocket, "无法找到聊天上下文")
             return
 
+        # 多个 worker 共享用户信息时从存储刷新
+        user_context = await self.context_manager.get_user_context(context.user_context.user_id) or context.user_context
         current_time = datetime.now()
         status_data = {
             "conversation_id": context.conversation_id,
             "started_at": context.started_at.isoformat(),
             "duration": str(current_time - context.started_at),
-            "message_count": context.user_context.message_count,
-            "username": context.user_context.username,
-            "last_active": context.user_context.last_active.isoformat()
+            "message_count": user_context.message_count,
+            "username": user_context.username,
+            "last_active": user_context.last_active.isoformat(),
+            # 心跳往返时间，尚未完成心跳时为 None
+            "rtt_ms": round(websocket.rtt * 1000, 1) if websocket.rtt is not None else None,
+            "rtt_avg_ms": round(websocket.rtt_avg * 1000, 1) if websocket.rtt_avg is not None else None
         }
         
         await self.send_response(websocket, "系统状态", status_data) 
\ No newline at end of file
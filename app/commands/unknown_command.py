@@ -1,9 +1,9 @@
 from .base import BaseCommand
-from fastapi import WebSocket
+from app.websocket.channel import WebSocketChannel
 from app.models.message import Message, CommandType
 
 class UnknownCommand(BaseCommand):
     command_name = CommandType.UNKNOWN
 
-    async def execute(self, websocket: WebSocket, message: Message, conversation_id: str) -> None:
+    async def execute(self, websocket: WebSocketChannel, message: Message, conversation_id: str) -> None:
         await self.send_error(websocket, f"未知命令: {message.content}") 
\ No newline at end of file
@@ -15,6 +15,31 @@ class NoUserContextError(ContextError):
     pass 
 
 
+class MessageFormatError(ChatError):
+    """收到的消息无法解码"""
+    pass
+
+class ChannelClosedError(ChatError):
+    """连接已关闭，等待中的请求无法完成"""
+    pass
+
+class RequestTimeoutError(ChatError):
+    """等待客户端响应超时"""
+    pass
+
+class FetchError(ChatError):
+    """获取数据请求错误"""
+    pass
+
+class FetchTimeoutError(FetchError, RequestTimeoutError):
+    """获取数据请求超时"""
+    pass
+
+class ExtensionUnavailableError(FetchError):
+    """没有可用的扩展连接"""
+    pass
+
+
 class ParamTypeError(Exception):
     """参数类型错误"""
     pass
\ No newline at end of file
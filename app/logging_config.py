@@ -0,0 +1,156 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+# 日志级别和日志文件，未设置 LOG_FILE 时只输出到控制台
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FILE = os.environ.get("LOG_FILE", "")
+# 输出格式：text 或 json
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text")
+# 日志中单个载荷的最大长度
+LOG_PAYLOAD_LIMIT = int(os.environ.get("LOG_PAYLOAD_LIMIT", "512"))
+# 同一处 DEBUG 日志每个时间窗口最多输出的条数
+LOG_DEBUG_RATE = int(os.environ.get("LOG_DEBUG_RATE", "20"))
+LOG_DEBUG_INTERVAL = float(os.environ.get("LOG_DEBUG_INTERVAL", "1"))
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# logging.LogRecord 自带的属性，其余属性视为通过 extra 传入的结构化字段
+_RECORD_ATTRS = frozenset(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class Payload:
+    """延迟截断的日志载荷
+
+    只有日志真正输出时才把对象转换为字符串，被级别或采样过滤掉的日志没有格式化开销。
+    """
+    __slots__ = ("value", "limit")
+
+    def __init__(self, value: Any, limit: Optional[int] = None):
+        self.value = value
+        self.limit = limit if limit is not None else LOG_PAYLOAD_LIMIT
+
+    def __str__(self) -> str:
+        return truncate(self.value, self.limit)
+
+    __repr__ = __str__
+
+
+def truncate(value: Any, limit: Optional[int] = None) -> str:
+    """转换为字符串并截断到 limit 个字符"""
+    limit = limit if limit is not None else LOG_PAYLOAD_LIMIT
+    text = value if isinstance(value, str) else repr(value)
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}...(共 {len(text)} 字符)"
+
+
+class DebugRateLimitFilter(logging.Filter):
+    """限制每处 DEBUG 日志的输出频率
+
+    以 (logger 名, 日志模板) 区分调用位置，每个时间窗口最多放行 rate 条，
+    窗口内被丢弃的条数附加在下一条放行的日志上。INFO 及以上级别不受影响。
+    """
+    def __init__(self, rate: int = LOG_DEBUG_RATE, interval: float = LOG_DEBUG_INTERVAL):
+        super().__init__()
+        self.rate = rate
+        self.interval = interval
+        # 调用位置 -> [窗口开始时间, 已放行条数, 已丢弃条数]
+        self._windows: Dict[Tuple[str, Any], list] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.rate <= 0:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window is not None else 0
+                window = self._windows[key] = [now, 0, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+            if window[1] >= self.rate:
+                window[2] += 1
+                return False
+            window[1] += 1
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行 JSON，extra 传入的字段原样保留，字符串字段会被截断"""
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value if isinstance(value, (int, float, bool)) or value is None else truncate(value)
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    """文本格式，附带被采样丢弃的条数"""
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        suppressed = getattr(record, "suppressed", None)
+        if suppressed:
+            text += f" (此前 {suppressed} 条相同日志已省略)"
+        return text
+
+
+def setup_logging(
+    level: str = LOG_LEVEL,
+    log_file: Optional[str] = LOG_FILE,
+    fmt: str = LOG_FORMAT
+) -> logging.handlers.QueueListener:
+    """配置根日志
+
+    调用方线程只把日志放入队列，格式化之外的写控制台和写文件都在后台线程完成，
+    磁盘变慢不会阻塞事件循环。重复调用时替换之前的配置。
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+
+    formatter = JsonFormatter() if fmt == "json" else TextFormatter(TEXT_FORMAT)
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        handlers.append(logging.FileHandler(log_file, encoding="utf-8"))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(DebugRateLimitFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+@atexit.register
+def _stop_listener() -> None:
+    # 退出前写完队列中剩余的日志
+    if _listener is not None:
+        _listener.stop()
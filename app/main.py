@@ -1,20 +1,29 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from app.routes.chat import router
+from app.routes.chat import router, context_manager
+from app.routes import admin, api, metrics
+from app.logging_config import setup_logging
+from app.tracing import default_profiler
 import logging
 
-# 配置日志
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),  # 输出到控制台
-        logging.FileHandler('app.log')  # 输出到文件
-    ]
-)
+# 配置日志，级别和文件由 LOG_LEVEL、LOG_FILE 环境变量指定
+setup_logging()
 
 # 创建logger
 logger = logging.getLogger(__name__)
 logger.debug("应用启动")
 
-app = FastAPI()
-app.include_router(router)
\ No newline at end of file
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    context_manager.start_sweeper()
+    yield
+    # 停止清理任务，写入尚未持久化的历史消息
+    await context_manager.close()
+    default_profiler.stop()
+    await default_profiler.flush()
+
+app = FastAPI(lifespan=lifespan)
+app.include_router(router)
+app.include_router(api.router)
+app.include_router(metrics.router)
+app.include_router(admin.router)
\ No newline at end of file
@@ -1,8 +1,14 @@
 from pydantic import BaseModel
 from enum import Enum
 import json
+from json.encoder import encode_basestring_ascii
 from datetime import datetime
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson 是可选依赖
+    orjson = None
 
 class MessageRole(str, Enum):
     USER = "user"
@@ -16,6 +22,8 @@ class MessageType(str, Enum):
     ERROR = "error"         # 错误消息
     SYSTEM = "system"       # 系统消息
     FETCH_RESPONSE = "fetch_response" # 获取数据响应
+    FETCH_CHUNK = "fetch_chunk"       # 分块获取数据响应
+    PONG = "pong"           # 心跳回复
 
 class CommandType(str, Enum):
     HELP = "help"          # 显示帮助信息
@@ -25,7 +33,13 @@ class CommandType(str, Enum):
     HISTORY = "history"    # 显示历史消息
     UNKNOWN = "unknown"    # 未知命令
     FETCH = "fetch"        # 获取数据
+    FETCH_BATCH = "fetch_batch"  # 批量获取数据
+    FETCH_ACK = "fetch_ack"      # 分块响应的流控确认
     ADD_FAV = "add_fav"    # 添加收藏
+    ADD_FAV_BULK = "add_fav_bulk"  # 批量添加收藏
+    JOIN = "join"          # 加入聊天室
+    LEAVE = "leave"        # 离开聊天室
+    PING = "ping"          # 心跳
     PARAMS_REQUEST = "params_request"  # 添加这一行
 
 class Message(BaseModel):
@@ -36,21 +50,89 @@ class Message(BaseModel):
     timestamp: datetime = datetime.now()
     command: Optional[CommandType] = None
     data: Optional[Dict[str, Any]] = None
+    request_id: Optional[str] = None
+
+    def to_json(self) -> str:
+        """序列化为 JSON 文本
+
+        输出与 json.dumps(字段字典) 逐字节一致，但只对 content、sender、data 等
+        可变字段编码，type/role 前缀、command 和时间戳的编码结果会被缓存。
+        """
+        prefix = _PREFIX_CACHE.get((self.type, self.role))
+        if prefix is None:
+            prefix = _PREFIX_CACHE[(self.type, self.role)] = (
+                f'{{"type": {json.dumps(self.type)}, "role": {json.dumps(self.role)}, "content": '
+            )
+        command = _COMMAND_CACHE.get(self.command)
+        if command is None:
+            command = _COMMAND_CACHE[self.command] = json.dumps(self.command)
+        return "".join((
+            prefix,
+            encode_basestring_ascii(self.content),
+            ', "sender": ',
+            encode_basestring_ascii(self.sender),
+            ', "timestamp": ',
+            _encode_timestamp(self.timestamp),
+            ', "command": ',
+            command,
+            ', "data": ',
+            "null" if self.data is None else _encode_json(self.data),
+            ', "request_id": ',
+            "null" if self.request_id is None else encode_basestring_ascii(self.request_id),
+            "}"
+        ))
 
-    def to_json(self):
-        return json.dumps({
-            "type": self.type,
-            "role": self.role,
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为与 to_json 字段相同的字典，供其他编码使用"""
+        return {
+            "type": self.type.value,
+            "role": self.role.value,
             "content": self.content,
             "sender": self.sender,
             "timestamp": self.timestamp.isoformat(),
-            "command": self.command,
-            "data": self.data
+            "command": self.command.value if self.command is not None else None,
+            "data": self.data,
+            "request_id": self.request_id
+        }
+
+    @classmethod
+    def create_trusted(
+        cls,
+        type: MessageType,
+        role: MessageRole,
+        content: str,
+        sender: str,
+        command: Optional[CommandType] = None,
+        data: Optional[Dict[str, Any]] = None,
+        request_id: Optional[str] = None
+    ) -> 'Message':
+        """跳过校验构造服务端生成的消息
+
+        字段类型由调用方保证。校验会复制整个 data 字典，对大的获取数据响应开销明显；
+        model_construct 同样跳过校验，但比直接校验还慢，所以这里直接填充实例字段。
+        """
+        message = _object_new(cls)
+        _object_setattr(message, "__dict__", {
+            "type": type,
+            "role": role,
+            "content": content,
+            "sender": sender,
+            "timestamp": _DEFAULT_TIMESTAMP,
+            "command": command,
+            "data": data,
+            "request_id": request_id
         })
+        _object_setattr(message, "__pydantic_fields_set__", set(_TRUSTED_FIELDS))
+        _object_setattr(message, "__pydantic_extra__", None)
+        _object_setattr(message, "__pydantic_private__", None)
+        return message
 
     @classmethod
     def create_command(cls, command: str, sender: str, **kwargs) -> 'Message':
-        """创建命令消息"""
+        """创建命令消息
+
+        命令名、发送者和参数来自客户端输入，需要经过校验，不能走 create_trusted。
+        """
         try:
             cmd_type = CommandType(command.lower())
         except ValueError:
@@ -69,22 +151,24 @@ class Message(BaseModel):
     def create_system_command(
         cls,
         command: CommandType,
-        data: Optional[Dict[str, Any]] = None
+        data: Optional[Dict[str, Any]] = None,
+        request_id: Optional[str] = None
     ) -> 'Message':
         """创建系统命令消息"""
-        return cls(
+        return cls.create_trusted(
             type=MessageType.COMMAND,
             role=MessageRole.SYSTEM,
             sender="system",
             command=command,
             data=data,
-            content=""
+            content="",
+            request_id=request_id
         )
 
     @classmethod
     def create_response(cls, content: str, data: Optional[Dict[str, Any]] = None) -> 'Message':
         """创建响应消息"""
-        return cls(
+        return cls.create_trusted(
             type=MessageType.RESPONSE,
             role=MessageRole.SYSTEM,
             content=content,
@@ -93,22 +177,55 @@ class Message(BaseModel):
         )
     
     @classmethod    
-    def create_fetch_response(cls, data: Dict[str, Any]) -> 'Message':
+    def create_fetch_response(cls, data: Dict[str, Any], request_id: Optional[str] = None) -> 'Message':
         """创建获取数据响应消息"""
-        return cls(
+        return cls.create_trusted(
             type=MessageType.FETCH_RESPONSE,
             role=MessageRole.AGENT,
             content="",
             sender="agent",
-            data=data
+            data=data,
+            request_id=request_id
         )
 
     @classmethod
     def create_error(cls, content: str) -> 'Message':
         """创建错误消息"""
-        return cls(
+        return cls.create_trusted(
             type=MessageType.ERROR,
             role=MessageRole.SYSTEM,
             content=content,
             sender="System"
         )
+
+
+_object_new = object.__new__
+_object_setattr = object.__setattr__
+_DEFAULT_TIMESTAMP: datetime = Message.model_fields["timestamp"].default
+# 每条消息需要自己的 fields_set，赋值和 model_copy 会修改它
+_TRUSTED_FIELDS = ("type", "role", "content", "sender", "command", "data", "request_id")
+
+# to_json 的编码缓存：(type, role) 前缀、command 取值、最近一次的时间戳
+_PREFIX_CACHE: Dict[Tuple[Any, Any], str] = {}
+_COMMAND_CACHE: Dict[Any, str] = {}
+_timestamp_cache: Tuple[Optional[datetime], str] = (None, "")
+_encode_json = json.JSONEncoder().encode
+
+
+def _encode_timestamp(timestamp: datetime) -> str:
+    global _timestamp_cache
+    cached, encoded = _timestamp_cache
+    if cached is not timestamp:
+        encoded = encode_basestring_ascii(timestamp.isoformat())
+        _timestamp_cache = (timestamp, encoded)
+    return encoded
+
+
+def parse_json(data: Any) -> Any:
+    """解析收到的 JSON 消息，安装了 orjson 时使用 orjson
+
+    解析失败时抛出 json.JSONDecodeError（orjson 的异常是它的子类）。
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
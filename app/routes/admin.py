@@ -0,0 +1,49 @@
+import os
+import secrets
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+
+from app.tracing import default_profiler
+
+# 管理接口的访问令牌，未设置时管理接口不可用
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+
+router = APIRouter(prefix="/admin")
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)) -> None:
+    """校验请求头 X-Admin-Token"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="管理接口未启用")
+    if x_admin_token is None or not secrets.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="无效的管理令牌")
+
+
+@router.get("/profile", dependencies=[Depends(require_admin)])
+async def profile_status():
+    """性能分析状态和最近一次结果的路径"""
+    return default_profiler.status()
+
+
+@router.post("/profile", dependencies=[Depends(require_admin)])
+async def start_profile(
+    commands: Optional[int] = Query(None, ge=1, le=100000),
+    seconds: Optional[float] = Query(None, gt=0, le=3600)
+):
+    """分析接下来的 commands 条命令或 seconds 秒，先满足的条件结束"""
+    try:
+        default_profiler.start(commands, seconds)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return default_profiler.status()
+
+
+@router.delete("/profile", dependencies=[Depends(require_admin)])
+async def stop_profile():
+    """提前结束分析并保存结果"""
+    output = default_profiler.stop()
+    await default_profiler.flush()
+    return {"output": output}
@@ -0,0 +1,86 @@
+from typing import AsyncIterator, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+
+from app import metrics
+from app.commands.fetch_command import FETCH_TIMEOUT, FetchCommand, FetchCommandData
+from app.commands.fetch_dispatcher import FetchDispatcher
+from app.exceptions import (
+    ChannelClosedError,
+    ExtensionUnavailableError,
+    FetchError,
+    FetchTimeoutError,
+)
+from app.models.message import CommandType
+from app.routes.auth import require_gateway
+from app.routes.chat import command_handler, session_registry
+from app.websocket.stream import DEFAULT_STREAM_WINDOW
+
+# 网关通过用户已登录的浏览器发送请求，所有接口都需要令牌
+router = APIRouter(prefix="/api", dependencies=[Depends(require_gateway)])
+
+
+def fetch_command() -> FetchCommand:
+    """与聊天命令共用的 FetchCommand，共享缓存和请求合并"""
+    return command_handler.get_command(CommandType.FETCH)
+
+
+# 在所有在线扩展之间分发请求
+fetch_dispatcher = FetchDispatcher(session_registry, fetch_command())
+
+
+def to_http_error(e: Exception) -> HTTPException:
+    """把获取数据的异常转换为 HTTP 状态码"""
+    metrics.record_error(e)
+    if isinstance(e, ExtensionUnavailableError):
+        return HTTPException(status_code=503, detail=str(e))
+    if isinstance(e, FetchTimeoutError):
+        return HTTPException(status_code=504, detail=str(e))
+    return HTTPException(status_code=502, detail=str(e))
+
+
+@router.post("/fetch")
+async def api_fetch(
+    data: FetchCommandData,
+    timeout: float = Query(FETCH_TIMEOUT, gt=0, le=600),
+    affinity: Optional[str] = Query(None, max_length=256),
+    retry: bool = False
+):
+    """通过在线的扩展发送请求并返回扩展的响应
+
+    affinity 相同的请求发给同一个扩展；扩展中途断开时幂等请求自动重试，
+    retry=true 时非幂等请求也重试。
+    """
+    try:
+        response = await fetch_dispatcher.fetch(data, timeout, affinity, retry_non_idempotent=retry)
+    except (FetchError, ChannelClosedError) as e:
+        raise to_http_error(e)
+    return {"request_id": response.request_id, "data": response.data}
+
+
+@router.post("/fetch/stream")
+async def api_fetch_stream(
+    data: FetchCommandData,
+    window: int = Query(DEFAULT_STREAM_WINDOW, ge=1, le=256),
+    affinity: Optional[str] = Query(None, max_length=256)
+):
+    """通过在线的扩展发送请求，响应体按分块流式返回"""
+    try:
+        stream = await fetch_dispatcher.fetch_stream(data, window, affinity)
+    except (FetchError, ChannelClosedError) as e:
+        raise to_http_error(e)
+
+    async def body() -> AsyncIterator[bytes]:
+        # 响应头发出后无法再改状态码，出错时直接中断响应
+        try:
+            async for chunk in stream:
+                yield chunk
+        finally:
+            await stream.aclose()
+
+    return StreamingResponse(
+        body(),
+        media_type="application/octet-stream",
+        headers={"X-Request-Id": stream.request_id}
+    )
@@ -0,0 +1,21 @@
+import os
+import secrets
+from typing import Optional
+
+from fastapi import Header, HTTPException
+
+# HTTP 网关和扩展注册的访问令牌，未设置时网关不可用，也不接受扩展连接
+GATEWAY_TOKEN = os.environ.get("GATEWAY_TOKEN", "")
+
+
+def check_gateway_token(token: Optional[str]) -> bool:
+    """令牌是否与 GATEWAY_TOKEN 一致"""
+    return bool(GATEWAY_TOKEN) and token is not None and secrets.compare_digest(token, GATEWAY_TOKEN)
+
+
+def require_gateway(x_gateway_token: Optional[str] = Header(None)) -> None:
+    """校验请求头 X-Gateway-Token"""
+    if not GATEWAY_TOKEN:
+        raise HTTPException(status_code=404, detail="网关未启用")
+    if not check_gateway_token(x_gateway_token):
+        raise HTTPException(status_code=403, detail="无效的网关令牌")
@@ -1,10 +1,32 @@
+import asyncio
+from typing import Set
 from fastapi import APIRouter, WebSocket
 from fastapi.responses import HTMLResponse
 from app.templates.chat import html
 from app.websocket.connection import WebSocketConnection
+from app.websocket.command_handler import CommandHandler
+from app.websocket.context import ChatContext, ContextManager
+from app.websocket.registry import CLIENT_EXTENSION, SessionRegistry
+from app.websocket.codec import negotiate_codec
+from app.routes.auth import check_gateway_token
+from app.storage.context_store import create_context_store
+from app.storage.history_store import create_history_store
 
 router = APIRouter()
-ws_connection = WebSocketConnection()
+context_manager = ContextManager(create_history_store(), context_store=create_context_store())
+command_handler = CommandHandler(context_manager)
+session_registry = SessionRegistry()
+_close_tasks: Set[asyncio.Task] = set()
+
+def close_evicted_session(conversation_id: str, context: ChatContext) -> None:
+    """对话被清理后断开对应的连接"""
+    session = session_registry.get(conversation_id)
+    if session is not None:
+        task = asyncio.create_task(session.close("会话长时间未活动，连接已断开"))
+        _close_tasks.add(task)
+        task.add_done_callback(_close_tasks.discard)
+
+context_manager.add_eviction_listener(close_evicted_session)
 
 @router.get("/")
 async def get():
@@ -12,4 +34,13 @@ async def get():
 
 @router.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    await ws_connection.handle_connection(websocket)
\ No newline at end of file
+    # 扩展连接会接收网关转发的请求，注册为扩展需要令牌（查询参数 token 或请求头 X-Gateway-Token）
+    if websocket.query_params.get("client") == CLIENT_EXTENSION:
+        token = websocket.query_params.get("token") or websocket.headers.get("x-gateway-token")
+        if not check_gateway_token(token):
+            await websocket.close(code=1008)
+            return
+    # 客户端可以通过子协议 chat.msgpack 切换为二进制编码，默认使用 JSON 文本
+    codec = negotiate_codec(websocket.scope.get("subprotocols", []))
+    connection = WebSocketConnection(context_manager, command_handler, session_registry, codec)
+    await connection.handle_connection(websocket)
\ No newline at end of file
@@ -0,0 +1,25 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from app import metrics
+from app.routes.chat import session_registry
+from app.websocket.registry import CLIENT_CHAT, CLIENT_EXTENSION
+
+router = APIRouter()
+
+CONNECTIONS = metrics.registry.gauge("ws_connections", "当前在线的连接数", ("kind",))
+
+
+def collect_connections() -> None:
+    """导出前按客户端类型统计在线连接数"""
+    for kind in (CLIENT_CHAT, CLIENT_EXTENSION):
+        CONNECTIONS.set(len(session_registry.get_by_kind(kind)), kind=kind)
+
+
+metrics.registry.add_collector(collect_connections)
+
+
+@router.get("/metrics")
+async def get_metrics():
+    """Prometheus 文本格式的指标"""
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
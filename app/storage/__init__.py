@@ -0,0 +1,31 @@
+from .context_store import (
+    ContextStore,
+    MemoryContextStore,
+    SQLiteContextStore,
+    UserRecord,
+    create_context_store,
+)
+from .history_store import (
+    BatchingHistoryWriter,
+    HistoryPage,
+    HistoryRecord,
+    HistoryStore,
+    MemoryHistoryStore,
+    SQLiteHistoryStore,
+    create_history_store,
+)
+
+__all__ = [
+    'ContextStore',
+    'MemoryContextStore',
+    'SQLiteContextStore',
+    'UserRecord',
+    'create_context_store',
+    'BatchingHistoryWriter',
+    'HistoryPage',
+    'HistoryRecord',
+    'HistoryStore',
+    'MemoryHistoryStore',
+    'SQLiteHistoryStore',
+    'create_history_store',
+]
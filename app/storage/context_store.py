@@ -0,0 +1,331 @@
+import asyncio
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+
+class UserRecord(NamedTuple):
+    user_id: str
+    username: str
+    connected_at: datetime
+    last_active: datetime
+    message_count: int
+
+
+class ContextStore(ABC):
+    """用户和对话信息的存储，多个进程共享同一个存储时可以看到彼此的用户和对话
+
+    消息计数通过 record_activity 累积，由 flush 批量写回。
+    record_activity 在每条消息上调用，只修改内存；其余操作可能访问数据库，都是协程。
+    """
+
+    @abstractmethod
+    async def get_user(self, user_id: str) -> Optional[UserRecord]:
+        """读取用户信息，包含尚未写回的计数"""
+
+    @abstractmethod
+    async def save_user(self, record: UserRecord) -> None:
+        """新建用户或更新用户名，计数字段只在新建时写入"""
+
+    @abstractmethod
+    def record_activity(self, user_id: str, messages: int, last_active: datetime) -> None:
+        """累积用户的消息数和最近活跃时间"""
+
+    @abstractmethod
+    async def add_conversation(self, conversation_id: str, user_id: str, started_at: datetime) -> None:
+        """记录对话"""
+
+    @abstractmethod
+    async def remove_conversation(self, conversation_id: str) -> None:
+        """删除对话记录"""
+
+    @abstractmethod
+    async def touch_conversations(self, conversation_ids: List[str], now: datetime) -> None:
+        """刷新本进程仍在进行的对话，长时间没有刷新的对话视为已失效"""
+
+    @abstractmethod
+    async def delete_idle_users(self, before: datetime) -> int:
+        """删除 before 之前没有刷新过的对话（例如崩溃的 worker 留下的），
+        再删除没有对话且在 before 之前不再活跃的用户，返回删除的用户数"""
+
+    async def flush(self) -> None:
+        """写回累积的计数"""
+
+    async def close(self) -> None:
+        """写回计数并释放资源"""
+        await self.flush()
+
+
+class MemoryContextStore(ContextStore):
+    """进程内存中的存储，只在单个进程内共享"""
+    def __init__(self):
+        self.users: Dict[str, UserRecord] = {}
+        self.conversations: Dict[str, str] = {}
+
+    async def get_user(self, user_id: str) -> Optional[UserRecord]:
+        return self.users.get(user_id)
+
+    async def save_user(self, record: UserRecord) -> None:
+        current = self.users.get(record.user_id)
+        self.users[record.user_id] = current._replace(username=record.username) if current else record
+
+    def record_activity(self, user_id: str, messages: int, last_active: datetime) -> None:
+        current = self.users.get(user_id)
+        if current is not None:
+            self.users[user_id] = current._replace(
+                message_count=current.message_count + messages,
+                last_active=max(current.last_active, last_active)
+            )
+
+    async def add_conversation(self, conversation_id: str, user_id: str, started_at: datetime) -> None:
+        self.conversations[conversation_id] = user_id
+
+    async def remove_conversation(self, conversation_id: str) -> None:
+        self.conversations.pop(conversation_id, None)
+
+    async def touch_conversations(self, conversation_ids: List[str], now: datetime) -> None:
+        # 只在本进程内共享，对话随进程一起消失，不会残留
+        pass
+
+    async def delete_idle_users(self, before: datetime) -> int:
+        in_use = set(self.conversations.values())
+        idle = [
+            user_id for user_id, record in self.users.items()
+            if user_id not in in_use and record.last_active < before
+        ]
+        for user_id in idle:
+            del self.users[user_id]
+        return len(idle)
+
+
+class SQLiteContextStore(ContextStore):
+    """SQLite 存储，同一台机器上的多个 worker 进程打开同一个数据库文件即可共享状态
+
+    所有数据库操作在单独的线程中串行执行，其他进程持有写锁时只阻塞该线程，不阻塞事件循环。
+    读取经过本地缓存。每次读取前检查 PRAGMA data_version，其他连接提交过写入时清空缓存；
+    本连接自己的写入同时更新缓存，不会使缓存失效。缓存只在存储线程中访问。
+    消息计数先累积在内存中，由 flush 在一个事务中写回，避免每条消息一次写入。
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="context-store")
+        self._connection: Optional[sqlite3.Connection] = None
+        # 只保护 _pending：record_activity 在事件循环中调用，不能等待数据库操作
+        self._lock = threading.Lock()
+        self._cache: Dict[str, UserRecord] = {}
+        self._data_version = 0
+        self._pending: Dict[str, Tuple[int, datetime]] = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA busy_timeout=5000")
+            connection.executescript(
+                "CREATE TABLE IF NOT EXISTS users ("
+                " user_id TEXT PRIMARY KEY,"
+                " username TEXT NOT NULL,"
+                " connected_at REAL NOT NULL,"
+                " last_active REAL NOT NULL,"
+                " message_count INTEGER NOT NULL DEFAULT 0"
+                ");"
+                "CREATE TABLE IF NOT EXISTS conversations ("
+                " conversation_id TEXT PRIMARY KEY,"
+                " user_id TEXT NOT NULL,"
+                " started_at REAL NOT NULL,"
+                " last_seen REAL NOT NULL DEFAULT 0"
+                ");"
+                "CREATE INDEX IF NOT EXISTS conversations_user ON conversations (user_id);"
+            )
+            columns = {row[1] for row in connection.execute("PRAGMA table_info(conversations)")}
+            if "last_seen" not in columns:
+                # 旧版本创建的数据库
+                connection.execute("ALTER TABLE conversations ADD COLUMN last_seen REAL NOT NULL DEFAULT 0")
+            self._connection = connection
+            self._data_version = self._read_data_version(connection)
+        return self._connection
+
+    async def _run(self, func: Callable[[sqlite3.Connection], Any]) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: func(self._connect()))
+
+    @staticmethod
+    def _read_data_version(connection: sqlite3.Connection) -> int:
+        return connection.execute("PRAGMA data_version").fetchone()[0]
+
+    def _validate_cache(self, connection: sqlite3.Connection) -> None:
+        version = self._read_data_version(connection)
+        if version != self._data_version:
+            self._cache.clear()
+            self._data_version = version
+
+    async def get_user(self, user_id: str) -> Optional[UserRecord]:
+        def read(connection: sqlite3.Connection) -> Optional[UserRecord]:
+            self._validate_cache(connection)
+            record = self._cache.get(user_id)
+            if record is not None:
+                self.cache_hits += 1
+                return record
+            self.cache_misses += 1
+            row = connection.execute(
+                "SELECT user_id, username, connected_at, last_active, message_count"
+                " FROM users WHERE user_id = ?",
+                (user_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            record = UserRecord(
+                row[0], row[1],
+                datetime.fromtimestamp(row[2]), datetime.fromtimestamp(row[3]),
+                row[4]
+            )
+            self._cache[user_id] = record
+            return record
+
+        record = await self._run(read)
+        if record is None:
+            return None
+        with self._lock:
+            pending = self._pending.get(user_id)
+        if pending is not None:
+            record = record._replace(
+                message_count=record.message_count + pending[0],
+                last_active=max(record.last_active, pending[1])
+            )
+        return record
+
+    async def save_user(self, record: UserRecord) -> None:
+        def write(connection: sqlite3.Connection) -> None:
+            connection.execute(
+                "INSERT INTO users (user_id, username, connected_at, last_active, message_count)"
+                " VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT (user_id) DO UPDATE SET username = excluded.username",
+                (
+                    record.user_id, record.username,
+                    record.connected_at.timestamp(), record.last_active.timestamp(),
+                    record.message_count
+                )
+            )
+            # 计数以数据库为准，未缓存的用户下次读取时从数据库加载
+            cached = self._cache.get(record.user_id)
+            if cached is not None:
+                self._cache[record.user_id] = cached._replace(username=record.username)
+
+        await self._run(write)
+
+    def record_activity(self, user_id: str, messages: int, last_active: datetime) -> None:
+        with self._lock:
+            count, active = self._pending.get(user_id, (0, last_active))
+            self._pending[user_id] = (count + messages, max(active, last_active))
+
+    def _flush(self, connection: sqlite3.Connection) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        rows: List[Tuple[int, float, str]] = [
+            (count, active.timestamp(), user_id) for user_id, (count, active) in pending.items()
+        ]
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.executemany(
+                "UPDATE users SET message_count = message_count + ?,"
+                " last_active = MAX(last_active, ?) WHERE user_id = ?",
+                rows
+            )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            # 写入失败时把计数合并回去，下次重试
+            with self._lock:
+                for user_id, (count, active) in pending.items():
+                    current, latest = self._pending.get(user_id, (0, active))
+                    self._pending[user_id] = (current + count, max(latest, active))
+            raise
+        for user_id, (count, active) in pending.items():
+            cached = self._cache.get(user_id)
+            if cached is not None:
+                self._cache[user_id] = cached._replace(
+                    message_count=cached.message_count + count,
+                    last_active=max(cached.last_active, active)
+                )
+
+    async def flush(self) -> None:
+        await self._run(self._flush)
+
+    async def add_conversation(self, conversation_id: str, user_id: str, started_at: datetime) -> None:
+        def write(connection: sqlite3.Connection) -> None:
+            connection.execute(
+                "INSERT OR REPLACE INTO conversations (conversation_id, user_id, started_at, last_seen)"
+                " VALUES (?, ?, ?, ?)",
+                (conversation_id, user_id, started_at.timestamp(), started_at.timestamp())
+            )
+
+        await self._run(write)
+
+    async def remove_conversation(self, conversation_id: str) -> None:
+        def write(connection: sqlite3.Connection) -> None:
+            connection.execute("DELETE FROM conversations WHERE conversation_id = ?", (conversation_id,))
+
+        await self._run(write)
+
+    async def touch_conversations(self, conversation_ids: List[str], now: datetime) -> None:
+        if not conversation_ids:
+            return
+
+        def write(connection: sqlite3.Connection) -> None:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.executemany(
+                    "UPDATE conversations SET last_seen = ? WHERE conversation_id = ?",
+                    [(now.timestamp(), conversation_id) for conversation_id in conversation_ids]
+                )
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+
+        await self._run(write)
+
+    async def delete_idle_users(self, before: datetime) -> int:
+        def delete(connection: sqlite3.Connection) -> int:
+            self._flush(connection)
+            # 存活的 worker 每次清理时都会刷新自己的对话，过期未刷新的是已退出的 worker 留下的
+            connection.execute("DELETE FROM conversations WHERE last_seen < ?", (before.timestamp(),))
+            cursor = connection.execute(
+                "DELETE FROM users WHERE last_active < ?"
+                " AND user_id NOT IN (SELECT user_id FROM conversations)",
+                (before.timestamp(),)
+            )
+            if cursor.rowcount:
+                self._cache.clear()
+            return cursor.rowcount
+
+        return await self._run(delete)
+
+    async def close(self) -> None:
+        def close(connection: sqlite3.Connection) -> None:
+            try:
+                self._flush(connection)
+            finally:
+                connection.close()
+
+        if self._connection is not None or self._pending:
+            await self._run(close)
+            self._connection = None
+        self._executor.shutdown(wait=False)
+
+
+def create_context_store() -> Optional[ContextStore]:
+    """按环境变量创建上下文存储，设置 CHAT_CONTEXT_DB 时使用该路径的 SQLite 数据库"""
+    path = os.environ.get("CHAT_CONTEXT_DB")
+    if path:
+        return SQLiteContextStore(path)
+    return None
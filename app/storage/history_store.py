@@ -0,0 +1,249 @@
+import asyncio
+import logging
+import os
+import sqlite3
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from app.models.message import Message, parse_json
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryRecord(NamedTuple):
+    conversation_id: str
+    seq: int
+    message: Message
+
+
+class HistoryPage(NamedTuple):
+    """一页历史消息，按时间顺序排列；next_cursor 用于读取更早的一页，没有更多时为 None"""
+    messages: List[Tuple[int, Message]]
+    next_cursor: Optional[int]
+
+
+class HistoryStore(ABC):
+    """历史消息存储"""
+
+    @abstractmethod
+    async def append_many(self, records: List[HistoryRecord]) -> None:
+        """批量写入消息"""
+
+    @abstractmethod
+    async def page(self, conversation_id: str, limit: int, before: Optional[int] = None) -> HistoryPage:
+        """读取序号小于 before 的最近 limit 条消息"""
+
+    @abstractmethod
+    async def delete_conversation(self, conversation_id: str) -> None:
+        """删除对话的全部消息"""
+
+    async def close(self) -> None:
+        """释放资源"""
+
+
+class MemoryHistoryStore(HistoryStore):
+    """进程内存中的历史存储，用于测试和本地调试"""
+    def __init__(self):
+        self._records: Dict[str, List[Tuple[int, Message]]] = {}
+
+    async def append_many(self, records: List[HistoryRecord]) -> None:
+        for record in records:
+            self._records.setdefault(record.conversation_id, []).append((record.seq, record.message))
+
+    async def page(self, conversation_id: str, limit: int, before: Optional[int] = None) -> HistoryPage:
+        records = self._records.get(conversation_id, [])
+        if before is not None:
+            records = [record for record in records if record[0] < before]
+        return _make_page(records[-limit:] if limit > 0 else [], len(records) > limit > 0)
+
+    async def delete_conversation(self, conversation_id: str) -> None:
+        self._records.pop(conversation_id, None)
+
+
+class SQLiteHistoryStore(HistoryStore):
+    """SQLite 历史存储
+
+    使用 WAL 模式，所有数据库操作在单独的线程中串行执行，不阻塞事件循环。
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-store")
+        self._connection: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            connection = sqlite3.connect(self.path)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS history ("
+                " conversation_id TEXT NOT NULL,"
+                " seq INTEGER NOT NULL,"
+                " payload TEXT NOT NULL,"
+                " PRIMARY KEY (conversation_id, seq)"
+                ") WITHOUT ROWID"
+            )
+            self._connection = connection
+        return self._connection
+
+    async def _run(self, func: Callable[[sqlite3.Connection], Any]) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: func(self._connect()))
+
+    async def append_many(self, records: List[HistoryRecord]) -> None:
+        def write(connection: sqlite3.Connection) -> None:
+            # 序列化和写入一起在存储线程中完成，大批次也不占用事件循环
+            rows = [(record.conversation_id, record.seq, record.message.to_json()) for record in records]
+            with connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO history (conversation_id, seq, payload) VALUES (?, ?, ?)",
+                    rows
+                )
+
+        await self._run(write)
+
+    async def page(self, conversation_id: str, limit: int, before: Optional[int] = None) -> HistoryPage:
+        if limit <= 0:
+            return HistoryPage([], None)
+
+        def read(connection: sqlite3.Connection) -> List[Tuple[int, str]]:
+            return connection.execute(
+                "SELECT seq, payload FROM history WHERE conversation_id = ? AND seq < ?"
+                " ORDER BY seq DESC LIMIT ?",
+                (conversation_id, before if before is not None else 2 ** 62, limit + 1)
+            ).fetchall()
+
+        rows = await self._run(read)
+        has_more = len(rows) > limit
+        records = [(seq, Message(**parse_json(payload))) for seq, payload in reversed(rows[:limit])]
+        return _make_page(records, has_more)
+
+    async def delete_conversation(self, conversation_id: str) -> None:
+        def delete(connection: sqlite3.Connection) -> None:
+            with connection:
+                connection.execute("DELETE FROM history WHERE conversation_id = ?", (conversation_id,))
+
+        await self._run(delete)
+
+    async def close(self) -> None:
+        def close(connection: sqlite3.Connection) -> None:
+            connection.close()
+
+        if self._connection is not None:
+            await self._run(close)
+            self._connection = None
+        self._executor.shutdown(wait=False)
+
+
+def _make_page(records: List[Tuple[int, Message]], has_more: bool) -> HistoryPage:
+    return HistoryPage(records, records[0][0] if has_more and records else None)
+
+
+class BatchingHistoryWriter:
+    """批量写入历史消息
+
+    submit 只把消息放入队列，不会阻塞调用方；后台任务把队列中的消息攒成批次写入存储。
+    删除操作与写入操作按提交顺序执行。
+    """
+    def __init__(
+        self,
+        store: HistoryStore,
+        max_batch: int = 500,
+        flush_interval: float = 0.2,
+        max_queue: int = 100_000
+    ):
+        self.store = store
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.dropped = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _ensure_started(self) -> asyncio.Queue:
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue(self.max_queue)
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return self._queue
+
+    def submit(self, record: HistoryRecord) -> None:
+        """提交一条消息，队列已满时丢弃并计数"""
+        try:
+            self._ensure_started().put_nowait(record)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning("历史消息写入队列已满，丢弃消息: conversation_id=%s", record.conversation_id)
+
+    async def delete_conversation(self, conversation_id: str) -> None:
+        """在之前提交的消息写入后删除对话，队列已满时等待而不是丢弃"""
+        await self._ensure_started().put(("delete", conversation_id))
+
+    async def flush(self) -> None:
+        """等待此前提交的所有操作写入存储"""
+        if self._task is None or self._task.done():
+            return
+        done = asyncio.get_running_loop().create_future()
+        await self._queue.put(done)
+        await done
+
+    async def _run(self) -> None:
+        queue = self._queue
+        batch: List[HistoryRecord] = []
+        while True:
+            item = await queue.get()
+            waiters: List[asyncio.Future] = []
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + self.flush_interval
+            while True:
+                if isinstance(item, HistoryRecord):
+                    batch.append(item)
+                elif isinstance(item, asyncio.Future):
+                    waiters.append(item)
+                    break
+                else:
+                    # 删除前先写入已收集的消息，保持顺序
+                    await self._write(batch)
+                    batch = []
+                    await self._call(self.store.delete_conversation, item[1])
+                if len(batch) >= self.max_batch:
+                    break
+                try:
+                    item = await asyncio.wait_for(queue.get(), max(deadline - loop.time(), 0))
+                except asyncio.TimeoutError:
+                    break
+
+            await self._write(batch)
+            batch = []
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+
+    async def _write(self, batch: List[HistoryRecord]) -> None:
+        if batch:
+            await self._call(self.store.append_many, batch)
+
+    async def _call(self, func: Callable, *args: Any) -> None:
+        try:
+            await func(*args)
+        except Exception:
+            logger.exception("写入历史消息失败")
+
+    async def close(self) -> None:
+        """写入剩余消息并停止后台任务"""
+        await self.flush()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+def create_history_store() -> Optional[HistoryStore]:
+    """按环境变量创建历史存储，设置 CHAT_HISTORY_DB 时使用该路径的 SQLite 数据库"""
+    path = os.environ.get("CHAT_HISTORY_DB")
+    if path:
+        return SQLiteHistoryStore(path)
+    return None
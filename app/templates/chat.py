@@ -30,16 +30,42 @@ html = """
         <ul id='messages'>
         </ul>
         <script>
-            var ws = new WebSocket("ws://localhost:8000/ws");
+            // 重连时带上服务端分配的用户ID，保留用户名和消息计数
+            var userId = localStorage.getItem("chatUserId");
+            var ws = new WebSocket("ws://localhost:8000/ws" + (userId ? "?user_id=" + encodeURIComponent(userId) : ""));
+            // 服务端请求参数时记录请求ID，下一条输入作为参数回复
+            var paramRequestId = null;
             
             ws.onmessage = function(event) {
                 var messages = document.getElementById('messages')
                 var message = document.createElement('li')
                 var data = JSON.parse(event.data)
+                var text = data.content
+
+                // 回复心跳，不显示
+                if (data.command === 'ping') {
+                    ws.send(JSON.stringify({
+                        type: "pong",
+                        role: "user",
+                        content: "",
+                        sender: document.getElementById("username").value,
+                        request_id: data.request_id
+                    }))
+                    return
+                }
+                
+                if (data.data && data.data.user_id) {
+                    localStorage.setItem("chatUserId", data.data.user_id)
+                }
+
+                if (data.command === 'params_request') {
+                    paramRequestId = data.request_id
+                    text = `请输入参数 ${data.data.param_name} (${data.data.description})`
+                }
                 
                 message.className = `${data.type} ${data.role}`
                 var time = new Date(data.timestamp).toLocaleTimeString()
-                var content = document.createTextNode(`[${time}] ${data.sender}: ${data.content}`)
+                var content = document.createTextNode(`[${time}] ${data.sender}: ${text}`)
                 
                 message.appendChild(content)
                 messages.appendChild(message)
@@ -62,6 +88,10 @@ html = """
                         content: input.value,
                         sender: username.value
                     }
+                    if (paramRequestId) {
+                        message.request_id = paramRequestId
+                        paramRequestId = null
+                    }
                     ws.send(JSON.stringify(message))
                     input.value = ''
                 }
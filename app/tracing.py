@@ -0,0 +1,268 @@
+import asyncio
+import atexit
+import contextvars
+import cProfile
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# 追踪结果写入的 JSONL 文件，未设置时不记录追踪
+TRACE_FILE = os.environ.get("TRACE_FILE", "")
+# 记录追踪的命令比例
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "1"))
+# 性能分析结果的保存目录
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+
+
+class Span:
+    """一段计时区间，同一次命令处理的所有区间共用 trace_id"""
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "attrs", "start", "duration", "error")
+
+    def __init__(self, trace_id: str, parent_id: Optional[str], name: str, attrs: Dict[str, Any]):
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.attrs = attrs
+        self.start = time.time()
+        self.duration = 0.0
+        self.error: Optional[str] = None
+
+    def set(self, **attrs: Any) -> None:
+        """补充区间属性"""
+        self.attrs.update(attrs)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": round(self.duration * 1000, 3),
+            "attrs": self.attrs,
+            "error": self.error
+        }
+
+
+class SpanSink(ABC):
+    """追踪结果的输出"""
+
+    @abstractmethod
+    def export(self, span: Span) -> None:
+        """输出一个已结束的区间，在事件循环中调用，不能阻塞"""
+
+    def close(self) -> None:
+        """写完剩余的区间并释放资源"""
+
+
+class MemorySpanSink(SpanSink):
+    """保存在内存中，用于测试"""
+    def __init__(self):
+        self.spans: List[Span] = []
+
+    def export(self, span: Span) -> None:
+        self.spans.append(span)
+
+
+class JsonlSpanSink(SpanSink):
+    """每个区间写为 JSONL 文件的一行
+
+    事件循环只把区间放入队列，序列化和写文件在后台线程完成。
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._queue: "queue.SimpleQueue[Optional[Span]]" = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._write_loop, name="span-writer", daemon=True)
+        self._thread.start()
+
+    def export(self, span: Span) -> None:
+        self._queue.put(span)
+
+    def _write_loop(self) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            while True:
+                span = self._queue.get()
+                if span is None:
+                    return
+                f.write(json.dumps(span.to_dict(), ensure_ascii=False, default=str))
+                f.write("\n")
+                # 队列暂时为空时落盘
+                if self._queue.empty():
+                    f.flush()
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._thread.join()
+
+
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+
+class Tracer:
+    """基于 contextvars 的轻量追踪
+
+    区间的父子关系随 asyncio 任务的上下文传递。没有设置输出，
+    或者根区间未被采样时，span() 不创建任何对象，开销只有一次上下文变量读取。
+    """
+    def __init__(self, sink: Optional[SpanSink] = None, sample_rate: float = TRACE_SAMPLE_RATE):
+        self.sink = sink
+        self.sample_rate = sample_rate
+
+    @contextmanager
+    def span(self, name: str, /, **attrs: Any) -> Iterator[Optional[Span]]:
+        """记录一段区间；不在采样范围内时返回 None"""
+        parent = _current_span.get()
+        if self.sink is None or (parent is None and random.random() >= self.sample_rate):
+            yield None
+            return
+
+        trace_id = parent.trace_id if parent is not None else uuid.uuid4().hex
+        span = Span(trace_id, parent.span_id if parent is not None else None, name, attrs)
+        token = _current_span.set(span)
+        started = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span.error = type(e).__name__
+            raise
+        finally:
+            span.duration = time.perf_counter() - started
+            _current_span.reset(token)
+            try:
+                self.sink.export(span)
+            except Exception:
+                logger.exception("导出追踪区间失败")
+
+    def close(self) -> None:
+        if self.sink is not None:
+            self.sink.close()
+
+
+def create_tracer() -> Tracer:
+    """根据 TRACE_FILE 环境变量创建追踪器"""
+    return Tracer(JsonlSpanSink(TRACE_FILE) if TRACE_FILE else None)
+
+
+def current_span() -> Optional[Span]:
+    """当前上下文中的区间"""
+    return _current_span.get()
+
+
+class CommandProfiler:
+    """按需对命令处理做 cProfile 性能分析
+
+    开启后分析接下来的 N 条命令或 T 秒，先满足的条件结束分析，
+    结果以 pstats 格式保存到 PROFILE_DIR，可用 python -m pstats 或 snakeviz 查看。
+    分析期间整个事件循环线程都被记录，结果中也包含同时处理的其他连接。
+    在事件循环中结束分析时，结果在后台线程写入文件，可以用 flush 等待写完。
+    """
+    def __init__(self, output_dir: str = PROFILE_DIR):
+        self.output_dir = output_dir
+        self.last_output: Optional[str] = None
+        self._profile: Optional[cProfile.Profile] = None
+        self._remaining: Optional[int] = None
+        self._deadline: Optional[float] = None
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._lock = threading.Lock()
+        self._saving: Set[asyncio.Task] = set()
+
+    @property
+    def active(self) -> bool:
+        return self._profile is not None
+
+    def start(self, commands: Optional[int] = None, seconds: Optional[float] = None) -> None:
+        """开始分析，commands 和 seconds 至少指定一个
+
+        Raises:
+            RuntimeError: 已经在分析中
+            ValueError: 没有指定结束条件
+        """
+        if commands is None and seconds is None:
+            raise ValueError("需要指定命令数或时长")
+        with self._lock:
+            if self._profile is not None:
+                raise RuntimeError("性能分析已在进行中")
+            self._remaining = commands
+            self._deadline = time.monotonic() + seconds if seconds is not None else None
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        if seconds is not None:
+            # 没有命令时也按时结束
+            try:
+                self._timer = asyncio.get_running_loop().call_later(seconds, self.stop)
+            except RuntimeError:
+                self._timer = None
+
+    def command_finished(self) -> None:
+        """每条命令处理结束后调用，达到结束条件时保存结果"""
+        if self._profile is None:
+            return
+        if self._remaining is not None:
+            self._remaining -= 1
+        if (self._remaining is not None and self._remaining <= 0) or self.expired():
+            self.stop()
+
+    def expired(self) -> bool:
+        return self._deadline is not None and time.monotonic() >= self._deadline
+
+    def stop(self) -> Optional[str]:
+        """结束分析并保存结果，返回文件路径；未在分析时返回 None
+
+        在事件循环中调用时立即返回，结果在后台线程写入。
+        """
+        with self._lock:
+            profile, self._profile = self._profile, None
+            if profile is None:
+                return None
+            profile.disable()
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        path = os.path.join(self.output_dir, f"profile-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.prof")
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._save(profile, path)
+            return path
+        task = loop.create_task(asyncio.to_thread(self._save, profile, path))
+        self._saving.add(task)
+        task.add_done_callback(self._saving.discard)
+        return path
+
+    def _save(self, profile: cProfile.Profile, path: str) -> None:
+        os.makedirs(self.output_dir, exist_ok=True)
+        profile.dump_stats(path)
+        self.last_output = path
+        logger.info("性能分析结果已保存: %s", path)
+
+    async def flush(self) -> None:
+        """等待后台写入的结果写完"""
+        if self._saving:
+            await asyncio.gather(*self._saving, return_exceptions=True)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "active": self.active,
+            "remaining_commands": self._remaining if self.active else None,
+            "remaining_seconds": max(0.0, self._deadline - time.monotonic()) if self.active and self._deadline else None,
+            "last_output": self.last_output
+        }
+
+
+# 全局追踪器和性能分析器
+default_tracer = create_tracer()
+default_profiler = CommandProfiler()
+
+# 退出前写完队列中剩余的区间
+atexit.register(default_tracer.close)
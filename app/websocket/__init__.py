@@ -1,3 +1,4 @@
 from .connection import WebSocketConnection
+from .registry import SessionRegistry
 
-__all__ = ['WebSocketConnection'] 
\ No newline at end of file
+__all__ = ['WebSocketConnection', 'SessionRegistry'] 
\ No newline at end of file
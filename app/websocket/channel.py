@@ -0,0 +1,391 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from fastapi import WebSocket, WebSocketDisconnect
+from app import metrics
+from app.exceptions import ChannelClosedError, MessageFormatError, RequestTimeoutError
+from app.models.message import CommandType, Message, MessageType
+from .codec import Frame, MessageCodec
+from .stream import DEFAULT_STREAM_WINDOW, FetchStream
+
+logger = logging.getLogger(__name__)
+
+# 等待中请求的类型
+REQUEST_FETCH = "fetch"
+REQUEST_PARAMS = "params"
+REQUEST_PING = "ping"
+
+# 发送队列满时的处理策略：等待、丢弃低优先级消息、断开连接
+POLICY_BLOCK = "block"
+POLICY_DROP_LOW = "drop_low"
+POLICY_DISCONNECT = "disconnect"
+# 消息优先级，低优先级消息在 drop_low 策略下可以被丢弃
+PRIORITY_NORMAL = 0
+PRIORITY_LOW = 1
+
+# 每个连接发送队列的容量
+SEND_QUEUE_SIZE = int(os.environ.get("WS_SEND_QUEUE_SIZE", "256"))
+SEND_POLICY = os.environ.get("WS_SEND_POLICY", POLICY_BLOCK)
+# 写入任务一次从队列中取出的最大消息数
+SEND_BATCH_SIZE = int(os.environ.get("WS_SEND_BATCH_SIZE", "64"))
+# 关闭连接前等待发送队列清空的时间（秒）
+SEND_DRAIN_TIMEOUT = 1.0
+
+SEND_QUEUE_DEPTH = metrics.registry.gauge("ws_send_queue_depth", "所有连接发送队列中等待的消息数")
+DROPPED_FRAMES = metrics.registry.counter("ws_dropped_frames_total", "发送队列满时丢弃的消息数", ("reason",))
+FRAMES = metrics.registry.counter("ws_frames_total", "按方向和消息类型统计的消息数", ("direction", "type"))
+# 客户端发来的类型不在此集合中时统一记为 unknown，避免标签取值无限增长
+_MESSAGE_TYPES = frozenset(message_type.value for message_type in MessageType)
+
+
+class WebSocketChannel:
+    """WebSocket 收发通道
+
+    每个连接一个通道。通道内由唯一的读取任务接收并解码消息，按类型和请求ID分发：
+    带请求ID的回复交给等待中的请求（获取数据响应、参数回复），
+    其余消息放入收件箱供 receive_json 读取。
+    同一连接上可以同时有多个请求在等待回复，回复可以乱序返回。
+    消息的编码由握手时协商的 codec 决定，调用方不需要关心具体编码。
+
+    发送同样由唯一的写入任务完成：send_* 只把消息放入有界队列，客户端接收慢时不会拖住发送方，
+    并发发送的消息也按入队顺序整条写出。队列满时按 send_policy 等待、丢弃低优先级消息或断开连接。
+    """
+    def __init__(
+        self,
+        websocket: WebSocket,
+        codec: Optional[MessageCodec] = None,
+        send_queue_size: int = SEND_QUEUE_SIZE,
+        send_policy: str = SEND_POLICY
+    ):
+        self.websocket = websocket
+        self.codec = codec if codec is not None else MessageCodec()
+        self.pending_requests: Dict[str, asyncio.Future] = {}
+        self._request_kinds: Dict[str, str] = {}
+        self.streams: Dict[str, FetchStream] = {}
+        self._inbox: asyncio.Queue = asyncio.Queue()
+        self._reader_task: Optional[asyncio.Task] = None
+        self.send_policy = send_policy
+        self._send_queue: asyncio.Queue = asyncio.Queue(send_queue_size)
+        self._writer_task: Optional[asyncio.Task] = None
+        self._send_error: Optional[ChannelClosedError] = None
+        # 最近一次收到消息的时间，任何消息都说明连接仍然可用
+        self.last_received = time.monotonic()
+        # 每收到一条消息调用一次，由连接用来刷新对话的活跃时间
+        self.on_receive: Optional[Callable[[], None]] = None
+        # 最近一次和平滑后的心跳往返时间（秒）
+        self.rtt: Optional[float] = None
+        self.rtt_avg: Optional[float] = None
+
+    async def accept(self) -> None:
+        """接受连接并启动读取任务，客户端请求了协商出的子协议时在握手中确认"""
+        requested = getattr(self.websocket, "scope", {}).get("subprotocols") or []
+        subprotocol = self.codec.subprotocol if self.codec.subprotocol in requested else None
+        await self.websocket.accept(subprotocol=subprotocol)
+        self._reader_task = asyncio.create_task(self._read_loop())
+
+    async def send_message(self, message: Message, priority: int = PRIORITY_NORMAL) -> int:
+        """按连接的编码发送消息，返回编码后的长度，保存到历史时不必再次序列化"""
+        FRAMES.inc(direction="outbound", type=message.type.value)
+        frame = self.codec.encode(message)
+        await self.send_frame(frame, priority)
+        return len(frame)
+
+    async def send_text(self, data: str, priority: int = PRIORITY_NORMAL) -> None:
+        """发送已序列化为 JSON 文本的消息，按连接的编码转换"""
+        await self.send_frame(self.codec.encode_text(data), priority)
+
+    async def send_frame(self, frame: Frame, priority: int = PRIORITY_NORMAL) -> None:
+        """把已编码的消息放入发送队列
+
+        Raises:
+            ChannelClosedError: 连接已关闭，或队列已满且策略为断开连接
+        """
+        if self._send_error is not None:
+            raise self._send_error
+        if self._writer_task is None:
+            self._writer_task = asyncio.create_task(self._write_loop())
+
+        if self._send_queue.full():
+            if self.send_policy == POLICY_DISCONNECT:
+                DROPPED_FRAMES.inc(reason="disconnect")
+                await self.abort(ChannelClosedError("客户端接收过慢，连接已断开"))
+                raise self._send_error
+            if self.send_policy == POLICY_DROP_LOW and priority >= PRIORITY_LOW:
+                DROPPED_FRAMES.inc(reason="queue_full")
+                return
+        await self._send_queue.put(frame)
+        SEND_QUEUE_DEPTH.inc()
+        if self._send_error is not None:
+            # 等待队列空间期间连接已关闭，消息不会再写出
+            raise self._send_error
+
+    def send_frame_nowait(self, frame: Frame) -> bool:
+        """不等待地把已编码的消息放入发送队列，队列已满时丢弃并返回 False
+
+        用于广播：无论连接的发送策略是什么，一个接收慢的成员都不能拖住其他成员和发送方。
+
+        Raises:
+            ChannelClosedError: 连接已关闭
+        """
+        if self._send_error is not None:
+            raise self._send_error
+        if self._writer_task is None:
+            self._writer_task = asyncio.create_task(self._write_loop())
+        try:
+            self._send_queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            DROPPED_FRAMES.inc(reason="queue_full")
+            return False
+        SEND_QUEUE_DEPTH.inc()
+        return True
+
+    @property
+    def closed(self) -> bool:
+        """连接是否已关闭，关闭后发送会抛出 ChannelClosedError"""
+        return self._send_error is not None
+
+    @property
+    def queue_depth(self) -> int:
+        """发送队列中等待的消息数"""
+        return self._send_queue.qsize()
+
+    async def _write_loop(self) -> None:
+        """写入任务：连接上唯一发送消息的地方，每次取出队列中已有的一批消息连续写出"""
+        queue = self._send_queue
+        try:
+            while True:
+                batch = [await queue.get()]
+                while len(batch) < SEND_BATCH_SIZE and not queue.empty():
+                    batch.append(queue.get_nowait())
+                SEND_QUEUE_DEPTH.dec(len(batch))
+                for frame in batch:
+                    if isinstance(frame, bytes):
+                        await self.websocket.send_bytes(frame)
+                    else:
+                        await self.websocket.send_text(frame)
+                    queue.task_done()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._send_error = ChannelClosedError(f"连接已关闭: {e!r}")
+            self._discard_queued()
+
+    def _discard_queued(self) -> None:
+        """丢弃发送队列中未写出的消息"""
+        queue = self._send_queue
+        while not queue.empty():
+            queue.get_nowait()
+            queue.task_done()
+            SEND_QUEUE_DEPTH.dec()
+
+    async def _stop_writer(self) -> None:
+        if self._writer_task is not None and not self._writer_task.done():
+            self._writer_task.cancel()
+            try:
+                await self._writer_task
+            except (asyncio.CancelledError, Exception):
+                pass
+        self._discard_queued()
+
+    async def abort(self, exc: ChannelClosedError) -> None:
+        """丢弃未发送的消息并立即关闭连接，等待中的请求和 receive_json 都以 exc 结束"""
+        if self._send_error is None:
+            self._send_error = exc
+        await self._stop_writer()
+        if self._reader_task and not self._reader_task.done():
+            self._reader_task.cancel()
+        self.fail_pending(exc)
+        self._inbox.put_nowait(exc)
+        try:
+            await self.websocket.close(code=1008)
+        except Exception:
+            pass
+
+    async def receive_json(self) -> Any:
+        """接收下一条不属于任何等待中请求的消息
+
+        Raises:
+            MessageFormatError: 消息无法解码
+        """
+        data = await self._inbox.get()
+        if isinstance(data, MessageFormatError):
+            raise data
+        if isinstance(data, BaseException):
+            # 保留断线异常，后续调用同样抛出
+            self._inbox.put_nowait(data)
+            raise data
+        return data
+
+    def create_request(self, kind: str = REQUEST_FETCH) -> Tuple[str, asyncio.Future]:
+        """登记一个等待回复的请求，返回请求ID和对应的 Future"""
+        request_id = uuid.uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        self.pending_requests[request_id] = future
+        self._request_kinds[request_id] = kind
+        return request_id, future
+
+    def discard_request(self, request_id: str) -> None:
+        """移除等待中的请求"""
+        self.pending_requests.pop(request_id, None)
+        self._request_kinds.pop(request_id, None)
+
+    def open_stream(self, window: int = DEFAULT_STREAM_WINDOW) -> Tuple[str, FetchStream]:
+        """登记一个分块响应，返回请求ID和对应的流"""
+        request_id = uuid.uuid4().hex
+        stream = FetchStream(self, request_id, window)
+        self.streams[request_id] = stream
+        return request_id, stream
+
+    def close_stream(self, request_id: str) -> None:
+        """移除分块响应，之后到达的分块会被丢弃"""
+        self.streams.pop(request_id, None)
+
+    async def ping(self, timeout: Optional[float] = None) -> float:
+        """发送心跳并等待回复，返回往返时间（秒）
+
+        Raises:
+            RequestTimeoutError: 超时未收到回复
+        """
+        request_id, _ = self.create_request(REQUEST_PING)
+        started = time.monotonic()
+        try:
+            await self.send_message(Message.create_system_command(CommandType.PING, request_id=request_id))
+        except Exception:
+            self.discard_request(request_id)
+            raise
+        await self.wait_response(request_id, timeout)
+        rtt = time.monotonic() - started
+        self.rtt = rtt
+        self.rtt_avg = rtt if self.rtt_avg is None else self.rtt_avg + 0.2 * (rtt - self.rtt_avg)
+        return rtt
+
+    async def wait_response(self, request_id: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """等待指定请求的回复
+
+        Raises:
+            ChannelClosedError: 连接已关闭，请求随之失败
+            RequestTimeoutError: 超时未收到回复
+        """
+        future = self.pending_requests.get(request_id)
+        if future is None:
+            if self._send_error is not None:
+                # 发送请求期间连接已关闭，等待中的请求已被清空
+                raise self._send_error
+            raise KeyError(request_id)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise RequestTimeoutError(f"请求 {request_id} 等待回复超时")
+        finally:
+            self.discard_request(request_id)
+
+    def dispatch(self, message_data: Any) -> None:
+        """分发一条已解码的消息"""
+        if not isinstance(message_data, dict):
+            FRAMES.inc(direction="inbound", type="unknown")
+            self._inbox.put_nowait(message_data)
+            return
+
+        request_id = message_data.get("request_id")
+        message_type = message_data.get("type")
+        FRAMES.inc(direction="inbound", type=message_type if message_type in _MESSAGE_TYPES else "unknown")
+        stream = self.streams.get(request_id) if request_id is not None else None
+        if stream is not None:
+            if message_type == MessageType.FETCH_CHUNK:
+                stream.feed(message_data.get("data") or {})
+            elif message_type == MessageType.FETCH_RESPONSE:
+                stream.feed_response(message_data.get("data"))
+            return
+        if message_type == MessageType.FETCH_CHUNK:
+            logger.debug("丢弃未匹配的分块: request_id=%s", request_id)
+            return
+
+        if request_id is None and message_type == MessageType.FETCH_RESPONSE:
+            # 兼容不回传请求ID的客户端：交给最早发出的获取数据请求
+            request_id = next(
+                (rid for rid, kind in self._request_kinds.items() if kind == REQUEST_FETCH),
+                None
+            )
+
+        if request_id is None:
+            self._inbox.put_nowait(message_data)
+            return
+
+        future = self.pending_requests.get(request_id)
+        self.discard_request(request_id)
+        if future is None:
+            # 已超时或未知请求的迟到回复，不能当作普通消息处理
+            logger.debug("丢弃未匹配的回复: request_id=%s", request_id)
+        elif not future.done():
+            future.set_result(message_data)
+
+    def fail_pending(self, exc: Optional[BaseException] = None) -> None:
+        """让所有等待中的请求失败"""
+        exc = exc or ChannelClosedError("连接已关闭")
+        pending, self.pending_requests = self.pending_requests, {}
+        self._request_kinds = {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(exc)
+                # 请求可能还没开始等待就随发送失败被放弃，避免 "exception was never retrieved"
+                future.exception()
+        for stream in list(self.streams.values()):
+            stream.fail(exc)
+
+    async def _read_loop(self) -> None:
+        """读取任务：连接上唯一接收消息的地方，每条消息只解码一次"""
+        try:
+            while True:
+                frame = await self.receive_frame()
+                self.last_received = time.monotonic()
+                if self.on_receive is not None:
+                    self.on_receive()
+                try:
+                    message_data = self.codec.decode(frame)
+                except MessageFormatError as e:
+                    self._inbox.put_nowait(e)
+                    continue
+                self.dispatch(message_data)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            closed = ChannelClosedError(f"连接已关闭: {e!r}")
+            # 读取失败说明连接已断开，之后的发送直接失败而不是进入队列
+            if self._send_error is None:
+                self._send_error = closed
+            self.fail_pending(closed)
+            self._inbox.put_nowait(e)
+
+    async def receive_frame(self) -> Frame:
+        """接收一条文本或二进制消息"""
+        message = await self.websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+        if message.get("text") is not None:
+            return message["text"]
+        return message.get("bytes") or b""
+
+    async def close(self) -> None:
+        """写出发送队列中的消息，停止读写任务，结束等待中的请求并关闭连接"""
+        if self._writer_task is not None and self._send_error is None:
+            try:
+                await asyncio.wait_for(self._send_queue.join(), SEND_DRAIN_TIMEOUT)
+            except asyncio.TimeoutError:
+                pass
+        if self._send_error is None:
+            self._send_error = ChannelClosedError("连接已关闭")
+        await self._stop_writer()
+        if self._reader_task and not self._reader_task.done():
+            self._reader_task.cancel()
+            try:
+                await self._reader_task
+            except (asyncio.CancelledError, Exception):
+                pass
+        self.fail_pending()
+        # 唤醒仍在等待收件箱的 receive_json
+        self._inbox.put_nowait(ChannelClosedError("连接已关闭"))
+        await self.websocket.close()
@@ -0,0 +1,154 @@
+import json
+import os
+import zlib
+from typing import Any, Iterable, Optional, Union
+
+from app import metrics
+from app.exceptions import MessageFormatError
+from app.models.message import Message, parse_json
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - 未安装时只提供 JSON 编码
+    msgpack = None
+
+Frame = Union[str, bytes]
+
+JSON_SUBPROTOCOL = "chat.json"
+MSGPACK_SUBPROTOCOL = "chat.msgpack"
+# 在编码子协议后加上该后缀即可启用压缩，例如 chat.json+deflate
+DEFLATE_SUFFIX = "+deflate"
+
+# 超过该字节数的消息才压缩
+COMPRESSION_THRESHOLD = int(os.environ.get("WS_COMPRESSION_THRESHOLD", "4096"))
+# zlib 压缩级别 1-9
+COMPRESSION_LEVEL = int(os.environ.get("WS_COMPRESSION_LEVEL", "6"))
+# 解压后的最大字节数，防止压缩炸弹
+MAX_DECOMPRESSED_SIZE = 64 * 1024 * 1024
+# zlib 数据的首字节（CMF，deflate + 32K 窗口），JSON 文本和 MessagePack 映射都不会以它开头
+ZLIB_HEADER = 0x78
+
+COMPRESSED_FRAMES = metrics.registry.counter(
+    "ws_compressed_frames_total", "压缩传输的消息数", ("direction",)
+)
+COMPRESSION_SAVED_BYTES = metrics.registry.counter(
+    "ws_compression_saved_bytes_total", "压缩节省的字节数", ("direction",)
+)
+
+
+class MessageCodec:
+    """消息编码：JSON 文本，连接默认使用的编码"""
+    subprotocol: Optional[str] = JSON_SUBPROTOCOL
+
+    def encode(self, message: Message) -> Frame:
+        """编码消息"""
+        return message.to_json()
+
+    def encode_text(self, text: str) -> Frame:
+        """编码已经序列化为 JSON 文本的消息"""
+        return text
+
+    def decode(self, frame: Frame) -> Any:
+        """解码收到的消息
+
+        Raises:
+            MessageFormatError: 消息格式错误
+        """
+        try:
+            return parse_json(frame)
+        except json.JSONDecodeError as e:
+            raise MessageFormatError(f"消息格式错误: {e}") from e
+
+
+class MsgPackCodec(MessageCodec):
+    """消息编码：MessagePack 二进制，字段与 JSON 编码相同"""
+    subprotocol = MSGPACK_SUBPROTOCOL
+
+    def encode(self, message: Message) -> Frame:
+        return msgpack.packb(message.to_dict())
+
+    def encode_text(self, text: str) -> Frame:
+        return msgpack.packb(parse_json(text))
+
+    def decode(self, frame: Frame) -> Any:
+        if isinstance(frame, str):
+            # 兼容仍然发送 JSON 文本的客户端
+            return super().decode(frame)
+        try:
+            return msgpack.unpackb(frame, raw=False)
+        except Exception as e:
+            raise MessageFormatError(f"消息格式错误: {e}") from e
+
+
+class CompressedCodec(MessageCodec):
+    """在其他编码外层压缩大消息
+
+    编码后超过阈值且压缩后更小的消息以二进制 zlib 数据发送，其余消息保持原样；
+    收到以 zlib 头开头的二进制消息时先解压再交给内层编码解码。
+    """
+    def __init__(
+        self,
+        inner: MessageCodec,
+        threshold: int = COMPRESSION_THRESHOLD,
+        level: int = COMPRESSION_LEVEL
+    ):
+        self.inner = inner
+        self.threshold = threshold
+        self.level = level
+        self.subprotocol = f"{inner.subprotocol}{DEFLATE_SUFFIX}"
+
+    def encode(self, message: Message) -> Frame:
+        return self.compress(self.inner.encode(message))
+
+    def encode_text(self, text: str) -> Frame:
+        return self.compress(self.inner.encode_text(text))
+
+    def compress(self, frame: Frame) -> Frame:
+        """超过阈值时压缩消息"""
+        if len(frame) < self.threshold:
+            return frame
+        payload = frame.encode("utf-8") if isinstance(frame, str) else frame
+        compressed = zlib.compress(payload, self.level)
+        if len(compressed) >= len(payload):
+            return frame
+        COMPRESSED_FRAMES.inc(direction="outbound")
+        COMPRESSION_SAVED_BYTES.inc(len(payload) - len(compressed), direction="outbound")
+        return compressed
+
+    def decode(self, frame: Frame) -> Any:
+        if isinstance(frame, bytes) and frame[:1] == bytes((ZLIB_HEADER,)):
+            decompressor = zlib.decompressobj()
+            try:
+                payload = decompressor.decompress(frame, MAX_DECOMPRESSED_SIZE)
+            except zlib.error as e:
+                raise MessageFormatError(f"消息格式错误: {e}") from e
+            if decompressor.unconsumed_tail:
+                raise MessageFormatError("消息格式错误: 解压后的消息过大")
+            COMPRESSED_FRAMES.inc(direction="inbound")
+            # 客户端可能发送压缩后反而更大的帧，计数器只能增加
+            COMPRESSION_SAVED_BYTES.inc(max(0, len(payload) - len(frame)), direction="inbound")
+            frame = payload
+        return self.inner.decode(frame)
+
+
+def available_codecs() -> list:
+    """按优先级返回当前可用的编码"""
+    codecs = []
+    if msgpack is not None:
+        codecs.append(MsgPackCodec())
+    codecs.append(MessageCodec())
+    return codecs
+
+
+def negotiate_codec(requested: Iterable[str]) -> MessageCodec:
+    """根据客户端请求的子协议选择编码，未请求或不支持时使用 JSON
+
+    请求的子协议带 +deflate 后缀时，在所选编码外层启用压缩。
+    """
+    requested = list(requested)
+    for codec in available_codecs():
+        if f"{codec.subprotocol}{DEFLATE_SUFFIX}" in requested:
+            return CompressedCodec(codec)
+        if codec.subprotocol in requested:
+            return codec
+    return MessageCodec()
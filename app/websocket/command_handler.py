@@ -1,5 +1,8 @@
+import time
 from typing import Dict, Type
-from fastapi import WebSocket
+from app import metrics
+from app.tracing import CommandProfiler, Tracer, default_profiler, default_tracer
+from .channel import WebSocketChannel
 from app.models.message import Message, CommandType
 from app.exceptions import ChatError
 from app.commands.base import BaseCommand
@@ -9,13 +12,23 @@ from app.commands.rename_command import RenameCommand
 from app.commands.status_command import StatusCommand
 from app.commands.history_command import HistoryCommand
 from app.commands.unknown_command import UnknownCommand
-from app.commands.fetch_command import FetchCommand
-from app.commands.add_fav_command import AddFavCommand
+from app.commands.fetch_command import FetchCommand, FetchBatchCommand
+from app.commands.add_fav_command import AddFavCommand, AddFavBulkCommand
+from app.commands.room_command import JoinCommand, LeaveCommand
 from .context import ContextManager
 
+COMMAND_SECONDS = metrics.registry.histogram("command_duration_seconds", "命令执行耗时", ("command",))
+
 class CommandHandler:
-    def __init__(self, context_manager: ContextManager):
+    def __init__(
+        self,
+        context_manager: ContextManager,
+        tracer: Tracer = None,
+        profiler: CommandProfiler = None
+    ):
         self.context_manager = context_manager
+        self.tracer = tracer if tracer is not None else default_tracer
+        self.profiler = profiler if profiler is not None else default_profiler
         self.commands: Dict[str, BaseCommand] = {}
         self._register_default_commands()
 
@@ -28,7 +41,11 @@ class CommandHandler:
             StatusCommand,
             HistoryCommand,
             FetchCommand,
-            AddFavCommand
+            FetchBatchCommand,
+            AddFavCommand,
+            AddFavBulkCommand,
+            JoinCommand,
+            LeaveCommand
         ])
 
     def register_commands(self, command_classes: list[Type[BaseCommand]]) -> None:
@@ -45,11 +62,21 @@ class CommandHandler:
         """获取命令处理器"""
         return self.commands.get(command_type, UnknownCommand(self.context_manager))
 
-    async def handle_command(self, websocket: WebSocket, message: Message, conversation_id: str) -> None:
+    async def handle_command(self, websocket: WebSocketChannel, message: Message, conversation_id: str) -> None:
         """处理命令消息"""
+        command_name = message.command.value if message.command is not None else "unknown"
+        started = time.perf_counter()
         try:
-            command = self.get_command(message.command)
-            await command.execute(websocket, message, conversation_id)
+            with self.tracer.span("command", command=command_name, conversation_id=conversation_id):
+                command = self.get_command(message.command)
+                await command.execute(websocket, message, conversation_id)
         except ChatError as e:
+            metrics.record_error(e)
             error_msg = Message.create_error(str(e))
-            await websocket.send_text(error_msg.to_json()) 
\ No newline at end of file
+            await websocket.send_message(error_msg)
+        except Exception as e:
+            metrics.record_error(e)
+            raise
+        finally:
+            COMMAND_SECONDS.observe(time.perf_counter() - started, command=command_name)
+            self.profiler.command_finished()
\ No newline at end of file
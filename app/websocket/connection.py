@@ -1,29 +1,85 @@
-from fastapi import WebSocket
-import json
+from fastapi import WebSocket, WebSocketDisconnect
+import asyncio
+import logging
+import os
+import time
+from app import metrics
 from app.models.message import Message, MessageType, MessageRole, CommandType
+from .channel import PRIORITY_LOW, PRIORITY_NORMAL, WebSocketChannel
+from .codec import MessageCodec
 from .command_handler import CommandHandler
 from .context import ContextManager
-from typing import Optional
+from .registry import CLIENT_CHAT, SessionRegistry
+from .rooms import RoomManager, default_room_manager
+from typing import Any, Dict, Optional, Set
+import re
 import uuid
-from app.exceptions import ChatError
+from app.exceptions import ChannelClosedError, ChatError, MessageFormatError, RequestTimeoutError
+
+logger = logging.getLogger(__name__)
+
+# 心跳间隔（秒），0 表示关闭心跳
+HEARTBEAT_INTERVAL = float(os.environ.get("WS_HEARTBEAT_INTERVAL", "20"))
+# 连续多少次心跳没有回复且期间没有收到任何消息时断开连接
+HEARTBEAT_MAX_MISSED = int(os.environ.get("WS_HEARTBEAT_MAX_MISSED", "3"))
+
+# 客户端在握手时通过 ?user_id= 声明的用户ID格式，不符合时分配新的ID
+USER_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{8,64}")
+
+REAPED_CONNECTIONS = metrics.registry.counter("ws_reaped_connections_total", "心跳超时被断开的连接数")
 
 class WebSocketConnection:
-    def __init__(self):
-        self.context_manager = ContextManager()
-        self.command_handler = CommandHandler(self.context_manager)
-        self.websocket: Optional[WebSocket] = None
+    """单个 WebSocket 连接的会话对象
+
+    上下文管理器、命令处理器和会话注册表在所有连接间共享，
+    每个连接只持有自己的 websocket 和对话ID。
+    """
+    def __init__(
+        self,
+        context_manager: Optional[ContextManager] = None,
+        command_handler: Optional[CommandHandler] = None,
+        registry: Optional[SessionRegistry] = None,
+        codec: Optional[MessageCodec] = None,
+        rooms: Optional[RoomManager] = None,
+        heartbeat_interval: float = HEARTBEAT_INTERVAL,
+        max_missed_heartbeats: int = HEARTBEAT_MAX_MISSED
+    ):
+        self.context_manager = context_manager if context_manager is not None else ContextManager()
+        self.command_handler = command_handler if command_handler is not None else CommandHandler(self.context_manager)
+        self.registry = registry if registry is not None else SessionRegistry()
+        self.codec = codec if codec is not None else MessageCodec()
+        self.rooms = rooms if rooms is not None else default_room_manager
+        self.websocket: Optional[WebSocketChannel] = None
         self.current_context: Optional[str] = None
+        self.user_id: Optional[str] = None
+        self.client_type = CLIENT_CHAT
+        self.command_tasks: Set[asyncio.Task] = set()
+        self.heartbeat_interval = heartbeat_interval
+        self.max_missed_heartbeats = max_missed_heartbeats
+        self.heartbeat_task: Optional[asyncio.Task] = None
 
     async def initialize_connection(self, websocket: WebSocket) -> None:
         """初始化WebSocket连接"""
-        self.websocket = websocket
+        self.websocket = WebSocketChannel(websocket, self.codec)
+        query_params = getattr(websocket, "query_params", None)
+        requested_user_id = None
+        if query_params is not None:
+            self.client_type = query_params.get("client", CLIENT_CHAT)
+            requested_user_id = query_params.get("user_id")
         await self.websocket.accept()
         
-        # 创建新的对话上下文
+        # 创建新的对话上下文。客户端保存欢迎消息中的用户ID并在重连时带上，
+        # 配置了共享存储时，任意 worker 都能读到同一用户的用户名和消息计数
         conversation_id = str(uuid.uuid4())
-        user_id = str(uuid.uuid4())  # 在实际应用中，这应该从认证系统获取
+        if requested_user_id and USER_ID_PATTERN.fullmatch(requested_user_id):
+            user_id = requested_user_id
+        else:
+            user_id = str(uuid.uuid4())
         self.current_context = conversation_id
-        self.context_manager.create_context(conversation_id, user_id, "游客")
+        self.user_id = user_id
+        context = await self.context_manager.create_context(conversation_id, user_id, "游客")
+        self.websocket.on_receive = context.touch
+        self.registry.register(conversation_id, user_id, self)
         
         await self.send_welcome_message()
 
@@ -33,46 +89,68 @@ class WebSocketConnection:
             type=MessageType.SYSTEM,
             role=MessageRole.SYSTEM,
             content="欢迎加入聊天室！输入 /help 查看可用命令",
-            sender="System"
+            sender="System",
+            data={"user_id": self.user_id}
         )
         await self.send_message(welcome_msg)
 
-    async def send_message(self, message: Message) -> None:
+    async def send_message(self, message: Message, priority: int = PRIORITY_NORMAL) -> None:
         """发送消息并保存到上下文"""
         if self.websocket and self.current_context:
-            await self.websocket.send_text(message.to_json())
+            size = await self.websocket.send_message(message, priority)
             context = self.context_manager.get_context(self.current_context)
             if context:
-                context.add_message(message)
+                context.add_message(message, size)
+
+    def touch(self) -> None:
+        """刷新当前对话的活跃时间"""
+        context = self.context_manager.get_context(self.current_context) if self.current_context else None
+        if context is not None:
+            context.touch()
 
     async def handle_chat_loop(self) -> None:
         """处理持续的聊天对话"""
         try:
             while True:
-                data = await self.websocket.receive_text()
-                await self.process_message(data)
+                try:
+                    message_data = await self.websocket.receive_json()
+                except MessageFormatError as e:
+                    metrics.record_error(e)
+                    await self.handle_error("消息格式错误")
+                    continue
+                await self.process_message(message_data)
+        except (ChannelClosedError, WebSocketDisconnect):
+            # 服务端主动关闭或客户端正常断开
+            return
         except Exception as e:
+            metrics.record_error(e)
             await self.handle_error(str(e))
 
-    async def process_message(self, data: str) -> None:
-        """处理接收到的消息"""
+    async def process_message(self, message_data: Dict[str, Any]) -> None:
+        """处理接收到的消息，命令在独立任务中执行，不阻塞聊天循环"""
         try:
-            message_data = json.loads(data)
             content = message_data["content"]
             sender = message_data["sender"]
 
             if content.startswith('/'):
-                await self.handle_command_message(content, sender)
+                self.start_command_task(content, sender)
             else:
                 await self.handle_chat_message(content, sender)
                 
-        except json.JSONDecodeError:
-            await self.handle_error("消息格式错误")
         except ChatError as e:
+            metrics.record_error(e)
             await self.handle_error(str(e))
         except Exception as e:
+            metrics.record_error(e)
             await self.handle_error(f"消息处理错误: {str(e)}")
 
+    def start_command_task(self, content: str, sender: str) -> asyncio.Task:
+        """在独立任务中执行命令"""
+        task = asyncio.create_task(self.handle_command_message(content, sender))
+        self.command_tasks.add(task)
+        task.add_done_callback(self.command_tasks.discard)
+        return task
+
     async def handle_command_message(self, content: str, sender: str) -> None:
         """处理命令消息"""
         if not self.current_context:
@@ -83,12 +161,20 @@ class WebSocketConnection:
             parts = content[1:].split()
             command = parts[0]
             args = parts[1:] if len(parts) > 1 else []
+            # --key=value 形式的选项可以出现在任意位置，先取出再按位置分配其余参数
+            flags = [arg for arg in args if arg.startswith("--")]
+            positional = [arg for arg in args if not arg.startswith("--")]
             
             message = Message.create_command(
                 command=command,
                 sender=sender,
                 new_name=" ".join(args) if command == "rename" else None,
-                count=args[0] if command == "history" and args else None
+                count=args[0] if command == "history" and args else None,
+                cursor=args[1] if command == "history" and len(args) > 1 else None,
+                room=args[0] if command in ("join", "leave") and args else None,
+                urls=args if command == "fetch_batch" else None,
+                add_media_ids=positional[0] if command == "add_fav_bulk" and positional else None,
+                rids=positional[1:] + flags if command == "add_fav_bulk" else None
             )
             
             # 保存命令消息到上下文
@@ -105,6 +191,7 @@ class WebSocketConnection:
         except ChatError as e:
             await self.handle_error(str(e))
         except Exception as e:
+            # 命令处理器已经记录过错误
             await self.handle_error(f"命令执行错误: {str(e)}")
 
     async def handle_chat_message(self, content: str, sender: str) -> None:
@@ -115,18 +202,83 @@ class WebSocketConnection:
             content=content,
             sender=sender
         )
-        await self.send_message(message)
+        rooms = self.rooms.rooms_of(self.current_context) if self.current_context else []
+        if not rooms:
+            # 聊天回显在客户端接收过慢时可以丢弃
+            await self.send_message(message, PRIORITY_LOW)
+            return
+
+        # 在聊天室中时广播给所有成员（包括自己），并记入每个成员的历史
+        result = await self.rooms.broadcast(rooms, message)
+        for conversation_id in result.recipients:
+            context = self.context_manager.get_context(conversation_id)
+            if context:
+                context.add_message(message, result.size)
 
     async def handle_error(self, error_message: str) -> None:
-        """处理错误"""
-        if self.websocket:
-            error_msg = Message.create_error(error_message)
-            await self.send_message(error_msg)
+        """处理错误，连接已关闭时无法通知客户端，直接忽略"""
+        if self.websocket is None or self.websocket.closed:
+            return
+        try:
+            await self.send_message(Message.create_error(error_message))
+        except ChannelClosedError:
+            pass
+
+    async def close(self, reason: str) -> None:
+        """服务端主动结束会话：通知客户端后关闭连接，聊天循环随之退出"""
+        if not self.websocket:
+            return
+        try:
+            await self.websocket.send_message(Message(
+                type=MessageType.SYSTEM,
+                role=MessageRole.SYSTEM,
+                content=reason,
+                sender="System"
+            ))
+            await self.websocket.close()
+        except Exception:
+            pass
+
+    async def heartbeat_loop(self) -> None:
+        """定期发送心跳并记录往返时间
+
+        心跳超时但期间收到过其他消息时仍认为连接可用；连续多次既没有心跳回复也没有任何消息时，
+        认为连接已经失效，关闭通道，等待中的请求随之失败，聊天循环退出后清理上下文。
+        """
+        missed = 0
+        while self.websocket is not None:
+            await asyncio.sleep(self.heartbeat_interval)
+            channel = self.websocket
+            if channel is None:
+                return
+            sent_at = time.monotonic()
+            try:
+                await channel.ping(self.heartbeat_interval)
+                missed = 0
+            except RequestTimeoutError:
+                missed = 0 if channel.last_received >= sent_at else missed + 1
+                if missed >= self.max_missed_heartbeats:
+                    REAPED_CONNECTIONS.inc()
+                    logger.warning("心跳超时，断开连接: conversation_id=%s", self.current_context)
+                    await channel.abort(ChannelClosedError("心跳超时，连接已断开"))
+                    return
+            except ChannelClosedError:
+                return
 
     async def cleanup(self) -> None:
         """清理接"""
+        if self.heartbeat_task is not None:
+            self.heartbeat_task.cancel()
+            self.heartbeat_task = None
+        for task in list(self.command_tasks):
+            task.cancel()
+        if self.command_tasks:
+            await asyncio.gather(*self.command_tasks, return_exceptions=True)
+
         if self.current_context:
-            self.context_manager.close_context(self.current_context)
+            self.rooms.leave_all(self.current_context)
+            self.registry.unregister(self.current_context)
+            await self.context_manager.close_context(self.current_context)
             self.current_context = None
             
         if self.websocket:
@@ -141,7 +293,11 @@ class WebSocketConnection:
         """主要的连接处理函数"""
         try:
             await self.initialize_connection(websocket)
+            if self.heartbeat_interval > 0:
+                self.heartbeat_task = asyncio.create_task(self.heartbeat_loop())
             await self.handle_chat_loop()
+        except (ChannelClosedError, WebSocketDisconnect):
+            pass
         except Exception as e:
             await self.handle_error(f"发生错误: {str(e)}")
         finally:
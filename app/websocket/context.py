@@ -1,7 +1,33 @@
-from typing import Dict, List, Optional
-from datetime import datetime
+import asyncio
+import logging
+import os
+from typing import Callable, Dict, List, Optional
+from datetime import datetime, timedelta
+from app import metrics
 from app.models.message import Message
 from dataclasses import dataclass, field
+from app.storage.context_store import ContextStore, UserRecord
+from app.storage.history_store import BatchingHistoryWriter, HistoryPage, HistoryRecord, HistoryStore
+from .history import HistoryEntry, MessageHistory
+
+logger = logging.getLogger(__name__)
+
+# 对话超过该秒数没有新消息即被清理
+CONTEXT_IDLE_TTL = float(os.environ.get("CONTEXT_IDLE_TTL", "3600"))
+# 同时保留的对话上限
+CONTEXT_MAX_CONTEXTS = int(os.environ.get("CONTEXT_MAX_CONTEXTS", "10000"))
+# 所有对话在内存中保留的消息总数上限
+CONTEXT_MAX_MESSAGES = int(os.environ.get("CONTEXT_MAX_MESSAGES", "1000000"))
+# 清理任务的执行间隔（秒）
+CONTEXT_SWEEP_INTERVAL = float(os.environ.get("CONTEXT_SWEEP_INTERVAL", "60"))
+# 共享存储中消息计数的写回间隔（秒）
+CONTEXT_FLUSH_INTERVAL = float(os.environ.get("CONTEXT_FLUSH_INTERVAL", "1"))
+
+ACTIVE_CONTEXTS = metrics.registry.gauge("chat_active_contexts", "当前保留的对话数")
+USER_CONTEXTS = metrics.registry.gauge("chat_user_contexts", "当前保留的用户数")
+CONTEXT_EVICTIONS = metrics.registry.counter(
+    "chat_context_evictions_total", "被清理的对话数", ("reason",)
+)
 
 @dataclass
 class UserContext:
@@ -12,66 +38,255 @@ class UserContext:
     last_active: datetime = field(default_factory=datetime.now)
     message_count: int = 0
 
+    def to_record(self) -> UserRecord:
+        return UserRecord(self.user_id, self.username, self.connected_at, self.last_active, self.message_count)
+
+    def update_from(self, record: UserRecord) -> None:
+        """用存储中的数据刷新本地对象"""
+        self.username = record.username
+        self.message_count = record.message_count
+        self.last_active = max(self.last_active, record.last_active)
+
 @dataclass
 class ChatContext:
     """聊天上下文信息"""
     conversation_id: str
     started_at: datetime = field(default_factory=datetime.now)
-    message_history: List[Message] = field(default_factory=list)
+    message_history: MessageHistory = field(default_factory=MessageHistory)
     user_context: Optional[UserContext] = None
     metadata: Dict = field(default_factory=dict)
+    history_writer: Optional[BatchingHistoryWriter] = None
+    context_store: Optional[ContextStore] = None
+    last_active: datetime = field(default_factory=datetime.now)
 
-    def add_message(self, message: Message) -> None:
-        """添加消息到历史记录"""
-        self.message_history.append(message)
+    def touch(self) -> None:
+        """记录一次活动，收到任何消息或处理网关请求的连接不会被当作空闲清理"""
+        self.last_active = datetime.now()
+
+    def add_message(self, message: Message, size: Optional[int] = None) -> int:
+        """添加消息到历史记录，返回消息序号"""
+        seq = self.message_history.append(message, size)
+        self.last_active = datetime.now()
+        if self.history_writer is not None:
+            self.history_writer.submit(HistoryRecord(self.conversation_id, seq, message))
         if self.user_context:
             self.user_context.message_count += 1
-            self.user_context.last_active = datetime.now()
+            self.user_context.last_active = self.last_active
+            if self.context_store is not None:
+                self.context_store.record_activity(self.user_context.user_id, 1, self.last_active)
+        return seq
 
     def get_last_n_messages(self, n: int) -> List[Message]:
         """获取最近的n条消息"""
-        return self.message_history[-n:] if n > 0 else []
+        return self.message_history.last(n)
 
     def get_messages_by_type(self, message_type: str) -> List[Message]:
         """按类型获取消息"""
-        return [msg for msg in self.message_history if msg.type == message_type]
+        return self.message_history.by_type(message_type)
+
+    def get_messages_range(self, start_seq: int, end_seq: Optional[int] = None) -> List[HistoryEntry]:
+        """按序号范围获取消息"""
+        return self.message_history.range(start_seq, end_seq)
 
-    def clear_history(self) -> None:
+    async def clear_history(self) -> None:
         """清除消息历史"""
         self.message_history.clear()
+        if self.history_writer is not None:
+            await self.history_writer.delete_conversation(self.conversation_id)
 
 class ContextManager:
-    """对话上下文管理器"""
-    def __init__(self):
+    """对话上下文管理器
+
+    配置了 history_store 时，消息在写入内存历史的同时批量持久化，
+    内存中只保留最近的消息，更早的消息从存储中分页读取。对话关闭或被清理时删除其持久化的消息。
+
+    后台清理任务定期移除空闲超时的对话和用户；对话数或消息总数超出上限时，
+    按最近活跃时间从早到晚清理。对话被清理时通知监听器，由监听器关闭对应的连接。
+
+    配置了 context_store 时，用户和对话信息同时写入存储，多个 worker 进程通过共享存储
+    看到同一用户的用户名和消息计数；user_contexts 只是本进程的缓存。
+    访问存储的方法都是协程，存储在自己的线程中执行数据库操作，不阻塞事件循环。
+    """
+    def __init__(
+        self,
+        history_store: Optional[HistoryStore] = None,
+        idle_ttl: float = CONTEXT_IDLE_TTL,
+        max_contexts: int = CONTEXT_MAX_CONTEXTS,
+        max_messages: int = CONTEXT_MAX_MESSAGES,
+        context_store: Optional[ContextStore] = None
+    ):
         self.active_contexts: Dict[str, ChatContext] = {}
         self.user_contexts: Dict[str, UserContext] = {}
+        self.idle_ttl = idle_ttl
+        self.max_contexts = max_contexts
+        self.max_messages = max_messages
+        self.eviction_listeners: List[Callable[[str, ChatContext], None]] = []
+        self._sweeper_task: Optional[asyncio.Task] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self.context_store = context_store
+        self.history_store = history_store
+        self.history_writer = BatchingHistoryWriter(history_store) if history_store is not None else None
 
-    def create_context(self, conversation_id: str, user_id: str, username: str) -> ChatContext:
+    async def create_context(self, conversation_id: str, user_id: str, username: str) -> ChatContext:
         """创建新的对话上下文"""
-        user_context = self.get_or_create_user_context(user_id, username)
+        user_context = await self.get_or_create_user_context(user_id, username)
+        while len(self.active_contexts) >= self.max_contexts > 0:
+            oldest = min(self.active_contexts.values(), key=lambda c: c.last_active)
+            await self.evict_context(oldest.conversation_id, "capacity")
         context = ChatContext(
             conversation_id=conversation_id,
-            user_context=user_context
+            user_context=user_context,
+            history_writer=self.history_writer,
+            context_store=self.context_store
         )
         self.active_contexts[conversation_id] = context
+        if self.context_store is not None:
+            await self.context_store.add_conversation(conversation_id, user_id, context.started_at)
+        ACTIVE_CONTEXTS.set(len(self.active_contexts))
         return context
 
-    def get_or_create_user_context(self, user_id: str, username: str) -> UserContext:
+    async def get_or_create_user_context(self, user_id: str, username: str) -> UserContext:
         """获取或创建用户上下文"""
         if user_id not in self.user_contexts:
-            self.user_contexts[user_id] = UserContext(user_id=user_id, username=username)
+            record = await self.context_store.get_user(user_id) if self.context_store is not None else None
+            if record is not None:
+                user_context = UserContext(**record._asdict())
+            else:
+                user_context = UserContext(user_id=user_id, username=username)
+                if self.context_store is not None:
+                    await self.context_store.save_user(user_context.to_record())
+            # 等待存储期间同一用户的其他连接可能已经创建了上下文
+            self.user_contexts.setdefault(user_id, user_context)
+            USER_CONTEXTS.set(len(self.user_contexts))
         return self.user_contexts[user_id]
 
+    async def get_user_context(self, user_id: str) -> Optional[UserContext]:
+        """获取用户上下文，配置了共享存储时先从存储刷新"""
+        user_context = self.user_contexts.get(user_id)
+        if user_context is not None and self.context_store is not None:
+            record = await self.context_store.get_user(user_id)
+            if record is not None:
+                user_context.update_from(record)
+        return user_context
+
     def get_context(self, conversation_id: str) -> Optional[ChatContext]:
         """获取对话上下文"""
         return self.active_contexts.get(conversation_id)
 
-    def update_username(self, user_id: str, new_username: str) -> None:
+    async def update_username(self, user_id: str, new_username: str) -> None:
         """更新用户名"""
         if user_id in self.user_contexts:
             self.user_contexts[user_id].username = new_username
+            if self.context_store is not None:
+                await self.context_store.save_user(self.user_contexts[user_id].to_record())
 
-    def close_context(self, conversation_id: str) -> None:
+    async def close_context(self, conversation_id: str) -> None:
         """关闭对话上下文"""
         if conversation_id in self.active_contexts:
-            del self.active_contexts[conversation_id] 
\ No newline at end of file
+            del self.active_contexts[conversation_id]
+            ACTIVE_CONTEXTS.set(len(self.active_contexts))
+            if self.context_store is not None:
+                await self.context_store.remove_conversation(conversation_id)
+            if self.history_writer is not None:
+                # 对话ID每个连接一个，关闭后无法再读取，持久化的消息随之删除
+                await self.history_writer.delete_conversation(conversation_id)
+
+    def add_eviction_listener(self, listener: Callable[[str, ChatContext], None]) -> None:
+        """注册对话被清理时的回调"""
+        self.eviction_listeners.append(listener)
+
+    async def evict_context(self, conversation_id: str, reason: str) -> None:
+        """清理对话并通知监听器"""
+        context = self.active_contexts.get(conversation_id)
+        if context is None:
+            return
+        await self.close_context(conversation_id)
+        CONTEXT_EVICTIONS.inc(reason=reason)
+        logger.info("清理对话: conversation_id=%s, reason=%s", conversation_id, reason)
+        for listener in self.eviction_listeners:
+            try:
+                listener(conversation_id, context)
+            except Exception:
+                logger.exception("对话清理回调执行失败")
+
+    async def sweep(self, now: Optional[datetime] = None) -> int:
+        """清理空闲和超出上限的对话及不再使用的用户，返回清理的对话数"""
+        now = now if now is not None else datetime.now()
+        deadline = now - timedelta(seconds=self.idle_ttl)
+        evicted = 0
+        if self.idle_ttl > 0:
+            for context in list(self.active_contexts.values()):
+                if context.last_active < deadline:
+                    await self.evict_context(context.conversation_id, "idle")
+                    evicted += 1
+
+        # 按最近活跃时间从早到晚清理，直到对话数和消息总数都在上限内
+        total_messages = sum(len(c.message_history) for c in self.active_contexts.values())
+        if len(self.active_contexts) > self.max_contexts or total_messages > self.max_messages:
+            for context in sorted(self.active_contexts.values(), key=lambda c: c.last_active):
+                if len(self.active_contexts) <= self.max_contexts and total_messages <= self.max_messages:
+                    break
+                total_messages -= len(context.message_history)
+                await self.evict_context(context.conversation_id, "capacity")
+                evicted += 1
+
+        if self.idle_ttl > 0:
+            # 没有对话引用且空闲超时的用户
+            in_use = {c.user_context.user_id for c in self.active_contexts.values() if c.user_context}
+            for user_id, user_context in list(self.user_contexts.items()):
+                if user_id not in in_use and user_context.last_active < deadline:
+                    del self.user_contexts[user_id]
+            if self.context_store is not None:
+                await self.context_store.touch_conversations(list(self.active_contexts), now)
+                await self.context_store.delete_idle_users(deadline)
+        USER_CONTEXTS.set(len(self.user_contexts))
+        return evicted
+
+    def start_sweeper(self, interval: float = CONTEXT_SWEEP_INTERVAL) -> None:
+        """启动后台清理任务，配置了共享存储时同时启动计数写回任务"""
+        if self._sweeper_task is None or self._sweeper_task.done():
+            self._sweeper_task = asyncio.create_task(self._sweep_loop(interval))
+        if self.context_store is not None and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.create_task(self._flush_loop(CONTEXT_FLUSH_INTERVAL))
+
+    async def _sweep_loop(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.sweep()
+            except Exception:
+                logger.exception("清理对话失败")
+
+    async def _flush_loop(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.context_store.flush()
+            except Exception:
+                logger.exception("写回用户计数失败")
+
+    async def read_history(self, conversation_id: str, limit: int, before: Optional[int] = None) -> Optional[HistoryPage]:
+        """分页读取历史消息，before 为上一页返回的游标；对话不存在时返回 None"""
+        context = self.get_context(conversation_id)
+        if self.history_store is None:
+            return context.message_history.page(limit, before) if context else None
+        # 先写入队列中的消息，保证读到最新的内容
+        await self.history_writer.flush()
+        return await self.history_store.page(conversation_id, limit, before)
+
+    async def close(self) -> None:
+        """停止后台任务，写入剩余的历史消息和计数并关闭存储"""
+        for task in (self._sweeper_task, self._flush_task):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._sweeper_task = self._flush_task = None
+        if self.context_store is not None:
+            await self.context_store.close()
+        if self.history_writer is not None:
+            await self.history_writer.close()
+        if self.history_store is not None:
+            await self.history_store.close()
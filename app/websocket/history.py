@@ -0,0 +1,109 @@
+import os
+from collections import deque
+from itertools import islice
+from typing import Any, Deque, Dict, Iterator, List, NamedTuple, Optional
+
+from app.models.message import Message
+from app.storage.history_store import HistoryPage
+
+# 单个对话在内存中保留的最大消息数和字节数
+HISTORY_MAX_MESSAGES = int(os.environ.get("CHAT_HISTORY_MAX_MESSAGES", "1000"))
+HISTORY_MAX_BYTES = int(os.environ.get("CHAT_HISTORY_MAX_BYTES", str(1024 * 1024)))
+
+
+class HistoryEntry(NamedTuple):
+    seq: int
+    message: Message
+    size: int
+
+
+class MessageHistory:
+    """有界消息历史
+
+    按环形缓冲区保存消息，超出条数或字节上限时丢弃最早的消息。
+    每条消息有一个单调递增的序号，清空或淘汰后序号也不会复用，可用于范围查询；
+    另外按消息类型维护二级索引，按类型查询只需遍历结果本身。
+    """
+    def __init__(self, max_messages: int = HISTORY_MAX_MESSAGES, max_bytes: int = HISTORY_MAX_BYTES):
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries: Deque[HistoryEntry] = deque()
+        self._by_type: Dict[Any, Deque[HistoryEntry]] = {}
+        self._next_seq = 0
+
+    @property
+    def first_seq(self) -> int:
+        """最早一条保留消息的序号，没有消息时等于 next_seq"""
+        return self._entries[0].seq if self._entries else self._next_seq
+
+    @property
+    def next_seq(self) -> int:
+        """下一条消息的序号"""
+        return self._next_seq
+
+    def append(self, message: Message, size: Optional[int] = None) -> int:
+        """添加消息，返回消息序号；size 为已知的编码后长度，省略时按 JSON 重新序列化计算"""
+        entry = HistoryEntry(self._next_seq, message, size if size is not None else len(message.to_json()))
+        self._next_seq += 1
+        self._entries.append(entry)
+        self._by_type.setdefault(message.type, deque()).append(entry)
+        self.total_bytes += entry.size
+        while self._entries and (
+            len(self._entries) > self.max_messages or self.total_bytes > self.max_bytes
+        ):
+            self._evict_oldest()
+        return entry.seq
+
+    def _evict_oldest(self) -> None:
+        entry = self._entries.popleft()
+        self.total_bytes -= entry.size
+        # 各类型索引同样按序号递增，被淘汰的一定是对应索引的第一条
+        index = self._by_type[entry.message.type]
+        index.popleft()
+        if not index:
+            del self._by_type[entry.message.type]
+
+    def last(self, n: int) -> List[Message]:
+        """最近的 n 条消息，按时间顺序"""
+        if n <= 0:
+            return []
+        messages = [entry.message for entry in islice(reversed(self._entries), n)]
+        messages.reverse()
+        return messages
+
+    def by_type(self, message_type: Any) -> List[Message]:
+        """某个类型的全部消息"""
+        return [entry.message for entry in self._by_type.get(message_type, ())]
+
+    def range(self, start_seq: int, end_seq: Optional[int] = None) -> List[HistoryEntry]:
+        """序号在 [start_seq, end_seq) 范围内仍保留的消息"""
+        if not self._entries:
+            return []
+        first = self._entries[0].seq
+        start = max(start_seq - first, 0)
+        stop = len(self._entries) if end_seq is None else min(end_seq - first, len(self._entries))
+        if start >= stop:
+            return []
+        return list(islice(self._entries, start, stop))
+
+    def page(self, limit: int, before: Optional[int] = None) -> HistoryPage:
+        """序号小于 before 的最近 limit 条消息，与持久化存储的分页格式相同"""
+        entries = self.range(self.first_seq, before)
+        if limit <= 0:
+            return HistoryPage([], None)
+        selected = entries[-limit:]
+        next_cursor = selected[0].seq if len(entries) > limit else None
+        return HistoryPage([(entry.seq, entry.message) for entry in selected], next_cursor)
+
+    def clear(self) -> None:
+        """清空消息，序号继续递增"""
+        self._entries.clear()
+        self._by_type.clear()
+        self.total_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __iter__(self) -> Iterator[Message]:
+        return (entry.message for entry in self._entries)
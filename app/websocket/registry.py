@@ -0,0 +1,82 @@
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from .connection import WebSocketConnection
+
+# 客户端类型：聊天页面和浏览器扩展，连接时通过 ?client= 参数声明
+CLIENT_CHAT = "chat"
+CLIENT_EXTENSION = "extension"
+
+
+class SessionRegistry:
+    """在线会话注册表
+
+    按对话ID索引所有在线连接，并维护用户ID和客户端类型到对话的二级索引。
+    所有修改操作中间没有 await，在事件循环中是原子的；
+    遍历使用写时复制的快照，遍历过程中注册/注销会话不会影响当前遍历。
+    """
+    def __init__(self):
+        self._sessions: Dict[str, "WebSocketConnection"] = {}
+        self._user_sessions: Dict[str, Dict[str, "WebSocketConnection"]] = {}
+        self._kind_sessions: Dict[str, Dict[str, "WebSocketConnection"]] = {}
+        self._snapshot: Optional[Tuple["WebSocketConnection", ...]] = None
+
+    def register(self, conversation_id: str, user_id: str, session: "WebSocketConnection") -> None:
+        """注册会话"""
+        self.unregister(conversation_id)
+        self._sessions[conversation_id] = session
+        self._user_sessions.setdefault(user_id, {})[conversation_id] = session
+        self._kind_sessions.setdefault(self._kind(session), {})[conversation_id] = session
+        self._snapshot = None
+
+    def unregister(self, conversation_id: str) -> Optional["WebSocketConnection"]:
+        """注销会话，返回被注销的会话"""
+        session = self._sessions.pop(conversation_id, None)
+        if session is None:
+            return None
+
+        user_id = session.user_id
+        user_sessions = self._user_sessions.get(user_id)
+        if user_sessions is not None:
+            user_sessions.pop(conversation_id, None)
+            if not user_sessions:
+                del self._user_sessions[user_id]
+        kind = self._kind(session)
+        kind_sessions = self._kind_sessions.get(kind)
+        if kind_sessions is not None:
+            kind_sessions.pop(conversation_id, None)
+            if not kind_sessions:
+                del self._kind_sessions[kind]
+        self._snapshot = None
+        return session
+
+    def get(self, conversation_id: str) -> Optional["WebSocketConnection"]:
+        """按对话ID获取会话"""
+        return self._sessions.get(conversation_id)
+
+    def get_by_user(self, user_id: str) -> List["WebSocketConnection"]:
+        """获取某个用户的全部会话"""
+        return list(self._user_sessions.get(user_id, {}).values())
+
+    def get_by_kind(self, kind: str) -> List["WebSocketConnection"]:
+        """获取某种客户端的全部会话，例如所有扩展连接"""
+        return list(self._kind_sessions.get(kind, {}).values())
+
+    @staticmethod
+    def _kind(session: "WebSocketConnection") -> str:
+        return getattr(session, "client_type", CLIENT_CHAT)
+
+    def sessions(self) -> Tuple["WebSocketConnection", ...]:
+        """获取当前所有会话的快照"""
+        if self._snapshot is None:
+            self._snapshot = tuple(self._sessions.values())
+        return self._snapshot
+
+    def __iter__(self) -> Iterator["WebSocketConnection"]:
+        return iter(self.sessions())
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __contains__(self, conversation_id: object) -> bool:
+        return conversation_id in self._sessions
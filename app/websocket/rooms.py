@@ -0,0 +1,113 @@
+import logging
+import time
+from typing import Dict, Iterable, List, NamedTuple, Set, Tuple
+
+from app import metrics
+from app.exceptions import ChannelClosedError
+from app.models.message import Message
+from .channel import FRAMES, WebSocketChannel
+from .codec import Frame
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_SECONDS = metrics.registry.histogram("ws_broadcast_seconds", "一次广播发送给所有成员的耗时")
+BROADCAST_RECIPIENTS = metrics.registry.counter("ws_broadcast_recipients_total", "广播送达的成员数", ("result",))
+
+
+class BroadcastResult(NamedTuple):
+    recipients: List[str]
+    # 已断开或发送队列已满、没有收到消息的成员数
+    failed: int
+    # 消息的 JSON 文本长度，保存到历史时不必再次序列化
+    size: int
+
+    @property
+    def delivered(self) -> int:
+        return len(self.recipients) - self.failed
+
+
+class RoomManager:
+    """聊天室成员管理和广播
+
+    成员以对话ID标识，保存其收发通道。一个对话可以同时加入多个聊天室。
+    广播时消息只用 to_json 序列化一次，每种编码再各转换一次，
+    然后不等待地放入所有成员的发送队列：队列已满的成员丢弃这条消息，不会拖住其他成员和发送方；
+    单个成员失败不影响其他成员，已断开的成员自动移出。
+    """
+    def __init__(self):
+        self._rooms: Dict[str, Dict[str, WebSocketChannel]] = {}
+        self._memberships: Dict[str, Set[str]] = {}
+
+    def join(self, room: str, conversation_id: str, channel: WebSocketChannel) -> None:
+        """加入聊天室"""
+        self._rooms.setdefault(room, {})[conversation_id] = channel
+        self._memberships.setdefault(conversation_id, set()).add(room)
+
+    def leave(self, room: str, conversation_id: str) -> bool:
+        """离开聊天室，返回是否曾在该聊天室中"""
+        members = self._rooms.get(room)
+        if members is None or members.pop(conversation_id, None) is None:
+            return False
+        if not members:
+            del self._rooms[room]
+        rooms = self._memberships.get(conversation_id)
+        if rooms is not None:
+            rooms.discard(room)
+            if not rooms:
+                del self._memberships[conversation_id]
+        return True
+
+    def leave_all(self, conversation_id: str) -> None:
+        """离开所有聊天室，连接关闭时调用"""
+        for room in list(self._memberships.get(conversation_id, ())):
+            self.leave(room, conversation_id)
+
+    def rooms_of(self, conversation_id: str) -> List[str]:
+        """对话所在的聊天室"""
+        return sorted(self._memberships.get(conversation_id, ()))
+
+    def members(self, room: str) -> List[str]:
+        """聊天室成员的对话ID"""
+        return list(self._rooms.get(room, {}))
+
+    async def broadcast(self, rooms: Iterable[str], message: Message) -> BroadcastResult:
+        """向一个或多个聊天室的所有成员发送消息，同时在多个聊天室中的成员只收到一次"""
+        if isinstance(rooms, str):
+            rooms = (rooms,)
+        started = time.perf_counter()
+        recipients: Dict[str, WebSocketChannel] = {}
+        for room in rooms:
+            recipients.update(self._rooms.get(room, {}))
+
+        text = message.to_json()
+        frames: Dict[Tuple[type, object], Frame] = {}
+        targets = []
+        failed = 0
+        for conversation_id, channel in recipients.items():
+            targets.append(conversation_id)
+            codec = channel.codec
+            # 同一种编码的成员共用同一份编码结果
+            key = (type(codec), codec.subprotocol)
+            try:
+                frame = frames.get(key)
+                if frame is None:
+                    frame = frames[key] = codec.encode_text(text)
+                if not channel.send_frame_nowait(frame):
+                    failed += 1
+            except ChannelClosedError:
+                failed += 1
+                self.leave_all(conversation_id)
+            except Exception as e:
+                failed += 1
+                logger.warning("广播发送失败: conversation_id=%s, error=%r", conversation_id, e)
+
+        FRAMES.inc(len(targets), direction="outbound", type=message.type.value)
+        BROADCAST_SECONDS.observe(time.perf_counter() - started)
+        BROADCAST_RECIPIENTS.inc(len(targets) - failed, result="delivered")
+        if failed:
+            BROADCAST_RECIPIENTS.inc(failed, result="failed")
+        return BroadcastResult(targets, failed, len(text))
+
+
+# 所有连接共享的聊天室
+default_room_manager = RoomManager()
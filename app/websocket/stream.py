@@ -0,0 +1,205 @@
+import asyncio
+import base64
+import json
+from collections import deque
+from typing import TYPE_CHECKING, Any, AsyncIterator, Callable, Deque, Dict, List, Optional
+
+from app.exceptions import FetchError, FetchTimeoutError
+from app.models.message import Message, CommandType
+
+if TYPE_CHECKING:
+    from .channel import WebSocketChannel
+
+# 默认流控窗口：扩展最多可以连续发送的未确认分块数
+DEFAULT_STREAM_WINDOW = 16
+# 等待下一个分块的超时时间（秒）
+STREAM_IDLE_TIMEOUT = 30.0
+
+_EOF = object()
+
+
+class FetchStream:
+    """分块获取数据响应
+
+    扩展把响应体拆成带序号的 fetch_chunk 消息发送，最后一块带 eof 标记，只有最后一块可以为空：
+
+        {"type": "fetch_chunk", "request_id": "...",
+         "data": {"seq": 0, "chunk": "...", "encoding": "utf-8" | "base64", "eof": false}}
+
+    分块可以乱序到达，按序号重组后交给消费者。扩展最多只能发送 window 个未确认的分块，
+    消费者每取走半个窗口的分块，服务端回复一条 fetch_ack 补充额度，内存占用因此有上限。
+    """
+    def __init__(
+        self,
+        channel: "WebSocketChannel",
+        request_id: str,
+        window: int = DEFAULT_STREAM_WINDOW,
+        idle_timeout: Optional[float] = STREAM_IDLE_TIMEOUT
+    ):
+        self.channel = channel
+        self.request_id = request_id
+        self.window = window
+        self.idle_timeout = idle_timeout
+        self.bytes_received = 0
+        self._next_seq = 0
+        self._out_of_order: Dict[int, Any] = {}
+        self._ready: Deque[Any] = deque()
+        self._wakeup = asyncio.Event()
+        self._consumed = 0
+        self._error: Optional[BaseException] = None
+        self._finished = False
+        self._done_callbacks: List[Callable[[], None]] = []
+
+    def add_done_callback(self, callback: Callable[[], None]) -> None:
+        """扩展发送完最后一块或流失败时调用 callback；流已结束时立即调用"""
+        if self._finished:
+            callback()
+        else:
+            self._done_callbacks.append(callback)
+
+    def _finish(self) -> None:
+        self._finished = True
+        self.channel.close_stream(self.request_id)
+        callbacks, self._done_callbacks = self._done_callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def feed(self, data: Dict[str, Any]) -> None:
+        """由读取任务调用，放入一个分块"""
+        if self._finished:
+            return
+        if data.get("error"):
+            self.fail(FetchError(str(data["error"])))
+            return
+        try:
+            seq = int(data.get("seq", self._next_seq))
+            chunk = self._decode_chunk(data.get("chunk"), data.get("encoding", "utf-8"))
+        except (TypeError, ValueError) as e:
+            self.fail(FetchError(f"分块格式错误: {e}"))
+            return
+        if seq < self._next_seq or seq in self._out_of_order:
+            return
+        eof = bool(data.get("eof"))
+        if not chunk and not eof:
+            # 空分块不会交给消费者，也就不会被确认，占用的窗口额度永远不会归还
+            self.fail(FetchError("扩展发送了空分块"))
+            return
+
+        self._out_of_order[seq] = (chunk, eof)
+        if len(self._out_of_order) + len(self._ready) > self.window:
+            self.fail(FetchError("扩展发送的分块超出流控窗口"))
+            return
+
+        while self._next_seq in self._out_of_order:
+            chunk, eof = self._out_of_order.pop(self._next_seq)
+            self._next_seq += 1
+            if chunk:
+                self.bytes_received += len(chunk)
+                self._ready.append(chunk)
+            if eof:
+                self._ready.append(_EOF)
+                self._finish()
+                break
+        self._wakeup.set()
+
+    def feed_response(self, data: Any) -> None:
+        """扩展不支持分块时，把完整的 fetch_response 数据作为唯一的分块"""
+        self.feed({
+            "seq": self._next_seq,
+            "chunk": json.dumps(data, ensure_ascii=False),
+            "eof": True
+        })
+
+    def fail(self, exc: BaseException) -> None:
+        """结束流并让消费者收到异常"""
+        if self._finished:
+            return
+        self._error = exc
+        self._finish()
+        self._wakeup.set()
+
+    @staticmethod
+    def _decode_chunk(chunk: Any, encoding: str) -> bytes:
+        if chunk is None:
+            return b""
+        if isinstance(chunk, bytes):
+            return chunk
+        if encoding == "base64":
+            return base64.b64decode(chunk)
+        return chunk.encode("utf-8")
+
+    def __aiter__(self) -> AsyncIterator[bytes]:
+        return self
+
+    async def __anext__(self) -> bytes:
+        while not self._ready:
+            if self._error is not None:
+                raise self._error
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.idle_timeout)
+            except asyncio.TimeoutError:
+                self.fail(FetchTimeoutError(f"分块响应 {self.request_id} 等待超时"))
+
+        chunk = self._ready.popleft()
+        if chunk is _EOF:
+            self._ready.appendleft(_EOF)
+            raise StopAsyncIteration
+        await self._acknowledge()
+        return chunk
+
+    async def _acknowledge(self) -> None:
+        """消费者取走分块后补充扩展的发送额度"""
+        self._consumed += 1
+        if self._finished or self._consumed < max(1, self.window // 2):
+            return
+        credit, self._consumed = self._consumed, 0
+        await self.channel.send_message(Message.create_system_command(
+            CommandType.FETCH_ACK,
+            data={"credit": credit},
+            request_id=self.request_id
+        ))
+
+    async def read_all(self) -> bytes:
+        """读取完整的响应体"""
+        return b"".join([chunk async for chunk in self])
+
+    async def iter_lines(self) -> AsyncIterator[bytes]:
+        """按行产出响应体，适用于按行分隔的数据"""
+        buffer = b""
+        async for chunk in self:
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                yield line
+        if buffer:
+            yield buffer
+
+    async def iter_json_lines(self) -> AsyncIterator[Any]:
+        """按行解析 JSON 事件（NDJSON），跳过空行"""
+        async for line in self.iter_lines():
+            if line.strip():
+                yield json.loads(line)
+
+    async def to_file(self, path: str) -> int:
+        """把响应体写入磁盘文件，返回写入的字节数，写文件不阻塞事件循环"""
+        written = 0
+        file = await asyncio.to_thread(open, path, "wb")
+        try:
+            async for chunk in self:
+                await asyncio.to_thread(file.write, chunk)
+                written += len(chunk)
+        finally:
+            await asyncio.to_thread(file.close)
+        return written
+
+    async def aclose(self) -> None:
+        """提前结束读取，通知扩展停止发送"""
+        if self._finished:
+            return
+        self.fail(FetchError("分块响应已取消"))
+        await self.channel.send_message(Message.create_system_command(
+            CommandType.FETCH_ACK,
+            data={"credit": 0, "cancel": True},
+            request_id=self.request_id
+        ))
@@ -0,0 +1,91 @@
+"""Message 序列化基准测试
+
+对比逐字段校验 + json.dumps 的原始实现与当前的快速路径，输出每秒可处理的消息数。
+
+    python -m benchmarks.bench_message [--number 20000]
+"""
+import argparse
+import json
+import timeit
+from typing import Any, Callable, Dict, List, Tuple
+
+from app.models.message import Message, MessageRole, MessageType
+
+
+def legacy_create_response(content: str, data: Dict[str, Any]) -> Message:
+    """原始实现：经过 pydantic 校验构造"""
+    return Message(
+        type=MessageType.RESPONSE,
+        role=MessageRole.SYSTEM,
+        content=content,
+        sender="system",
+        data=data
+    )
+
+
+def legacy_to_json(message: Message) -> str:
+    """原始实现：手工构建字典后 json.dumps"""
+    return json.dumps({
+        "type": message.type,
+        "role": message.role,
+        "content": message.content,
+        "sender": message.sender,
+        "timestamp": message.timestamp.isoformat(),
+        "command": message.command,
+        "data": message.data,
+        "request_id": message.request_id
+    })
+
+
+def payloads() -> List[Tuple[str, str, Dict[str, Any]]]:
+    """小、中、大三种消息"""
+    return [
+        ("small", "收藏添加完成", {"code": 0}),
+        ("medium", "系统状态", {f"field_{i}": f"值 {i}" for i in range(20)}),
+        ("large", "", {
+            "code": 0,
+            "data": {f"item_{i}": {"id": i, "title": f"视频 {i}", "tags": ["a", "b"]} for i in range(500)}
+        })
+    ]
+
+
+def measure(func: Callable[[], Any], number: int) -> float:
+    """返回每秒执行次数"""
+    best = min(timeit.repeat(func, number=number, repeat=3))
+    return number / best
+
+
+def run(number: int) -> List[Dict[str, Any]]:
+    results = []
+    for name, content, data in payloads():
+        # 按消息体积减少大消息的迭代次数
+        count = max(number // (1 + len(json.dumps(data)) // 1000), 50)
+        fast = Message.create_response(content, data)
+        assert fast.to_json() == legacy_to_json(legacy_create_response(content, data))
+
+        legacy_rate = measure(lambda: legacy_to_json(legacy_create_response(content, data)), count)
+        fast_rate = measure(lambda: Message.create_response(content, data).to_json(), count)
+        results.append({
+            "payload": name,
+            "legacy_msgs_per_sec": legacy_rate,
+            "fast_msgs_per_sec": fast_rate,
+            "speedup": fast_rate / legacy_rate
+        })
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=20000, help="每轮迭代次数")
+    args = parser.parse_args()
+
+    print(f"{'payload':<8} {'legacy msg/s':>14} {'fast msg/s':>14} {'speedup':>8}")
+    for result in run(args.number):
+        print(
+            f"{result['payload']:<8} {result['legacy_msgs_per_sec']:>14,.0f} "
+            f"{result['fast_msgs_per_sec']:>14,.0f} {result['speedup']:>7.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,365 @@
+"""WebSocket 负载测试
+
+对本地运行的服务打开大量并发 /ws 连接，统计聊天回显、命令和获取数据往返的吞吐量与延迟分位数。
+一部分连接以 ?client=extension 模拟浏览器扩展，按设定的延迟和载荷大小回复 FETCH 和 PARAMS_REQUEST。
+
+    GATEWAY_TOKEN=secret uvicorn app.main:app --port 8000 &
+    GATEWAY_TOKEN=secret python -m benchmarks.loadtest --clients 2000 --extensions 50 --duration 30
+
+工作负载：
+    chat         聊天客户端发送聊天消息，等待回显
+    command      聊天客户端发送命令（默认 /status），等待响应
+    fetch_cmd    扩展客户端发送 /add_fav，经过两次参数请求和一次获取数据往返后收到响应
+    api_fetch    通过 HTTP 网关 POST /api/fetch，由在线扩展回复（--api-concurrency 大于 0 时）
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import resource
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import quote, urlsplit, urlunsplit
+
+import httpx
+import websockets
+
+Predicate = Callable[[Dict[str, Any]], bool]
+
+
+class Stats:
+    """按操作类型记录延迟和失败次数"""
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.connect_failures = 0
+
+    def record(self, op: str, latency: float) -> None:
+        self.latencies.setdefault(op, []).append(latency)
+
+    def error(self, op: str) -> None:
+        self.errors[op] = self.errors.get(op, 0) + 1
+
+    def report(self, duration: float) -> List[Dict[str, Any]]:
+        rows = []
+        for op in sorted(set(self.latencies) | set(self.errors)):
+            samples = sorted(self.latencies.get(op, []))
+            rows.append({
+                "op": op,
+                "count": len(samples),
+                "errors": self.errors.get(op, 0),
+                "per_sec": len(samples) / duration if duration > 0 else 0.0,
+                "p50_ms": percentile(samples, 50) * 1000,
+                "p95_ms": percentile(samples, 95) * 1000,
+                "p99_ms": percentile(samples, 99) * 1000,
+                "max_ms": (samples[-1] if samples else 0.0) * 1000
+            })
+        return rows
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """已排序样本的最近秩百分位数"""
+    if not samples:
+        return 0.0
+    rank = max(1, round(pct / 100 * len(samples)))
+    return samples[min(rank, len(samples)) - 1]
+
+
+class SimClient:
+    """模拟客户端：后台读取任务回复心跳，并把匹配的消息交给正在等待的请求
+
+    每个客户端同一时间只有一个进行中的请求（闭环），请求之间等待 think 秒。
+    """
+    query = ""
+
+    def __init__(self, name: str, args: argparse.Namespace, stats: Stats):
+        self.name = name
+        self.args = args
+        self.stats = stats
+        self.ws = None
+        self._waiter: Optional[Tuple[Predicate, asyncio.Future]] = None
+        self._tasks: set = set()
+        self.closed = False
+
+    async def connect(self) -> None:
+        self.ws = await websockets.connect(
+            self.args.url + self.query_string(),
+            max_size=None,
+            # 服务端有应用层心跳，关闭协议层 ping 减少干扰
+            ping_interval=None,
+            open_timeout=self.args.timeout
+        )
+        # 欢迎消息
+        await self.ws.recv()
+
+    def query_string(self) -> str:
+        return self.query
+
+    async def send(self, payload: Dict[str, Any]) -> None:
+        await self.ws.send(json.dumps(payload))
+
+    def message(self, content: str, **fields: Any) -> Dict[str, Any]:
+        return {"type": "chat", "role": "user", "content": content, "sender": self.name, **fields}
+
+    async def read_loop(self) -> None:
+        try:
+            async for raw in self.ws:
+                data = json.loads(raw)
+                if data.get("command") == "ping":
+                    await self.send({"type": "pong", "role": "user", "content": "", "sender": self.name,
+                                     "request_id": data.get("request_id")})
+                elif self.handle(data):
+                    continue
+                elif self._waiter is not None and self._waiter[0](data):
+                    future = self._waiter[1]
+                    self._waiter = None
+                    if not future.done():
+                        future.set_result(data)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            # 连接被服务端关闭时让正在等待的请求立即失败
+            self.closed = True
+            if self._waiter is not None and not self._waiter[1].done():
+                self._waiter[1].set_exception(ConnectionError("连接已关闭"))
+
+    def handle(self, data: Dict[str, Any]) -> bool:
+        """处理服务端主动发来的请求，返回是否已处理"""
+        return False
+
+    def spawn(self, coro) -> None:
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def request(self, op: str, payload: Dict[str, Any], predicate: Predicate) -> None:
+        """发送一条消息并等待匹配的回复，记录往返时间"""
+        future = asyncio.get_running_loop().create_future()
+        self._waiter = (predicate, future)
+        started = time.perf_counter()
+        try:
+            await self.send(payload)
+            reply = await asyncio.wait_for(future, self.args.timeout)
+        except (asyncio.TimeoutError, ConnectionError, websockets.ConnectionClosed):
+            self._waiter = None
+            self.stats.error(op)
+            return
+        if reply.get("type") == "error":
+            self.stats.error(op)
+        else:
+            self.stats.record(op, time.perf_counter() - started)
+
+    async def workload(self, stop: asyncio.Event) -> None:
+        pass
+
+    async def run(self, stop: asyncio.Event) -> None:
+        reader = asyncio.ensure_future(self.read_loop())
+        try:
+            await self.workload(stop)
+            await stop.wait()
+        finally:
+            reader.cancel()
+            for task in list(self._tasks):
+                task.cancel()
+            await self.ws.close()
+
+    async def think(self) -> None:
+        if self.args.think > 0:
+            # 加入抖动，避免所有客户端同时发送
+            await asyncio.sleep(self.args.think * random.uniform(0.5, 1.5))
+
+
+class ChatClient(SimClient):
+    """聊天页面：发送聊天消息和命令"""
+    async def workload(self, stop: asyncio.Event) -> None:
+        for seq in itertools.count():
+            if stop.is_set() or self.closed:
+                return
+            if random.random() < self.args.command_ratio:
+                await self.request(
+                    "command",
+                    self.message(self.args.command),
+                    lambda data: data.get("type") in ("response", "error")
+                )
+            else:
+                content = f"load {self.name} {seq}"
+                await self.request(
+                    "chat",
+                    self.message(content),
+                    lambda data, content=content: data.get("type") == "chat" and data.get("content") == content
+                )
+            await self.think()
+
+
+class ExtensionClient(SimClient):
+    """浏览器扩展：按设定延迟回复获取数据和参数请求，可选地自己发起 /add_fav"""
+    query = "?client=extension"
+
+    def __init__(self, name: str, args: argparse.Namespace, stats: Stats):
+        super().__init__(name, args, stats)
+        self.body = "x" * args.payload_size
+
+    def query_string(self) -> str:
+        # 注册为扩展需要网关令牌
+        return f"{self.query}&token={quote(self.args.gateway_token)}"
+
+    def handle(self, data: Dict[str, Any]) -> bool:
+        command = data.get("command")
+        if command == "fetch":
+            self.spawn(self.reply_fetch(data))
+            return True
+        if command == "params_request":
+            self.spawn(self.send(self.message("1", request_id=data.get("request_id"))))
+            return True
+        return False
+
+    async def reply_fetch(self, data: Dict[str, Any]) -> None:
+        if self.args.latency > 0:
+            await asyncio.sleep(self.args.latency / 1000)
+        await self.send({
+            "type": "fetch_response",
+            "role": "agent",
+            "content": "",
+            "sender": self.name,
+            "request_id": data.get("request_id"),
+            "data": {"status": 200, "code": 0, "body": self.body}
+        })
+
+    async def workload(self, stop: asyncio.Event) -> None:
+        if not self.args.extension_commands:
+            return
+        while not stop.is_set() and not self.closed:
+            await self.request(
+                "fetch_cmd",
+                self.message("/add_fav"),
+                lambda data: data.get("type") in ("response", "error")
+            )
+            await self.think()
+
+
+async def api_worker(client: httpx.AsyncClient, url: str, stats: Stats, stop: asyncio.Event, worker: int) -> None:
+    """通过 HTTP 网关发送获取数据请求，每次使用不同的 URL 并跳过缓存"""
+    for seq in itertools.count():
+        if stop.is_set():
+            return
+        body = {"url": f"https://example.com/load/{worker}/{seq}", "method": "GET", "cache": "bypass"}
+        started = time.perf_counter()
+        try:
+            response = await client.post(url, json=body)
+        except httpx.HTTPError:
+            stats.error("api_fetch")
+            continue
+        if response.status_code == 200:
+            stats.record("api_fetch", time.perf_counter() - started)
+        else:
+            stats.error("api_fetch")
+            if response.status_code == 503:
+                # 还没有扩展在线
+                await asyncio.sleep(0.1)
+
+
+def http_base(ws_url: str) -> str:
+    parts = urlsplit(ws_url)
+    scheme = "https" if parts.scheme == "wss" else "http"
+    return urlunsplit((scheme, parts.netloc, "", "", ""))
+
+
+def raise_fd_limit(needed: int) -> None:
+    """尽量提高文件描述符上限，数千个连接时默认的 1024 不够"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    target = needed if hard == resource.RLIM_INFINITY else min(needed, hard)
+    if soft < target:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+
+
+async def run(args: argparse.Namespace) -> Tuple[Stats, float, int]:
+    stats = Stats()
+    clients: List[SimClient] = [ExtensionClient(f"ext-{i}", args, stats) for i in range(args.extensions)]
+    clients += [ChatClient(f"chat-{i}", args, stats) for i in range(args.clients)]
+
+    # 限制同时建立的连接数，避免握手风暴
+    semaphore = asyncio.Semaphore(args.connect_concurrency)
+
+    async def connect(client: SimClient) -> bool:
+        async with semaphore:
+            try:
+                await client.connect()
+                return True
+            except (OSError, asyncio.TimeoutError, websockets.WebSocketException):
+                stats.connect_failures += 1
+                return False
+
+    connect_started = time.perf_counter()
+    connected = [client for client, ok in zip(clients, await asyncio.gather(*map(connect, clients))) if ok]
+    print(f"已连接 {len(connected)}/{len(clients)}，耗时 {time.perf_counter() - connect_started:.1f}s")
+
+    stop = asyncio.Event()
+    tasks = [asyncio.ensure_future(client.run(stop)) for client in connected]
+    http_client = None
+    if args.api_concurrency > 0:
+        http_client = httpx.AsyncClient(base_url=http_base(args.url), timeout=args.timeout,
+                                        headers={"X-Gateway-Token": args.gateway_token},
+                                        limits=httpx.Limits(max_connections=args.api_concurrency))
+        tasks += [
+            asyncio.ensure_future(api_worker(http_client, "/api/fetch", stats, stop, worker))
+            for worker in range(args.api_concurrency)
+        ]
+
+    started = time.perf_counter()
+    await asyncio.sleep(args.duration)
+    stop.set()
+    duration = time.perf_counter() - started
+    await asyncio.gather(*tasks, return_exceptions=True)
+    if http_client is not None:
+        await http_client.aclose()
+    return stats, duration, len(connected)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="ws://127.0.0.1:8000/ws", help="WebSocket 地址")
+    parser.add_argument("--clients", type=int, default=1000, help="聊天客户端数")
+    parser.add_argument("--extensions", type=int, default=10, help="模拟扩展客户端数")
+    parser.add_argument("--duration", type=float, default=30, help="测试时长（秒）")
+    parser.add_argument("--think", type=float, default=1.0, help="每个客户端两次请求之间的平均间隔（秒）")
+    parser.add_argument("--command-ratio", type=float, default=0.2, help="聊天客户端发送命令的比例")
+    parser.add_argument("--command", default="/status", help="聊天客户端发送的命令")
+    parser.add_argument("--latency", type=float, default=50, help="扩展回复获取数据请求前的延迟（毫秒）")
+    parser.add_argument("--payload-size", type=int, default=1024, help="扩展回复的响应体大小（字节）")
+    parser.add_argument("--extension-commands", action="store_true", help="扩展客户端循环发送 /add_fav")
+    parser.add_argument("--api-concurrency", type=int, default=0, help="通过 HTTP 网关并发获取数据的请求数")
+    parser.add_argument("--connect-concurrency", type=int, default=200, help="同时进行的握手数")
+    parser.add_argument("--timeout", type=float, default=30, help="单次请求超时（秒）")
+    parser.add_argument("--gateway-token", default=os.environ.get("GATEWAY_TOKEN", ""),
+                        help="网关令牌，扩展注册和 /api/fetch 需要，默认读取 GATEWAY_TOKEN")
+    parser.add_argument("--json", help="把结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    raise_fd_limit(args.clients + args.extensions + args.api_concurrency + 256)
+    stats, duration, connected = asyncio.run(run(args))
+    rows = stats.report(duration)
+
+    print(f"{'op':<10} {'count':>8} {'errors':>7} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for row in rows:
+        print(
+            f"{row['op']:<10} {row['count']:>8} {row['errors']:>7} {row['per_sec']:>9,.1f} "
+            f"{row['p50_ms']:>8.1f} {row['p95_ms']:>8.1f} {row['p99_ms']:>8.1f} {row['max_ms']:>8.1f}"
+        )
+    if stats.connect_failures:
+        print(f"连接失败: {stats.connect_failures}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({
+                "args": {key: value for key, value in vars(args).items() if key != "gateway_token"},
+                "connected": connected,
+                "connect_failures": stats.connect_failures,
+                "duration": duration,
+                "results": rows
+            }, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
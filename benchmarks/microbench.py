@@ -0,0 +1,251 @@
+"""核心数据路径的微基准测试
+
+覆盖每条消息都要经过的开销：Message 各个工厂方法、to_json、收到消息的解码和校验、
+大历史记录下的 ChatContext 读写，以及 CommandHandler 的命令分发。结果以每次操作的纳秒数表示。
+
+    python -m benchmarks.microbench                  # 运行并输出结果
+    python -m benchmarks.microbench --save           # 保存为基线
+    python -m benchmarks.microbench --check          # 与基线比较，任一项变慢超过阈值时退出码为 1
+
+基线与机器相关，更换测试机器后需要用 --save 重新生成。
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import timeit
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import app.websocket  # noqa: F401  先导入 websocket 包，避免命令模块的循环导入
+from app.models.message import CommandType, Message, MessageRole, MessageType
+from app.websocket.codec import MessageCodec, MsgPackCodec, msgpack
+from app.websocket.command_handler import CommandHandler
+from app.websocket.context import ChatContext, ContextManager
+from app.websocket.history import MessageHistory
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+# 默认允许的变慢比例
+DEFAULT_THRESHOLD = 0.25
+# 历史记录规模
+HISTORY_SIZES = (1000, 10000, 100000)
+
+# 基准测试函数接收迭代次数，返回总耗时（秒）
+Runner = Callable[[int], float]
+
+
+def sync_runner(func: Callable[[], Any]) -> Runner:
+    return lambda number: timeit.timeit(func, number=number)
+
+
+def async_runner(func: Callable[[], Any]) -> Runner:
+    """在同一个事件循环中连续执行协程，避免把事件循环启动开销计入结果"""
+    loop = asyncio.new_event_loop()
+
+    async def batch(number: int) -> float:
+        started = timeit.default_timer()
+        for _ in range(number):
+            await func()
+        return timeit.default_timer() - started
+
+    return lambda number: loop.run_until_complete(batch(number))
+
+
+LARGE_DATA = {
+    "code": 0,
+    "data": {f"item_{i}": {"id": i, "title": f"视频 {i}", "tags": ["a", "b"]} for i in range(500)}
+}
+
+
+def message_benchmarks() -> List[Tuple[str, Runner, int]]:
+    """Message 工厂方法、序列化和收到消息的解析"""
+    small = Message.create_response("收藏添加完成", {"code": 0})
+    large = Message.create_fetch_response(LARGE_DATA, request_id="r1")
+    chat = Message(type=MessageType.CHAT, role=MessageRole.USER, content="你好", sender="用户")
+    json_frame = chat.to_json()
+    msgpack_frame = MsgPackCodec().encode(chat) if msgpack is not None else None
+    json_codec = MessageCodec()
+    parsed = json_codec.decode(json_frame)
+
+    benchmarks = [
+        ("message.create_response", sync_runner(lambda: Message.create_response("完成", {"code": 0})), 200000),
+        ("message.create_error", sync_runner(lambda: Message.create_error("出错了")), 200000),
+        ("message.create_command", sync_runner(lambda: Message.create_command("help", "用户")), 200000),
+        ("message.create_system_command", sync_runner(
+            lambda: Message.create_system_command(CommandType.FETCH, {"url": "https://a.com"}, "r1")
+        ), 200000),
+        ("message.create_fetch_response", sync_runner(
+            lambda: Message.create_fetch_response({"code": 0}, request_id="r1")
+        ), 200000),
+        ("message.validate_chat", sync_runner(
+            lambda: Message(type=MessageType.CHAT, role=MessageRole.USER, content="你好", sender="用户")
+        ), 50000),
+        ("message.to_json.small", sync_runner(small.to_json), 100000),
+        ("message.to_json.large", sync_runner(large.to_json), 200),
+        ("inbound.json_decode", sync_runner(lambda: json_codec.decode(json_frame)), 100000),
+        ("inbound.model_validate", sync_runner(lambda: Message.model_validate(parsed)), 50000),
+    ]
+    if msgpack_frame is not None:
+        msgpack_codec = MsgPackCodec()
+        benchmarks.append(("inbound.msgpack_decode", sync_runner(lambda: msgpack_codec.decode(msgpack_frame)), 100000))
+    return benchmarks
+
+
+def make_context(size: int) -> ChatContext:
+    """已写满 size 条消息的上下文，每 10 条中有 1 条命令响应"""
+    context = ChatContext(
+        conversation_id="bench",
+        message_history=MessageHistory(max_messages=size, max_bytes=sys.maxsize)
+    )
+    chat = Message(type=MessageType.CHAT, role=MessageRole.USER, content="你好", sender="用户")
+    response = Message.create_response("完成", {"code": 0})
+    for i in range(size):
+        context.add_message(response if i % 10 == 0 else chat, 100)
+    return context
+
+
+def context_benchmarks() -> List[Tuple[str, Runner, int]]:
+    """大历史记录下的上下文读写，写入时已达到上限，每次写入都会淘汰最早的消息"""
+    benchmarks = []
+    chat = Message(type=MessageType.CHAT, role=MessageRole.USER, content="你好", sender="用户")
+    for size in HISTORY_SIZES:
+        # 写入会改变历史中的消息类型分布，读写各用一个上下文
+        writer = make_context(size)
+        context = make_context(size)
+        benchmarks += [
+            (f"context.add_message[{size}]", sync_runner(lambda writer=writer: writer.add_message(chat, 100)), 100000),
+            (f"context.get_last_n_messages[{size}]", sync_runner(
+                lambda context=context: context.get_last_n_messages(50)
+            ), 50000),
+            (f"context.get_messages_by_type[{size}]", sync_runner(
+                lambda context=context: context.get_messages_by_type(MessageType.RESPONSE)
+            ), max(10, 1000000 // size)),
+        ]
+    return benchmarks
+
+
+class NullChannel:
+    """只编码不发送的通道，计入序列化开销但不经过发送队列"""
+    codec = MessageCodec()
+
+    async def send_message(self, message: Message, priority: int = 0) -> None:
+        self.codec.encode(message)
+
+
+def command_benchmarks() -> List[Tuple[str, Runner, int]]:
+    """命令分发：查找命令、执行并发送响应"""
+    handler = CommandHandler(ContextManager())
+    channel = NullChannel()
+    help_message = Message.create_command("help", "用户")
+    unknown_message = Message.create_command("nope", "用户")
+    return [
+        ("command.get_command", sync_runner(lambda: handler.get_command(CommandType.HELP)), 200000),
+        ("command.dispatch.help", async_runner(
+            lambda: handler.handle_command(channel, help_message, "bench")
+        ), 20000),
+        ("command.dispatch.unknown", async_runner(
+            lambda: handler.handle_command(channel, unknown_message, "bench")
+        ), 20000),
+    ]
+
+
+SUITES = {
+    "message": message_benchmarks,
+    "context": context_benchmarks,
+    "command": command_benchmarks,
+}
+
+
+def run(
+    scale: float = 1.0,
+    repeat: int = 5,
+    pattern: Optional[str] = None,
+    names: Optional[Iterable[str]] = None
+) -> Dict[str, float]:
+    """运行基准测试，返回每次操作的纳秒数（取多轮中最快的一轮）
+
+    pattern 按名称子串过滤，names 只运行指定的基准。
+    """
+    names = set(names) if names is not None else None
+    results = {}
+    for suite in SUITES.values():
+        for name, runner, number in suite():
+            if pattern and pattern not in name:
+                continue
+            if names is not None and name not in names:
+                continue
+            number = max(1, int(number * scale))
+            runner(max(1, number // 10))  # 预热
+            best = min(runner(number) for _ in range(repeat))
+            results[name] = best / number * 1e9
+    return results
+
+
+def compare(results: Dict[str, float], baseline: Dict[str, float], threshold: float) -> List[str]:
+    """返回比基线慢超过阈值的基准名称"""
+    return [
+        name for name, value in results.items()
+        if baseline.get(name) and value > baseline[name] * (1 + threshold)
+    ]
+
+
+def load_baseline(path: str) -> Dict[str, float]:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)["results"]
+
+
+def save_baseline(path: str, results: Dict[str, float]) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "results": {name: round(value, 1) for name, value in sorted(results.items())}
+        }, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", type=float, default=1.0, help="迭代次数的缩放比例")
+    parser.add_argument("--repeat", type=int, default=5, help="每项重复的轮数，取最快的一轮")
+    parser.add_argument("--filter", help="只运行名称包含该字符串的基准")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="基线文件路径")
+    parser.add_argument("--save", action="store_true", help="把结果保存为基线")
+    parser.add_argument("--check", action="store_true", help="与基线比较，有退化时退出码为 1")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="允许的变慢比例，默认 0.25")
+    args = parser.parse_args()
+
+    results = run(args.scale, args.repeat, args.filter)
+    baseline = load_baseline(args.baseline) if os.path.exists(args.baseline) else {}
+
+    print(f"{'benchmark':<40} {'ns/op':>14} {'baseline':>14} {'change':>8}")
+    for name, value in results.items():
+        base = baseline.get(name)
+        change = f"{value / base - 1:+.0%}" if base else ""
+        base_text = f"{base:,.0f}" if base else "-"
+        print(f"{name:<40} {value:>14,.0f} {base_text:>14} {change:>8}")
+
+    if args.save:
+        save_baseline(args.baseline, {**baseline, **results})
+        print(f"基线已保存到 {args.baseline}")
+    if args.check:
+        if not baseline:
+            sys.exit(f"基线文件 {args.baseline} 不存在，请先用 --save 生成")
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            # 单次测量受机器负载影响，超过阈值的项再测一次，两次都慢才算退化
+            retried = run(args.scale, args.repeat * 2, names=regressions)
+            results.update({name: min(results[name], value) for name, value in retried.items()})
+            regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} 项超过 {args.threshold:.0%} 阈值:")
+            for name in regressions:
+                base, value = baseline[name], results[name]
+                print(f"  {name}: {base:,.0f} ns -> {value:,.0f} ns (+{value / base - 1:.0%})")
+            sys.exit(1)
+        print(f"\n没有超过 {args.threshold:.0%} 阈值的退化")
+
+
+if __name__ == "__main__":
+    main()
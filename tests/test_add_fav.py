@@ -0,0 +1,65 @@
+import asyncio
+import json
+import pytest
+
+from app.websocket.channel import WebSocketChannel
+from app.websocket.connection import WebSocketConnection
+from app.websocket.context import ContextManager
+from app.commands.add_fav_command import AddFavBulkCommand
+from app.models.message import Message
+from tests.utils import FakeWebSocket
+
+
+@pytest.mark.asyncio
+async def test_bulk_add_fav_respects_window_and_aggregates():
+    """测试批量收藏限制在途请求数并汇总每个条目的结果"""
+    websocket = FakeWebSocket()
+    channel = WebSocketChannel(websocket)
+    await channel.accept()
+    command = AddFavBulkCommand(ContextManager())
+    message = Message.create_command(
+        "add_fav_bulk", "测试用户", add_media_ids="99", rids=["1,2", "3", "2", "--window=2"]
+    )
+
+    task = asyncio.create_task(command.execute(channel, message, "conversation"))
+    answered = 0
+    while answered < 3:
+        sent = await websocket.wait_sent(answered + 1)
+        await asyncio.sleep(0.01)
+        # 同时在途的请求不超过窗口大小
+        assert len(websocket.sent) - answered <= 2
+        frame = sent[answered]
+        code = -1 if "rid=2&" in frame["data"]["data"] else 0
+        response = Message.create_fetch_response(
+            {"code": code, "message": "失败" if code else "0"}, request_id=frame["request_id"]
+        )
+        await websocket.incoming.put(response.to_json())
+        answered += 1
+
+    await task
+    result = json.loads(websocket.sent[-1])
+    assert result["content"] == "批量收藏完成: 成功 2，失败 1"
+    assert result["data"]["succeeded"] == ["1", "3"]
+    assert result["data"]["failed"] == [{"rid": "2", "error": "失败"}]
+    await channel.close()
+
+
+@pytest.mark.asyncio
+async def test_bulk_add_fav_flags_before_media_id():
+    """测试选项写在收藏夹ID之前时不会被当作收藏夹ID，缺少收藏夹ID时返回用法"""
+    websocket = FakeWebSocket()
+    connection = WebSocketConnection(ContextManager(), heartbeat_interval=0)
+    await connection.initialize_connection(websocket)
+
+    await connection.handle_command_message("/add_fav_bulk --window=4", "测试用户")
+    error = (await websocket.wait_sent(2))[-1]
+    assert error["type"] == "error" and "/add_fav_bulk <收藏夹ID>" in error["content"]
+
+    task = asyncio.create_task(connection.handle_command_message("/add_fav_bulk --window=4 99 1", "测试用户"))
+    frame = (await websocket.wait_sent(3))[-1]
+    assert "rid=1&add_media_ids=99" in frame["data"]["data"]
+    response = Message.create_fetch_response({"code": 0}, request_id=frame["request_id"])
+    await websocket.incoming.put(response.to_json())
+    await task
+    assert (await websocket.wait_sent(4))[-1]["data"]["succeeded"] == ["1"]
+    await connection.cleanup()
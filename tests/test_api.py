@@ -0,0 +1,122 @@
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+from app.main import app
+from app.routes import auth
+from app.routes.chat import context_manager, session_registry
+from app.websocket.registry import CLIENT_EXTENSION
+
+HEADERS = {"X-Gateway-Token": "secret"}
+EXTENSION_URL = "/ws?client=extension&token=secret"
+
+
+@pytest.fixture(autouse=True)
+def gateway_token(monkeypatch):
+    monkeypatch.setattr(auth, "GATEWAY_TOKEN", "secret")
+
+
+def test_gateway_requires_token(monkeypatch):
+    """测试网关接口和扩展注册都需要令牌，未配置令牌时网关不可用"""
+    with TestClient(app) as client:
+        body = {"url": "https://example.com", "method": "GET"}
+        assert client.post("/api/fetch", json=body).status_code == 403
+        assert client.post("/api/fetch/stream", json=body, headers={"X-Gateway-Token": "wrong"}).status_code == 403
+        with pytest.raises(WebSocketDisconnect):
+            with client.websocket_connect("/ws?client=extension&token=wrong") as ws:
+                ws.receive_json()
+
+        monkeypatch.setattr(auth, "GATEWAY_TOKEN", "")
+        assert client.post("/api/fetch", json=body, headers=HEADERS).status_code == 404
+        with pytest.raises(WebSocketDisconnect):
+            with client.websocket_connect(EXTENSION_URL) as ws:
+                ws.receive_json()
+
+
+def test_fetch_returns_503_without_extension():
+    """测试没有扩展在线时返回 503"""
+    with TestClient(app) as client:
+        response = client.post("/api/fetch", json={"url": "https://example.com", "method": "POST"}, headers=HEADERS)
+        assert response.status_code == 503
+
+
+def test_fetch_routes_to_extension():
+    """测试 HTTP 请求转发给扩展连接，并返回对应请求的响应"""
+    with TestClient(app) as client, client.websocket_connect(EXTENSION_URL) as extension:
+        extension.receive_json()
+        result = {}
+
+        def call():
+            result["response"] = client.post(
+                "/api/fetch", json={"url": "https://example.com/a", "method": "POST", "data": {"k": 1}}, headers=HEADERS
+            )
+
+        caller = threading.Thread(target=call)
+        caller.start()
+        command = extension.receive_json()
+        assert command["command"] == "fetch"
+        assert command["data"]["url"] == "https://example.com/a"
+        extension.send_json({
+            "type": "fetch_response",
+            "request_id": command["request_id"],
+            "data": {"status": 200, "body": "ok"}
+        })
+        caller.join(5)
+
+        response = result["response"]
+        assert response.status_code == 200
+        assert response.json() == {"request_id": command["request_id"], "data": {"status": 200, "body": "ok"}}
+
+
+def test_fetch_stream_returns_chunks():
+    """测试流式接口按顺序返回扩展发送的分块"""
+    with TestClient(app) as client, client.websocket_connect(EXTENSION_URL) as extension:
+        extension.receive_json()
+        result = {}
+
+        def call():
+            result["response"] = client.post(
+                "/api/fetch/stream", json={"url": "https://example.com/big", "method": "GET"}, headers=HEADERS
+            )
+
+        caller = threading.Thread(target=call)
+        caller.start()
+        command = extension.receive_json()
+        assert command["data"]["stream"] == {"window": 16}
+        for seq, chunk in ((1, "world"), (0, "hello ")):
+            extension.send_json({
+                "type": "fetch_chunk",
+                "request_id": command["request_id"],
+                "data": {"seq": seq, "chunk": chunk, "eof": seq == 1}
+            })
+        caller.join(5)
+
+        response = result["response"]
+        assert response.status_code == 200
+        assert response.content == b"hello world"
+        assert response.headers["x-request-id"] == command["request_id"]
+
+
+def test_fetch_without_data_returns_502():
+    """测试扩展的响应缺少数据时返回 502，并刷新扩展对话的活跃时间"""
+    with TestClient(app) as client, client.websocket_connect(EXTENSION_URL) as extension:
+        extension.receive_json()
+        (session,) = session_registry.get_by_kind(CLIENT_EXTENSION)
+        context = context_manager.get_context(session.current_context)
+        before = context.last_active
+        result = {}
+
+        def call():
+            result["response"] = client.post(
+                "/api/fetch", json={"url": "https://example.com/a", "method": "POST"}, headers=HEADERS
+            )
+
+        caller = threading.Thread(target=call)
+        caller.start()
+        command = extension.receive_json()
+        assert context.last_active > before
+        extension.send_json({"type": "fetch_response", "request_id": command["request_id"]})
+        caller.join(5)
+        assert result["response"].status_code == 502
@@ -0,0 +1,155 @@
+import asyncio
+import pytest
+
+from app.websocket.channel import POLICY_DISCONNECT, POLICY_DROP_LOW, PRIORITY_LOW, WebSocketChannel
+from app.websocket.context import ContextManager
+from app.commands.fetch_command import FetchCommand, FetchCommandData
+from app.commands.fetch_cache import FetchCache
+from app.models.message import Message
+from app.exceptions import ChannelClosedError, FetchTimeoutError
+from tests.utils import FakeWebSocket
+
+
+@pytest.mark.asyncio
+async def test_concurrent_fetches_resolve_out_of_order():
+    """测试同一连接上的多个获取请求可以乱序返回"""
+    websocket = FakeWebSocket()
+    channel = WebSocketChannel(websocket)
+    await channel.accept()
+    command = FetchCommand(ContextManager())
+    command.cache = FetchCache()
+
+    requests = [FetchCommandData(url=f"https://example.com/{i}", method="GET") for i in range(3)]
+    task = asyncio.create_task(command.fetch_many(channel, requests))
+
+    sent = await websocket.wait_sent(3)
+    # 中间夹一条普通聊天消息，不能被当作响应
+    await websocket.incoming.put('{"type": "chat", "content": "hi", "sender": "u"}')
+    for frame in reversed(sent):
+        url = frame["data"]["url"]
+        response = Message.create_fetch_response({"url": url}, request_id=frame["request_id"])
+        await websocket.incoming.put(response.to_json())
+
+    responses = await task
+    assert [r.data["url"] for r in responses] == [r.url for r in requests]
+    assert (await channel.receive_json())["content"] == "hi"
+    assert channel.pending_requests == {}
+    await channel.close()
+
+
+@pytest.mark.asyncio
+async def test_fetch_timeout_and_disconnect():
+    """测试请求超时和连接断开时等待中的请求失败"""
+    websocket = FakeWebSocket()
+    channel = WebSocketChannel(websocket)
+    await channel.accept()
+    command = FetchCommand(ContextManager())
+    command.cache = FetchCache()
+    data = FetchCommandData(url="https://example.com", method="GET")
+
+    with pytest.raises(FetchTimeoutError):
+        await command.fetch(channel, data, timeout=0.01)
+    assert channel.pending_requests == {}
+
+    task = asyncio.create_task(command.fetch(channel, data))
+    await websocket.wait_sent(2)
+    await websocket.incoming.put(None)
+    with pytest.raises(ChannelClosedError):
+        await task
+    await channel.close()
+
+
+@pytest.mark.asyncio
+async def test_fetch_batch_streams_results_as_they_complete():
+    """测试批量获取只发送一条消息，并按完成顺序产出结果"""
+    websocket = FakeWebSocket()
+    channel = WebSocketChannel(websocket)
+    await channel.accept()
+    command = FetchCommand(ContextManager())
+    command.cache = FetchCache()
+    requests = [FetchCommandData(url=f"https://example.com/{i}", method="GET") for i in range(3)]
+
+    results = command.fetch_batch(channel, requests, timeout=1)
+    first = asyncio.ensure_future(results.__anext__())
+    (batch,) = await websocket.wait_sent(1)
+    assert batch["command"] == "fetch_batch"
+    items = batch["data"]["requests"]
+    assert [item["url"] for item in items] == [r.url for r in requests]
+
+    order = []
+    for index in (2, 0, 1):
+        response = Message.create_fetch_response({"index": index}, request_id=items[index]["request_id"])
+        await websocket.incoming.put(response.to_json())
+        result = await (first if index == 2 else results.__anext__())
+        assert result.ok and result.response.data["index"] == result.index
+        order.append(result.index)
+
+    assert order == [2, 0, 1]
+    with pytest.raises(StopAsyncIteration):
+        await results.__anext__()
+    assert channel.pending_requests == {}
+    await channel.close()
+
+
+class SlowWebSocket(FakeWebSocket):
+    """发送在 release 之前一直阻塞，模拟接收很慢的客户端"""
+    def __init__(self):
+        super().__init__()
+        self.release = asyncio.Event()
+
+    async def send_text(self, data: str) -> None:
+        await self.release.wait()
+        await super().send_text(data)
+
+
+@pytest.mark.asyncio
+async def test_send_queue_policies():
+    """测试发送队列满时丢弃低优先级消息或断开连接"""
+    websocket = SlowWebSocket()
+    channel = WebSocketChannel(websocket, send_queue_size=2, send_policy=POLICY_DROP_LOW)
+    # 第一条被写入任务取出后阻塞在发送上，随后两条占满队列
+    for i in range(3):
+        await channel.send_message(Message.create_response(str(i)))
+        await asyncio.sleep(0)
+    assert channel.queue_depth == 2
+    await channel.send_message(Message.create_response("low"), PRIORITY_LOW)
+    assert channel.queue_depth == 2
+
+    websocket.release.set()
+    sent = await websocket.wait_sent(3)
+    assert [frame["content"] for frame in sent] == ["0", "1", "2"]
+
+    websocket = SlowWebSocket()
+    channel = WebSocketChannel(websocket, send_queue_size=1, send_policy=POLICY_DISCONNECT)
+    for i in range(2):
+        await channel.send_message(Message.create_response(str(i)))
+        await asyncio.sleep(0)
+    with pytest.raises(ChannelClosedError):
+        await channel.send_message(Message.create_response("overflow"))
+    assert websocket.closed
+    with pytest.raises(ChannelClosedError):
+        await channel.send_message(Message.create_response("after"))
+
+
+@pytest.mark.asyncio
+async def test_disconnect_while_waiting_for_queue_space():
+    """测试等待发送队列空间期间客户端断开，请求以 ChannelClosedError 失败而不是 KeyError"""
+    websocket = SlowWebSocket()
+    channel = WebSocketChannel(websocket, send_queue_size=1)
+    await channel.accept()
+    command = FetchCommand(ContextManager())
+    command.cache = FetchCache()
+    for i in range(2):
+        await channel.send_message(Message.create_response(str(i)))
+        await asyncio.sleep(0)
+
+    task = asyncio.create_task(command.fetch(channel, FetchCommandData(url="https://example.com", method="GET")))
+    await asyncio.sleep(0)
+    await websocket.incoming.put(None)
+    await asyncio.sleep(0.01)
+    websocket.release.set()
+    with pytest.raises(ChannelClosedError):
+        await asyncio.wait_for(task, 1)
+    with pytest.raises(ChannelClosedError):
+        await channel.wait_response("unknown")
+    await channel.close()
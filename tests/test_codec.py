@@ -0,0 +1,94 @@
+import json
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.models.message import Message, CommandType
+from app.websocket.codec import MessageCodec, negotiate_codec, MSGPACK_SUBPROTOCOL
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+requires_msgpack = pytest.mark.skipif(msgpack is None, reason="未安装 msgpack")
+client = TestClient(app)
+
+
+@requires_msgpack
+def test_negotiate_codec():
+    """测试子协议协商"""
+    assert negotiate_codec([]).subprotocol == "chat.json"
+    assert negotiate_codec(["other", MSGPACK_SUBPROTOCOL]).subprotocol == MSGPACK_SUBPROTOCOL
+
+
+@requires_msgpack
+def test_msgpack_matches_json_fields():
+    """测试二进制编码与 JSON 编码字段一致"""
+    message = Message.create_system_command(CommandType.FETCH, data={"url": "https://a.com"}, request_id="r1")
+    codec = negotiate_codec([MSGPACK_SUBPROTOCOL])
+    assert msgpack.unpackb(codec.encode(message)) == json.loads(MessageCodec().encode(message))
+    assert codec.encode_text(message.to_json()) == codec.encode(message)
+
+
+@requires_msgpack
+def test_msgpack_connection():
+    """测试协商为 MessagePack 后的收发"""
+    with client.websocket_connect("/ws", subprotocols=[MSGPACK_SUBPROTOCOL]) as websocket:
+        assert websocket.accepted_subprotocol == MSGPACK_SUBPROTOCOL
+        welcome = msgpack.unpackb(websocket.receive_bytes())
+        assert welcome["type"] == "system"
+
+        websocket.send_bytes(msgpack.packb({"type": "chat", "role": "user", "content": "二进制", "sender": "u"}))
+        assert msgpack.unpackb(websocket.receive_bytes())["content"] == "二进制"
+
+        websocket.send_bytes(b"\xc1")
+        response = msgpack.unpackb(websocket.receive_bytes())
+        assert response["type"] == "error"
+        assert response["content"] == "消息格式错误"
+
+
+def test_json_connection_has_no_subprotocol_by_default():
+    """测试未请求子协议时保持 JSON 文本"""
+    with client.websocket_connect("/ws") as websocket:
+        assert websocket.accepted_subprotocol is None
+        assert websocket.receive_json()["type"] == "system"
+
+
+def test_compressed_codec_threshold_and_metrics():
+    """测试超过阈值的消息被压缩并记录节省的字节数"""
+    from app.websocket.codec import CompressedCodec, COMPRESSION_SAVED_BYTES
+
+    codec = CompressedCodec(MessageCodec(), threshold=1024, level=6)
+    small = Message.create_response("小消息")
+    assert codec.encode(small) == small.to_json()
+
+    big = Message.create_fetch_response({"items": [{"id": i, "title": "标题"} for i in range(500)]})
+    saved_before = COMPRESSION_SAVED_BYTES.get(direction="outbound")
+    frame = codec.encode(big)
+    assert isinstance(frame, bytes) and len(frame) < len(big.to_json()) / 5
+    assert COMPRESSION_SAVED_BYTES.get(direction="outbound") - saved_before == len(big.to_json()) - len(frame)
+    assert codec.decode(frame) == json.loads(big.to_json())
+    assert codec.decode(small.to_json())["content"] == "小消息"
+
+    # 客户端发来压缩后更大的帧时，节省的字节数不减少
+    import zlib
+    tiny = zlib.compress(small.to_json().encode("utf-8"), 0)
+    inbound_before = COMPRESSION_SAVED_BYTES.get(direction="inbound")
+    assert codec.decode(tiny)["content"] == "小消息"
+    assert COMPRESSION_SAVED_BYTES.get(direction="inbound") == inbound_before
+
+
+def test_deflate_connection():
+    """测试协商压缩后大消息以压缩二进制收发"""
+    import zlib
+
+    with client.websocket_connect("/ws", subprotocols=["chat.json+deflate"]) as websocket:
+        assert websocket.accepted_subprotocol == "chat.json+deflate"
+        assert websocket.receive_json()["type"] == "system"
+
+        content = "重复内容" * 5000
+        payload = json.dumps({"type": "chat", "role": "user", "content": content, "sender": "u"})
+        websocket.send_bytes(zlib.compress(payload.encode("utf-8")))
+        echoed = websocket.receive_bytes()
+        assert json.loads(zlib.decompress(echoed))["content"] == content
@@ -0,0 +1,80 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.models.message import Message
+from app.websocket.connection import WebSocketConnection
+from app.websocket.context import ContextManager
+from app.websocket.registry import SessionRegistry
+from tests.utils import FakeWebSocket
+
+
+@pytest.mark.asyncio
+async def test_sweep_evicts_idle_contexts_and_users():
+    """测试清理空闲对话，并移除没有对话引用的空闲用户"""
+    manager = ContextManager(idle_ttl=60)
+    evicted = []
+    manager.add_eviction_listener(lambda conversation_id, context: evicted.append(conversation_id))
+    await manager.create_context("old", "u1", "甲")
+    await manager.create_context("new", "u2", "乙")
+    now = datetime.now() + timedelta(seconds=30)
+    manager.active_contexts["old"].last_active = now - timedelta(seconds=120)
+    manager.user_contexts["u1"].last_active = now - timedelta(seconds=120)
+
+    assert await manager.sweep(now) == 1
+    assert evicted == ["old"]
+    assert list(manager.active_contexts) == ["new"]
+    assert list(manager.user_contexts) == ["u2"]
+
+
+@pytest.mark.asyncio
+async def test_capacity_evicts_least_recently_active():
+    """测试超出对话数和消息总数上限时按最近活跃时间清理"""
+    manager = ContextManager(idle_ttl=0, max_contexts=2, max_messages=3)
+    for name in ("a", "b"):
+        await manager.create_context(name, name, name)
+    manager.get_context("a").add_message(Message.create_response("a"))
+    await manager.create_context("c", "c", "c")
+    assert set(manager.active_contexts) == {"a", "c"}
+
+    for _ in range(3):
+        manager.get_context("c").add_message(Message.create_response("c"))
+    assert await manager.sweep() == 1
+    assert set(manager.active_contexts) == {"c"}
+
+
+@pytest.mark.asyncio
+async def test_close_ends_connection():
+    """测试服务端主动关闭会话后连接处理结束并清理"""
+    manager = ContextManager()
+    registry = SessionRegistry()
+    connection = WebSocketConnection(manager, registry=registry)
+    fake = FakeWebSocket()
+    handler = asyncio.create_task(connection.handle_connection(fake))
+    await fake.wait_sent(1)
+
+    await connection.close("会话已断开")
+    await asyncio.wait_for(handler, 1)
+    assert fake.closed
+    assert (await fake.wait_sent(2))[-1]["content"] == "会话已断开"
+    assert len(registry) == 0 and not manager.active_contexts
+
+
+@pytest.mark.asyncio
+async def test_any_inbound_frame_keeps_context_active():
+    """测试收到任何消息（包括心跳回复）都会刷新对话的活跃时间，不被当作空闲清理"""
+    manager = ContextManager(idle_ttl=60)
+    connection = WebSocketConnection(manager, registry=SessionRegistry(), heartbeat_interval=0)
+    fake = FakeWebSocket()
+    handler = asyncio.create_task(connection.handle_connection(fake))
+    await fake.wait_sent(1)
+    context = manager.get_context(connection.current_context)
+    context.last_active = datetime.now() - timedelta(seconds=120)
+
+    await fake.incoming.put('{"type": "pong", "request_id": "late"}')
+    await asyncio.sleep(0.01)
+    assert await manager.sweep() == 0
+
+    await fake.incoming.put(None)
+    await asyncio.wait_for(handler, 1)
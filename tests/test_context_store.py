@@ -0,0 +1,113 @@
+import asyncio
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.models.message import Message
+from app.websocket.context import ContextManager
+from app.storage.context_store import SQLiteContextStore
+from app.websocket.connection import WebSocketConnection
+from tests.utils import FakeWebSocket
+
+
+@pytest.mark.asyncio
+async def test_workers_share_users_through_sqlite(tmp_path):
+    """测试两个进程的上下文管理器通过同一个 SQLite 文件共享用户信息"""
+    path = str(tmp_path / "context.db")
+    store_a, store_b = SQLiteContextStore(path), SQLiteContextStore(path)
+    worker_a = ContextManager(context_store=store_a)
+    worker_b = ContextManager(context_store=store_b)
+
+    context = await worker_a.create_context("c1", "u1", "游客")
+    await worker_b.create_context("c2", "u1", "游客")
+    await worker_a.update_username("u1", "甲")
+    assert (await worker_b.get_user_context("u1")).username == "甲"
+
+    for _ in range(3):
+        context.add_message(Message.create_response("hi"))
+    # 计数写回前只在本进程可见
+    assert (await worker_b.get_user_context("u1")).message_count == 0
+    assert (await worker_a.get_user_context("u1")).message_count == 3
+    await store_a.flush()
+    assert (await worker_b.get_user_context("u1")).message_count == 3
+
+    # 没有其他进程写入时读取命中本地缓存
+    hits = store_b.cache_hits
+    await worker_b.get_user_context("u1")
+    assert store_b.cache_hits == hits + 1
+
+    await store_a.close()
+    await store_b.close()
+
+
+@pytest.mark.asyncio
+async def test_locked_database_does_not_block_event_loop(tmp_path):
+    """测试其他进程持有写锁时，存储操作在线程中等待，事件循环照常运行"""
+    path = str(tmp_path / "context.db")
+    store = SQLiteContextStore(path)
+    manager = ContextManager(context_store=store)
+    await manager.create_context("c1", "u1", "游客")
+
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+    closing = asyncio.create_task(manager.close_context("c1"))
+    started = time.monotonic()
+    await asyncio.sleep(0.05)
+    assert time.monotonic() - started < 0.5
+    assert not closing.done()
+
+    other.execute("COMMIT")
+    other.close()
+    await asyncio.wait_for(closing, 5)
+    await store.close()
+
+
+@pytest.mark.asyncio
+async def test_reconnect_with_user_id_reads_shared_user(tmp_path):
+    """测试带上用户ID重连到另一个 worker 时读到同一用户，无效的用户ID被替换"""
+    path = str(tmp_path / "context.db")
+    store_a, store_b = SQLiteContextStore(path), SQLiteContextStore(path)
+    worker_a = WebSocketConnection(ContextManager(context_store=store_a), heartbeat_interval=0)
+    fake = FakeWebSocket()
+    await worker_a.initialize_connection(fake)
+    user_id = (await fake.wait_sent(1))[0]["data"]["user_id"]
+    await worker_a.context_manager.update_username(user_id, "甲")
+    await worker_a.cleanup()
+
+    worker_b = WebSocketConnection(ContextManager(context_store=store_b), heartbeat_interval=0)
+    fake = FakeWebSocket()
+    fake.query_params = {"user_id": user_id}
+    await worker_b.initialize_connection(fake)
+    assert worker_b.user_id == user_id
+    assert worker_b.context_manager.user_contexts[user_id].username == "甲"
+    await worker_b.cleanup()
+
+    other = WebSocketConnection(ContextManager(), heartbeat_interval=0)
+    fake = FakeWebSocket()
+    fake.query_params = {"user_id": "../bad id"}
+    await other.initialize_connection(fake)
+    assert other.user_id != "../bad id"
+    await other.cleanup()
+    await store_a.close()
+    await store_b.close()
+
+
+@pytest.mark.asyncio
+async def test_sweep_removes_orphaned_conversations(tmp_path):
+    """测试退出的 worker 留下的对话过期后被其他 worker 清理，其用户随之删除"""
+    path = str(tmp_path / "context.db")
+    crashed_store, store = SQLiteContextStore(path), SQLiteContextStore(path)
+    crashed = ContextManager(context_store=crashed_store, idle_ttl=60)
+    await crashed.create_context("orphan", "u1", "甲")
+    await crashed_store.close()
+
+    worker = ContextManager(context_store=store, idle_ttl=60)
+    await worker.create_context("live", "u2", "乙")
+    later = datetime.now() + timedelta(seconds=120)
+    worker.active_contexts["live"].last_active = later
+    await worker.sweep(later)
+    assert await store.get_user("u1") is None
+    assert await store.get_user("u2") is not None
+    await store.close()
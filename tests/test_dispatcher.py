@@ -0,0 +1,119 @@
+import pytest
+
+import app.websocket  # noqa: F401  先导入 websocket 包，避免命令模块的循环导入
+from app.commands.fetch_command import FetchCommandData
+from app.commands.fetch_dispatcher import FetchDispatcher
+from app.exceptions import ChannelClosedError, ExtensionUnavailableError
+from app.models.message import Message
+from app.websocket.registry import CLIENT_EXTENSION, SessionRegistry
+from app.websocket.stream import FetchStream
+
+
+class DummyExtension:
+    client_type = CLIENT_EXTENSION
+
+    def __init__(self, name: str):
+        self.user_id = name
+        self.current_context = name
+        self.websocket = name
+        self.touched = 0
+
+    def touch(self):
+        self.touched += 1
+
+
+class DummyFetchCommand:
+    """按通道名返回结果，dead 中的通道模拟请求进行中断开"""
+    def __init__(self, dead=(), cached=()):
+        self.dead = set(dead)
+        self.cached = set(cached)
+        self.calls = []
+
+    async def fetch_with_source(self, websocket, data, timeout, scope=None):
+        assert scope == websocket
+        self.calls.append(websocket)
+        if websocket in self.dead:
+            raise ChannelClosedError("连接已关闭")
+        return Message.create_fetch_response({"via": websocket}), websocket in self.cached
+
+    async def fetch_stream(self, websocket, data, window):
+        return FetchStream(DummyChannel(), "r1", window)
+
+
+class DummyChannel:
+    def close_stream(self, request_id):
+        pass
+
+
+def make_dispatcher(names, dead=(), cached=()):
+    registry = SessionRegistry()
+    sessions = [DummyExtension(name) for name in names]
+    for session in sessions:
+        registry.register(session.user_id, session.user_id, session)
+    return FetchDispatcher(registry, DummyFetchCommand(dead, cached)), sessions
+
+
+def test_select_prefers_least_loaded_and_honours_affinity():
+    """测试按进行中请求数和延迟选择扩展，亲和键固定到同一个扩展"""
+    dispatcher, (a, b) = make_dispatcher(["a", "b"])
+    dispatcher.stats_for(a).latency = 0.1
+    dispatcher.stats_for(b).latency = 0.5
+    assert dispatcher.select() is a
+    dispatcher.stats_for(a).in_flight = 9
+    assert dispatcher.select() is b
+
+    assert dispatcher.select("example.com") is b
+    dispatcher.stats_for(a).in_flight = 0
+    assert dispatcher.select("example.com") is b
+    assert dispatcher.select() is a
+
+
+@pytest.mark.asyncio
+async def test_fetch_fails_over_for_idempotent_requests():
+    """测试扩展中途断开时幂等请求换一个扩展重试，非幂等请求直接失败"""
+    dispatcher, (a, b) = make_dispatcher(["a", "b"], dead={"a"})
+    dispatcher.stats_for(b).latency = 10
+
+    response = await dispatcher.fetch(FetchCommandData(url="https://example.com", method="GET"))
+    assert response.data == {"via": "b"}
+    assert dispatcher.fetch_command.calls == ["a", "b"]
+    assert dispatcher.stats_for(a).in_flight == 0 and dispatcher.stats_for(a).failures == 1
+
+    dispatcher.stats_for(b).latency = 10
+    with pytest.raises(ChannelClosedError):
+        await dispatcher.fetch(FetchCommandData(url="https://example.com", method="POST"))
+
+
+def test_select_without_extensions():
+    """测试没有扩展在线时报错"""
+    dispatcher, _ = make_dispatcher([])
+    with pytest.raises(ExtensionUnavailableError):
+        dispatcher.select()
+
+
+@pytest.mark.asyncio
+async def test_cache_hits_do_not_update_latency():
+    """测试缓存命中不计入扩展延迟，真实往返才计入"""
+    dispatcher, (a,) = make_dispatcher(["a"], cached=["a"])
+    await dispatcher.fetch(FetchCommandData(url="https://a.com", method="GET"))
+    assert dispatcher.stats_for(a).completed == 1
+    assert dispatcher.stats_for(a).latency is None
+
+    dispatcher.fetch_command.cached.clear()
+    await dispatcher.fetch(FetchCommandData(url="https://a.com", method="GET"))
+    assert dispatcher.stats_for(a).latency is not None
+
+
+@pytest.mark.asyncio
+async def test_streams_count_as_in_flight_until_finished():
+    """测试分块请求在结束前计入进行中请求数"""
+    dispatcher, (a,) = make_dispatcher(["a"])
+    stream = await dispatcher.fetch_stream(FetchCommandData(url="https://a.com", method="GET"))
+    assert dispatcher.stats_for(a).in_flight == 1
+    stream.feed({"seq": 0, "chunk": "done", "eof": True})
+    assert dispatcher.stats_for(a).in_flight == 0
+    assert await stream.read_all() == b"done"
+
+    stream = await dispatcher.fetch_stream(FetchCommandData(url="https://a.com", method="GET"))
+    stream.fail(ChannelClosedError("连接已关闭"))
+    assert dispatcher.stats_for(a).in_flight == 0
@@ -0,0 +1,142 @@
+import asyncio
+import pytest
+
+from app.commands import fetch_cache as fetch_cache_module
+from app.commands.fetch_cache import CacheMode, FetchCache
+from app.commands.fetch_command import FetchCommand, FetchCommandData
+from app.websocket.channel import WebSocketChannel
+from app.websocket.context import ContextManager
+from app.models.message import Message
+from tests.utils import FakeWebSocket
+
+
+def test_cache_key_normalizes_headers():
+    """测试缓存键忽略请求头大小写和无关请求头"""
+    cache = FetchCache()
+    a = cache.make_key("get", "https://a.com/x", {"Accept": "json", "X-Trace": "1"}, None)
+    b = cache.make_key("GET", "https://a.com/x", {"accept": "json "}, "")
+    c = cache.make_key("GET", "https://a.com/x", {"accept": "html"}, None)
+    assert a == b
+    assert a != c
+
+
+def test_cache_ttl_rules_and_expiry(monkeypatch):
+    """测试按域名和路径配置过期时间"""
+    now = [1000.0]
+    monkeypatch.setattr(fetch_cache_module.time, "monotonic", lambda: now[0])
+    cache = FetchCache(default_ttl=10, ttl_rules={"a.com": 60, "a.com/live": 0})
+    assert cache.ttl_for("https://a.com/list?page=1") == 60
+    assert cache.ttl_for("https://a.com/live/room") == 0
+    assert cache.ttl_for("https://a.com/lively") == 60
+    assert cache.ttl_for("https://b.com/") == 10
+
+    key = cache.make_key("GET", "https://b.com/", None, None)
+    cache.set(key, {"v": 1})
+    assert cache.get(key) == {"v": 1}
+    now[0] += 11
+    assert cache.get(key) is None
+
+    live_key = cache.make_key("GET", "https://a.com/live/room", None, None)
+    cache.set(live_key, {"v": 1})
+    assert len(cache) == 0
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_cache_lru_eviction():
+    """测试超出条数上限时淘汰最久未使用的条目"""
+    cache = FetchCache(max_entries=2)
+    before = [counter.get() for counter in (
+        fetch_cache_module.CACHE_HITS, fetch_cache_module.CACHE_MISSES, fetch_cache_module.CACHE_EVICTIONS
+    )]
+    keys = [cache.make_key("GET", f"https://a.com/{i}", None, None) for i in range(3)]
+    cache.set(keys[0], {"i": 0})
+    cache.set(keys[1], {"i": 1})
+    cache.get(keys[0])
+    cache.set(keys[2], {"i": 2})
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) == {"i": 0}
+    assert cache.stats()["evictions"] == 1
+
+    # 命中、未命中和淘汰次数同时导出到 /metrics
+    after = [counter.get() for counter in (
+        fetch_cache_module.CACHE_HITS, fetch_cache_module.CACHE_MISSES, fetch_cache_module.CACHE_EVICTIONS
+    )]
+    assert [a - b for a, b in zip(after, before)] == [2, 1, 1]
+    assert FetchCache().max_entries == fetch_cache_module.FETCH_CACHE_MAX_ENTRIES
+
+
+def test_cache_returns_independent_copies():
+    """测试修改写入的数据或命中返回的数据都不会影响缓存"""
+    cache = FetchCache()
+    key = cache.make_key("GET", "https://a.com/x", None, None)
+    value = {"items": [1]}
+    cache.set(key, value)
+    value["items"].append(2)
+
+    hit = cache.get(key)
+    assert hit == {"items": [1]}
+    hit["items"].append(3)
+    hit["extra"] = True
+    assert cache.get(key) == {"items": [1]}
+
+
+@pytest.mark.asyncio
+async def test_fetch_uses_cache_modes():
+    """测试获取数据时的缓存命中、跳过和刷新"""
+    websocket = FakeWebSocket()
+    channel = WebSocketChannel(websocket)
+    await channel.accept()
+    command = FetchCommand(ContextManager())
+    command.cache = FetchCache()
+
+    async def fetch_with_reply(data, value):
+        task = asyncio.create_task(command.fetch(channel, data))
+        sent = await websocket.wait_sent(len(websocket.sent) + 1)
+        assert "cache" not in sent[-1]["data"]
+        await websocket.incoming.put(
+            Message.create_fetch_response({"v": value}, request_id=sent[-1]["request_id"]).to_json()
+        )
+        return await task
+
+    data = FetchCommandData(url="https://a.com/list", method="GET")
+    assert (await fetch_with_reply(data, 1)).data == {"v": 1}
+    assert (await command.fetch(channel, data)).data == {"v": 1}
+
+    refresh = FetchCommandData(url="https://a.com/list", method="GET", cache=CacheMode.REFRESH)
+    assert (await fetch_with_reply(refresh, 2)).data == {"v": 2}
+    assert (await command.fetch(channel, data)).data == {"v": 2}
+
+    bypass = FetchCommandData(url="https://a.com/list", method="GET", cache=CacheMode.BYPASS)
+    assert (await fetch_with_reply(bypass, 3)).data == {"v": 3}
+    assert (await command.fetch(channel, data)).data == {"v": 2}
+
+    post = FetchCommandData(url="https://a.com/list", method="POST")
+    assert (await fetch_with_reply(post, 4)).data == {"v": 4}
+    assert len(websocket.sent) == 4
+    await channel.close()
+
+
+@pytest.mark.asyncio
+async def test_fetch_scopes_do_not_share_cache_or_flights():
+    """测试不同作用域（不同扩展）的相同请求既不共享缓存，也不合并为一次发送"""
+    a, b = FakeWebSocket(), FakeWebSocket()
+    channel_a, channel_b = WebSocketChannel(a), WebSocketChannel(b)
+    await channel_a.accept()
+    await channel_b.accept()
+    command = FetchCommand(ContextManager())
+    command.cache = FetchCache()
+    data = FetchCommandData(url="https://a.com/me", method="GET")
+
+    task_a = asyncio.create_task(command.fetch(channel_a, data, scope="a"))
+    task_b = asyncio.create_task(command.fetch(channel_b, data, scope="b"))
+    for websocket, account in ((a, "甲"), (b, "乙")):
+        (frame,) = await websocket.wait_sent(1)
+        await websocket.incoming.put(
+            Message.create_fetch_response({"account": account}, request_id=frame["request_id"]).to_json()
+        )
+    assert (await task_a).data == {"account": "甲"}
+    assert (await task_b).data == {"account": "乙"}
+    assert (await command.fetch(channel_b, data, scope="b")).data == {"account": "乙"}
+    await channel_a.close()
+    await channel_b.close()
@@ -0,0 +1,64 @@
+import asyncio
+import json
+
+import pytest
+
+from app.exceptions import ChannelClosedError
+from app.models.message import Message
+from app.websocket.channel import REQUEST_FETCH
+from app.websocket.connection import WebSocketConnection
+from app.websocket.context import ContextManager
+from app.websocket.registry import SessionRegistry
+from tests.utils import FakeWebSocket
+
+
+@pytest.mark.asyncio
+async def test_ping_records_rtt():
+    """测试心跳回复后记录往返时间"""
+    fake = FakeWebSocket()
+    connection = WebSocketConnection(ContextManager(), heartbeat_interval=0)
+    handler = asyncio.create_task(connection.handle_connection(fake))
+    await fake.wait_sent(1)
+
+    ping = asyncio.create_task(connection.websocket.ping(1))
+    frame = (await fake.wait_sent(2))[-1]
+    assert frame["command"] == "ping"
+    await fake.incoming.put(json.dumps({"type": "pong", "request_id": frame["request_id"]}))
+    assert await ping >= 0
+    assert connection.websocket.rtt is not None
+
+    await fake.incoming.put(None)
+    await asyncio.wait_for(handler, 1)
+
+
+@pytest.mark.asyncio
+async def test_silent_connection_is_reaped():
+    """测试连续多次心跳无回复的连接被断开，等待中的请求失败并清理上下文"""
+    manager = ContextManager()
+    registry = SessionRegistry()
+    fake = FakeWebSocket()
+    connection = WebSocketConnection(manager, registry=registry, heartbeat_interval=0.05, max_missed_heartbeats=2)
+    handler = asyncio.create_task(connection.handle_connection(fake))
+    await fake.wait_sent(1)
+    _, pending = connection.websocket.create_request(REQUEST_FETCH)
+
+    await asyncio.wait_for(handler, 1)
+    with pytest.raises(ChannelClosedError):
+        await pending
+    assert fake.closed
+    assert len(registry) == 0 and not manager.active_contexts
+
+
+@pytest.mark.asyncio
+async def test_any_inbound_frame_counts_as_alive():
+    """测试心跳无回复但持续收到其他消息时不断开"""
+    fake = FakeWebSocket()
+    connection = WebSocketConnection(ContextManager(), heartbeat_interval=0.05, max_missed_heartbeats=1)
+    handler = asyncio.create_task(connection.handle_connection(fake))
+    for _ in range(6):
+        await asyncio.sleep(0.03)
+        await fake.incoming.put(Message.create_response("still here").to_json())
+    assert not handler.done()
+
+    await fake.incoming.put(None)
+    await asyncio.wait_for(handler, 1)
@@ -0,0 +1,66 @@
+import pytest
+
+from app.websocket.connection import WebSocketConnection
+from app.websocket.history import MessageHistory
+from app.websocket.context import ChatContext, ContextManager
+from app.models.message import Message, MessageType
+from tests.utils import FakeWebSocket
+
+
+def test_history_ring_buffer_and_indexes():
+    """测试历史记录按条数淘汰，并保持类型索引和序号"""
+    history = MessageHistory(max_messages=3, max_bytes=10 ** 6)
+    seqs = [
+        history.append(Message.create_response(f"r{i}")) if i % 2 == 0 else history.append(Message.create_error(f"e{i}"))
+        for i in range(5)
+    ]
+    assert seqs == [0, 1, 2, 3, 4]
+    assert [m.content for m in history] == ["r2", "e3", "r4"]
+    assert [m.content for m in history.by_type(MessageType.RESPONSE)] == ["r2", "r4"]
+    assert [m.content for m in history.by_type("error")] == ["e3"]
+    assert [m.content for m in history.last(2)] == ["e3", "r4"]
+    assert [entry.seq for entry in history.range(0, 4)] == [2, 3]
+    assert [entry.message.content for entry in history.range(4)] == ["r4"]
+
+    history.clear()
+    assert len(history) == 0 and history.by_type(MessageType.RESPONSE) == []
+    assert history.append(Message.create_response("after")) == 5
+
+
+def test_history_byte_limit():
+    """测试超出字节上限时淘汰最早的消息"""
+    one = len(Message.create_response("x" * 100).to_json())
+    history = MessageHistory(max_messages=100, max_bytes=one * 2)
+    for _ in range(5):
+        history.append(Message.create_response("x" * 100))
+    assert len(history) == 2
+    assert history.total_bytes == one * 2
+
+
+def test_context_uses_bounded_history():
+    """测试对话上下文的历史接口"""
+    context = ChatContext(conversation_id="c", message_history=MessageHistory(max_messages=2))
+    for i in range(3):
+        context.add_message(Message.create_response(str(i)))
+    assert [m.content for m in context.get_last_n_messages(5)] == ["1", "2"]
+    assert context.get_last_n_messages(0) == []
+    assert [m.content for m in context.get_messages_by_type(MessageType.RESPONSE)] == ["1", "2"]
+
+
+@pytest.mark.asyncio
+async def test_sent_messages_are_serialized_once(monkeypatch):
+    """测试发送的消息只编码一次，历史记录使用通道返回的长度"""
+    fake = FakeWebSocket()
+    connection = WebSocketConnection(ContextManager(), heartbeat_interval=0)
+    await connection.initialize_connection(fake)
+    calls = []
+    to_json = Message.to_json
+    monkeypatch.setattr(Message, "to_json", lambda self: calls.append(self) or to_json(self))
+
+    message = Message.create_fetch_response({"payload": "x" * 1000})
+    await connection.send_message(message)
+    assert len(calls) == 1
+    context = connection.context_manager.get_context(connection.current_context)
+    entry = context.get_messages_range(0)[-1]
+    assert entry.message is message and entry.size == len(to_json(message))
+    await connection.cleanup()
@@ -0,0 +1,111 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import app.websocket  # noqa: F401  先导入 websocket 包，避免命令模块的循环导入
+from app.commands.history_command import HistoryCommand
+from app.models.message import Message
+from app.storage.history_store import BatchingHistoryWriter, HistoryRecord, MemoryHistoryStore, SQLiteHistoryStore
+from app.websocket.channel import WebSocketChannel
+from app.websocket.context import ContextManager
+from tests.utils import FakeWebSocket
+
+
+@pytest.mark.asyncio
+async def test_sqlite_store_pages_with_cursor(tmp_path):
+    """测试 SQLite 存储按游标分页"""
+    store = SQLiteHistoryStore(str(tmp_path / "history.db"))
+    await store.append_many([
+        HistoryRecord("c", seq, Message.create_response(f"m{seq}")) for seq in range(7)
+    ])
+    page = await store.page("c", 3)
+    assert [message.content for _, message in page.messages] == ["m4", "m5", "m6"]
+    assert page.next_cursor == 4
+    page = await store.page("c", 3, page.next_cursor)
+    assert [seq for seq, _ in page.messages] == [1, 2, 3]
+    page = await store.page("c", 3, page.next_cursor)
+    assert [seq for seq, _ in page.messages] == [0] and page.next_cursor is None
+
+    await store.delete_conversation("c")
+    assert (await store.page("c", 3)).messages == []
+    await store.close()
+
+
+@pytest.mark.asyncio
+async def test_writer_batches_and_keeps_order():
+    """测试批量写入，删除操作在此前的写入之后执行"""
+    store = MemoryHistoryStore()
+    batches = []
+    append_many = store.append_many
+
+    async def record_batch(records):
+        batches.append(len(records))
+        await append_many(records)
+
+    store.append_many = record_batch
+    writer = BatchingHistoryWriter(store, max_batch=4, flush_interval=10)
+    for seq in range(10):
+        writer.submit(HistoryRecord("c", seq, Message.create_response(str(seq))))
+    await writer.delete_conversation("c")
+    writer.submit(HistoryRecord("c", 10, Message.create_response("10")))
+    await writer.flush()
+
+    assert batches == [4, 4, 2, 1]
+    page = await store.page("c", 10)
+    assert [seq for seq, _ in page.messages] == [10]
+    await writer.close()
+
+
+@pytest.mark.asyncio
+async def test_writer_delete_waits_when_queue_full():
+    """测试队列已满时删除操作等待写入任务腾出空间，而不是抛出 QueueFull"""
+    store = MemoryHistoryStore()
+    writer = BatchingHistoryWriter(store, flush_interval=0, max_queue=1)
+    writer.submit(HistoryRecord("c", 0, Message.create_response("0")))
+    await writer.delete_conversation("c")
+    await writer.flush()
+
+    assert (await store.page("c", 10)).messages == []
+    await writer.close()
+
+
+@pytest.mark.asyncio
+async def test_history_command_pages_persisted_messages():
+    """测试 /history 从持久化存储分页读取"""
+    manager = ContextManager(MemoryHistoryStore())
+    context = await manager.create_context("c", "u", "user")
+    for i in range(5):
+        context.add_message(Message.create_response(f"m{i}"))
+    fake = FakeWebSocket()
+    channel = WebSocketChannel(fake)
+    command = HistoryCommand(manager)
+
+    await command.execute(channel, Message.create_command("history", "user", count="2"), "c")
+    first = Message(**(await fake.wait_sent(1))[-1])
+    assert "m3" in first.content and "m4" in first.content
+    assert first.data == {"next_cursor": 3}
+
+    await command.execute(channel, Message.create_command("history", "user", count="2", cursor="3"), "c")
+    second = Message(**(await fake.wait_sent(2))[-1])
+    assert "m1" in second.content and "m2" in second.content
+    await manager.close()
+
+
+@pytest.mark.asyncio
+async def test_closed_and_evicted_conversations_are_deleted(tmp_path):
+    """测试对话关闭或被清理后，持久化的消息从存储中删除"""
+    store = SQLiteHistoryStore(str(tmp_path / "history.db"))
+    manager = ContextManager(store, idle_ttl=60)
+    for conversation_id in ("closed", "evicted", "kept"):
+        context = await manager.create_context(conversation_id, conversation_id, "user")
+        context.add_message(Message.create_response(conversation_id))
+
+    await manager.close_context("closed")
+    manager.active_contexts["evicted"].last_active = datetime.now() - timedelta(seconds=120)
+    await manager.sweep()
+    await manager.history_writer.flush()
+
+    assert (await store.page("closed", 10)).messages == []
+    assert (await store.page("evicted", 10)).messages == []
+    assert len((await store.page("kept", 10)).messages) == 1
+    await manager.close()
@@ -0,0 +1,54 @@
+import json
+import logging
+import time
+
+from app.logging_config import DebugRateLimitFilter, JsonFormatter, Payload, truncate
+
+
+def make_record(level: int = logging.DEBUG, msg: str = "收到数据: %s", args=("x",)) -> logging.LogRecord:
+    return logging.LogRecord("test", level, __file__, 1, msg, args, None)
+
+
+def test_truncate():
+    """测试超长载荷被截断并注明原长度"""
+    assert truncate("abc", 5) == "abc"
+    text = truncate("a" * 100, 10)
+    assert text.startswith("a" * 10)
+    assert "100" in text
+    assert str(Payload({"k": "v" * 100}, 8)).startswith("{'k': 'v")
+
+
+def test_payload_is_lazy():
+    """测试被过滤掉的日志不会格式化载荷"""
+    class Expensive:
+        def __repr__(self):
+            raise AssertionError("不应格式化")
+
+    logger = logging.getLogger("test.lazy")
+    logger.setLevel(logging.INFO)
+    logger.debug("数据: %s", Payload(Expensive()))
+
+
+def test_debug_rate_limit():
+    """测试同一处 DEBUG 日志超过频率后被丢弃，下个窗口报告丢弃条数"""
+    log_filter = DebugRateLimitFilter(rate=2, interval=0.05)
+    assert [log_filter.filter(make_record()) for _ in range(4)] == [True, True, False, False]
+    # 其他位置和更高级别的日志不受影响
+    assert log_filter.filter(make_record(msg="其他日志"))
+    assert log_filter.filter(make_record(level=logging.WARNING))
+
+    time.sleep(0.06)
+    record = make_record()
+    assert log_filter.filter(record)
+    assert record.suppressed == 2
+
+
+def test_json_formatter_truncates_extra():
+    """测试 JSON 格式保留 extra 字段并截断长字符串"""
+    record = make_record(logging.INFO)
+    record.conversation_id = "c1"
+    record.body = "b" * 10000
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry["message"] == "收到数据: x"
+    assert entry["conversation_id"] == "c1"
+    assert len(entry["body"]) < 1000
@@ -1,4 +1,5 @@
 import pytest
+from pydantic import ValidationError
 from fastapi.testclient import TestClient
 from fastapi.websockets import WebSocket
 from app.main import app
@@ -44,6 +45,10 @@ def test_message_factory_methods():
     assert cmd_msg.role == MessageRole.USER
     assert cmd_msg.command == CommandType.HELP
 
+    # 命令消息来自客户端输入，字段类型不对时校验失败
+    with pytest.raises(ValidationError):
+        Message.create_command("help", {"name": "测试用户"})
+
     # 测试响应消息创建
     resp_msg = Message.create_response("测试响应")
     assert resp_msg.type == MessageType.RESPONSE
@@ -56,6 +61,12 @@ def test_message_factory_methods():
     assert error_msg.role == MessageRole.SYSTEM
     assert error_msg.sender == "System"
 
+    # 跳过校验构造的消息仍然可以修改和复制
+    resp_msg.content = "修改后"
+    copied = resp_msg.model_copy(update={"request_id": "abc"})
+    assert copied.request_id == "abc" and copied.content == "修改后"
+    assert resp_msg.request_id is None
+
 def test_get_html_endpoint():
     """测试HTML页面端点"""
     response = client.get("/")
@@ -110,6 +121,8 @@ async def test_command_handling():
         assert response["type"] == "response"
         assert response["role"] == "system"
         assert "可用命令" in response["content"]
+        assert "/fetch_batch <url> [url ...]" in response["content"]
+        assert "/add_fav_bulk <收藏夹ID> [rid ...] [--window=N]" in response["content"]
         
         # 测试重命名命令
         rename_message = {
@@ -196,3 +209,70 @@ async def test_fetch_command():
         data = response["data"]
         assert isinstance(data, dict)
         assert data["content"] == "test_data"
+
+def test_command_params_routed_by_request_id():
+    """测试命令等待参数时，聊天消息和其他命令不会被当作参数值"""
+    with client.websocket_connect("/ws") as websocket:
+        # 跳过欢迎消息
+        websocket.receive_json()
+
+        websocket.send_json({"type": "chat", "role": "user", "content": "/add_fav", "sender": "测试用户"})
+        param_request = websocket.receive_json()
+        assert param_request["command"] == "params_request"
+        assert param_request["data"]["param_name"] == "rid"
+
+        # 等待参数期间的聊天消息和命令照常处理
+        websocket.send_json({"type": "chat", "role": "user", "content": "你好", "sender": "测试用户"})
+        assert websocket.receive_json()["content"] == "你好"
+        websocket.send_json({"type": "chat", "role": "user", "content": "/help", "sender": "测试用户"})
+        assert "可用命令" in websocket.receive_json()["content"]
+
+        for value in ("12345", "67890"):
+            websocket.send_json({
+                "type": "chat",
+                "role": "user",
+                "content": value,
+                "sender": "测试用户",
+                "request_id": param_request["request_id"]
+            })
+            param_request = websocket.receive_json()
+            if value == "12345":
+                assert param_request["data"]["param_name"] == "add_media_ids"
+
+        fetch_request = param_request
+        assert fetch_request["command"] == "fetch"
+        assert "rid=12345" in fetch_request["data"]["data"]
+        assert "add_media_ids=67890" in fetch_request["data"]["data"]
+
+        websocket.send_text(Message.create_fetch_response(
+            {"code": 0}, request_id=fetch_request["request_id"]
+        ).to_json())
+        response = websocket.receive_json()
+        assert response["type"] == "response"
+        assert response["content"] == "收藏添加完成"
+        assert response["data"] == {"code": 0}
+
+def test_message_to_json_matches_json_dumps():
+    """测试快速序列化与 json.dumps 逐字节一致"""
+    messages = [
+        Message.create_command("rename", "测试用户", new_name="新\"名字\"\n", count=None),
+        Message.create_system_command(CommandType.FETCH, data={"url": "https://a.com", "n": [1, 2.5, None]}, request_id="abc"),
+        Message.create_response("你好 \\ 世界 \U0001F600", {"nested": {"k": True}}),
+        Message.create_fetch_response({"content": "test_data"}),
+        Message.create_error("错误"),
+        Message(type=MessageType.CHAT, role=MessageRole.USER, content="hi", sender="u", timestamp=datetime(2024, 1, 2, 3, 4, 5, 6)),
+    ]
+    for message in messages:
+        expected = json.dumps({
+            "type": message.type,
+            "role": message.role,
+            "content": message.content,
+            "sender": message.sender,
+            "timestamp": message.timestamp.isoformat(),
+            "command": message.command,
+            "data": message.data,
+            "request_id": message.request_id
+        })
+        assert message.to_json() == expected
+        # 跳过校验构造的消息与校验构造的消息等价
+        assert Message(**message.model_dump()) == message
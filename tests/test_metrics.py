@@ -0,0 +1,44 @@
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.metrics import MetricsRegistry
+
+
+def test_render_prometheus_text():
+    """测试导出格式：HELP/TYPE 行、标签转义和直方图累计分桶"""
+    registry = MetricsRegistry()
+    counter = registry.counter("requests_total", "请求数", ("path",))
+    counter.inc(path='/a"b\\c')
+    histogram = registry.histogram("latency_seconds", "延迟", buckets=(0.1, 1.0))
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+
+    text = registry.render()
+    assert "# TYPE requests_total counter" in text
+    assert 'requests_total{path="/a\\"b\\\\c"} 1' in text
+    assert 'latency_seconds_bucket{le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{le="1.0"} 2' in text
+    assert 'latency_seconds_bucket{le="+Inf"} 3' in text
+    assert "latency_seconds_count 3" in text
+
+
+def test_metrics_endpoint():
+    """测试收发消息和执行命令后 /metrics 包含对应指标"""
+    with TestClient(app) as client:
+        with client.websocket_connect("/ws") as websocket:
+            websocket.receive_json()
+            websocket.send_json({"type": "chat", "role": "user", "content": "/help", "sender": "测试用户"})
+            websocket.receive_json()
+
+            response = client.get("/metrics")
+            assert response.status_code == 200
+            assert response.headers["content-type"].startswith("text/plain")
+            text = response.text
+            assert 'ws_connections{kind="chat"} 1' in text
+            assert 'ws_frames_total{direction="inbound",type="chat"}' in text
+            assert 'command_duration_seconds_bucket{command="help",le="+Inf"}' in text
+            assert "# TYPE fetch_rtt_seconds histogram" in text
+            assert "# TYPE errors_total counter" in text
+            assert "# TYPE fetch_cache_hits_total counter" in text
+            assert "fetch_cache_entries " in text
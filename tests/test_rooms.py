@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.metrics import Histogram
+from app.exceptions import ChannelClosedError
+from app.models.message import Message
+from app.websocket.channel import POLICY_BLOCK, WebSocketChannel
+from app.websocket.rooms import BROADCAST_SECONDS, RoomManager
+from tests.utils import FakeWebSocket
+
+
+def chat(content: str) -> dict:
+    return {"type": "chat", "role": "user", "content": content, "sender": "u"}
+
+
+def test_room_broadcast_reaches_all_members():
+    """测试加入聊天室后聊天消息广播给所有成员，离开后不再收到"""
+    with TestClient(app) as client, \
+            client.websocket_connect("/ws") as ws1, client.websocket_connect("/ws") as ws2:
+        ws1.receive_json()
+        ws2.receive_json()
+        for ws in (ws1, ws2):
+            ws.send_json(chat("/join ops"))
+            assert ws.receive_json()["content"] == "已加入聊天室: ops"
+
+        observed = BROADCAST_SECONDS.get()
+        ws1.send_json(chat("大家好"))
+        assert ws1.receive_json()["content"] == "大家好"
+        assert ws2.receive_json()["content"] == "大家好"
+
+        ws2.send_json(chat("/leave ops"))
+        assert ws2.receive_json()["content"] == "已离开聊天室: ops"
+        assert BROADCAST_SECONDS.get() == observed + 1
+        ws1.send_json(chat("还在吗"))
+        assert ws1.receive_json()["content"] == "还在吗"
+        # ws2 的历史里有广播收到的消息
+        ws2.send_json(chat("/history 10"))
+        assert "大家好" in ws2.receive_json()["content"]
+
+
+def test_histogram_samples_are_cumulative():
+    """测试直方图分桶计数是累积的"""
+    histogram = Histogram("test_seconds", "测试", buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5):
+        histogram.observe(value)
+    samples = {(name, labels.get("le")): value for name, labels, value in histogram.samples()}
+    assert samples[("test_seconds_bucket", "0.1")] == 1
+    assert samples[("test_seconds_bucket", "1.0")] == 2
+    assert samples[("test_seconds_bucket", "+Inf")] == 3
+    assert samples[("test_seconds_count", None)] == 3
+    assert histogram.get_sum() == 5.55
+
+
+class StuckWebSocket(FakeWebSocket):
+    """发送永远不返回，模拟不再读取的客户端"""
+    async def send_text(self, data: str) -> None:
+        await asyncio.Event().wait()
+
+
+@pytest.mark.asyncio
+async def test_slow_member_does_not_stall_broadcast():
+    """测试阻塞策略下，发送队列已满的成员丢弃广播，不拖住其他成员和发送方"""
+    rooms = RoomManager()
+    slow = WebSocketChannel(StuckWebSocket(), send_queue_size=1, send_policy=POLICY_BLOCK)
+    fast_socket = FakeWebSocket()
+    fast = WebSocketChannel(fast_socket, send_policy=POLICY_BLOCK)
+    rooms.join("ops", "slow", slow)
+    rooms.join("ops", "fast", fast)
+
+    results = []
+    for i in range(3):
+        results.append(await asyncio.wait_for(rooms.broadcast("ops", Message.create_response(str(i))), 1))
+        await asyncio.sleep(0)
+    assert [result.delivered for result in results] == [2, 2, 1]
+    assert [frame["content"] for frame in await fast_socket.wait_sent(3)] == ["0", "1", "2"]
+    assert rooms.members("ops") == ["slow", "fast"]
+    await slow.abort(ChannelClosedError("测试结束"))
+    await fast.close()
@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+from app import metrics
+from app.main import app
+from app.routes.chat import session_registry
+from app.websocket.connection import WebSocketConnection
+from app.websocket.context import ContextManager
+from app.websocket.registry import SessionRegistry
+from tests.utils import FakeWebSocket
+
+client = TestClient(app)
+
+
+class DummySession:
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+
+
+def test_registry_indexes():
+    """测试会话注册表的索引和快照遍历"""
+    registry = SessionRegistry()
+    a, b, c = DummySession("u1"), DummySession("u1"), DummySession("u2")
+    registry.register("c1", "u1", a)
+    registry.register("c2", "u1", b)
+    registry.register("c3", "u2", c)
+
+    assert len(registry) == 3
+    assert registry.get("c2") is b
+    assert set(registry.get_by_user("u1")) == {a, b}
+
+    # 遍历过程中注销会话不影响当前遍历
+    seen = []
+    for session in registry:
+        registry.unregister("c3")
+        seen.append(session)
+    assert len(seen) == 3
+    assert "c3" not in registry
+    assert registry.get_by_user("u2") == []
+
+    assert registry.unregister("c1") is a
+    assert registry.unregister("c1") is None
+    assert registry.get_by_user("u1") == [b]
+
+
+def test_connections_are_isolated():
+    """测试多个连接各自拥有独立的会话"""
+    with client.websocket_connect("/ws") as ws1, client.websocket_connect("/ws") as ws2:
+        ws1.receive_json()
+        ws2.receive_json()
+        assert len(session_registry) == 2
+
+        ws1.send_json({"type": "chat", "role": "user", "content": "/rename 甲", "sender": "甲"})
+        ws2.send_json({"type": "chat", "role": "user", "content": "来自二号", "sender": "乙"})
+
+        assert ws2.receive_json()["content"] == "来自二号"
+        assert ws1.receive_json()["content"] == "用户名已更改为: 甲"
+
+        ws2.send_json({"type": "chat", "role": "user", "content": "/status", "sender": "乙"})
+        status = ws2.receive_json()
+        assert status["data"]["username"] == "游客"
+
+    assert len(session_registry) == 0
+
+
+@pytest.mark.asyncio
+async def test_client_close_is_not_an_error():
+    """测试客户端正常断开时聊天循环安静退出，不记录错误也不再尝试发送"""
+    fake = FakeWebSocket()
+    connection = WebSocketConnection(ContextManager(), registry=SessionRegistry(), heartbeat_interval=0)
+    before = metrics.ERRORS.get(type="WebSocketDisconnect")
+    handler = asyncio.create_task(connection.handle_connection(fake))
+    await fake.wait_sent(1)
+
+    await fake.incoming.put(None)
+    await asyncio.wait_for(handler, 1)
+    assert len(fake.sent) == 1
+    assert metrics.ERRORS.get(type="WebSocketDisconnect") == before
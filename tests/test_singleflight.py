@@ -0,0 +1,78 @@
+import asyncio
+import pytest
+
+from app.commands.fetch_cache import FetchCache
+from app.commands.fetch_command import FetchCommand, FetchCommandData
+from app.commands.singleflight import SingleFlight
+from app.websocket.channel import WebSocketChannel
+from app.websocket.context import ContextManager
+from app.models.message import Message
+from app.exceptions import FetchTimeoutError
+from tests.utils import FakeWebSocket
+
+
+@pytest.mark.asyncio
+async def test_single_flight_shares_result_and_error():
+    """测试相同键的并发调用只执行一次，失败不缓存"""
+    flights = SingleFlight()
+    calls = []
+    gate = asyncio.Event()
+
+    async def work(value):
+        calls.append(value)
+        await gate.wait()
+        if value == "boom":
+            raise ValueError(value)
+        return value
+
+    tasks = [asyncio.create_task(flights.do("k", lambda: work("ok"))) for _ in range(3)]
+    await asyncio.sleep(0)
+    gate.set()
+    assert await asyncio.gather(*tasks) == ["ok"] * 3
+    assert calls == ["ok"]
+    assert flights.coalesced == 2
+    assert flights.in_flight() == 0
+
+    gate.clear()
+    tasks = [asyncio.create_task(flights.do("k", lambda: work("boom"))) for _ in range(2)]
+    await asyncio.sleep(0)
+    gate.set()
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    assert all(isinstance(result, ValueError) for result in results)
+
+    # 失败后再次调用会重新执行
+    assert await flights.do("k", lambda: work("again")) == "again"
+    assert calls == ["ok", "boom", "again"]
+
+
+@pytest.mark.asyncio
+async def test_identical_fetches_coalesce_across_connections():
+    """测试不同连接上相同的并发获取请求只发送一次"""
+    command = FetchCommand(ContextManager())
+    command.cache = FetchCache(default_ttl=0)
+    command.flights = SingleFlight()
+    websockets = [FakeWebSocket() for _ in range(3)]
+    channels = [WebSocketChannel(websocket) for websocket in websockets]
+    for channel in channels:
+        await channel.accept()
+
+    data = FetchCommandData(url="https://a.com/meta", method="GET")
+    tasks = [asyncio.create_task(command.fetch(channel, data)) for channel in channels]
+    (frame,) = await websockets[0].wait_sent(1)
+    await asyncio.sleep(0)
+    assert websockets[1].sent == [] and websockets[2].sent == []
+
+    await websockets[0].incoming.put(
+        Message.create_fetch_response({"v": 1}, request_id=frame["request_id"]).to_json()
+    )
+    responses = await asyncio.gather(*tasks)
+    assert [response.data for response in responses] == [{"v": 1}] * 3
+
+    # 超时错误同样传给所有等待者
+    tasks = [asyncio.create_task(command.fetch(channel, data, timeout=0.01)) for channel in channels]
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    assert all(isinstance(result, FetchTimeoutError) for result in results)
+    assert command.flights.in_flight() == 0
+
+    for channel in channels:
+        await channel.close()
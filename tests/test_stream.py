@@ -0,0 +1,101 @@
+import base64
+import json
+import pytest
+
+from app.websocket.channel import WebSocketChannel
+from app.websocket.context import ContextManager
+from app.commands.fetch_command import FetchCommand, FetchCommandData
+from app.exceptions import ChannelClosedError, FetchError
+from tests.utils import FakeWebSocket
+
+
+def chunk_frame(request_id, seq, chunk, eof=False, encoding="utf-8"):
+    return json.dumps({
+        "type": "fetch_chunk",
+        "request_id": request_id,
+        "data": {"seq": seq, "chunk": chunk, "encoding": encoding, "eof": eof}
+    })
+
+
+async def open_stream(window=4):
+    websocket = FakeWebSocket()
+    channel = WebSocketChannel(websocket)
+    await channel.accept()
+    command = FetchCommand(ContextManager())
+    data = FetchCommandData(url="https://a.com/big", method="GET")
+    stream = await command.fetch_stream(channel, data, window=window)
+    (request,) = await websocket.wait_sent(1)
+    assert request["data"]["stream"] == {"window": window}
+    return websocket, channel, stream, request["request_id"]
+
+
+@pytest.mark.asyncio
+async def test_stream_reorders_chunks_and_grants_credit():
+    """测试乱序分块按序号重组，并在消费后补充额度"""
+    websocket, channel, stream, request_id = await open_stream(window=4)
+    await websocket.incoming.put(chunk_frame(request_id, 1, '{"a": 2}\n'))
+    await websocket.incoming.put(chunk_frame(request_id, 0, '{"a": 1}\n'))
+    assert await stream.__anext__() == b'{"a": 1}\n'
+    assert await stream.__anext__() == b'{"a": 2}\n'
+
+    # 取走半个窗口后回复 fetch_ack 补充额度
+    ack = (await websocket.wait_sent(2))[1]
+    assert ack["command"] == "fetch_ack"
+    assert ack["request_id"] == request_id
+    assert ack["data"] == {"credit": 2}
+
+    await websocket.incoming.put(chunk_frame(request_id, 3, '{"a": 4}', eof=True))
+    await websocket.incoming.put(chunk_frame(request_id, 2, base64.b64encode(b'{"a": 3}\n').decode(), encoding="base64"))
+    events = [event async for event in stream.iter_json_lines()]
+    assert events == [{"a": 3}, {"a": 4}]
+    assert channel.streams == {}
+    await channel.close()
+
+
+@pytest.mark.asyncio
+async def test_stream_window_overflow_and_disconnect():
+    """测试超出窗口的分块和断线都会让流失败"""
+    websocket, channel, stream, request_id = await open_stream(window=2)
+    for seq in range(3):
+        await websocket.incoming.put(chunk_frame(request_id, seq, "x"))
+    with pytest.raises(FetchError):
+        await stream.read_all()
+
+    command = FetchCommand(ContextManager())
+    stream = await command.fetch_stream(channel, FetchCommandData(url="https://a.com", method="GET"))
+    await websocket.incoming.put(None)
+    with pytest.raises(ChannelClosedError):
+        await stream.read_all()
+    await channel.close()
+
+
+@pytest.mark.asyncio
+async def test_stream_rejects_empty_chunks_before_eof():
+    """测试空分块只能作为最后一块，否则流失败"""
+    websocket, channel, stream, request_id = await open_stream(window=2)
+    await websocket.incoming.put(chunk_frame(request_id, 0, "x"))
+    await websocket.incoming.put(chunk_frame(request_id, 1, "", eof=True))
+    assert await stream.read_all() == b"x"
+
+    command = FetchCommand(ContextManager())
+    stream = await command.fetch_stream(channel, FetchCommandData(url="https://a.com", method="GET"))
+    stream.idle_timeout = 1
+    await websocket.incoming.put(chunk_frame(stream.request_id, 0, ""))
+    with pytest.raises(FetchError, match="空分块"):
+        await stream.read_all()
+    assert channel.streams == {}
+    await channel.close()
+
+
+@pytest.mark.asyncio
+async def test_stream_to_file_and_whole_response_fallback(tmp_path):
+    """测试写入磁盘，以及扩展返回完整响应时的兼容处理"""
+    websocket, channel, stream, request_id = await open_stream()
+    await websocket.incoming.put(json.dumps({
+        "type": "fetch_response", "request_id": request_id, "data": {"code": 0}
+    }))
+    path = tmp_path / "body.json"
+    written = await stream.to_file(str(path))
+    assert json.loads(path.read_bytes()) == {"code": 0}
+    assert written == path.stat().st_size
+    await channel.close()
@@ -0,0 +1,81 @@
+import asyncio
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app.websocket  # noqa: F401  先导入 websocket 包，避免命令模块的循环导入
+from app import tracing
+from app.commands.fetch_cache import FetchCache
+from app.main import app
+from app.models.message import CommandType, Message
+from app.routes import admin
+from app.tracing import CommandProfiler, MemorySpanSink
+from app.websocket.channel import WebSocketChannel
+from app.websocket.command_handler import CommandHandler
+from app.websocket.context import ContextManager
+from tests.utils import FakeWebSocket
+
+
+@pytest.mark.asyncio
+async def test_command_spans(monkeypatch, tmp_path):
+    """测试命令处理记录分发、发送请求、等待响应和发送响应的区间"""
+    sink = MemorySpanSink()
+    monkeypatch.setattr(tracing.default_tracer, "sink", sink)
+    profiler = CommandProfiler(str(tmp_path))
+    handler = CommandHandler(ContextManager(), profiler=profiler)
+    handler.get_command(CommandType.FETCH).cache = FetchCache()
+    profiler.start(commands=1)
+
+    websocket = FakeWebSocket()
+    channel = WebSocketChannel(websocket)
+    await channel.accept()
+    task = asyncio.create_task(handler.handle_command(channel, Message.create_command("fetch", "u"), "c1"))
+    request = (await websocket.wait_sent(1))[-1]
+    await websocket.incoming.put(
+        Message.create_fetch_response({"v": 1}, request_id=request["request_id"]).to_json()
+    )
+    await task
+
+    spans = {span.name: span for span in sink.spans}
+    assert set(spans) == {"command", "fetch.send", "fetch.wait", "command.respond"}
+    root = spans["command"]
+    assert root.parent_id is None
+    assert root.attrs["command"] == "fetch"
+    for name in ("fetch.send", "fetch.wait", "command.respond"):
+        assert spans[name].trace_id == root.trace_id
+        assert spans[name].parent_id == root.span_id
+    assert spans["fetch.send"].attrs["request_id"] == request["request_id"]
+
+    # 分析一条命令后自动在后台线程保存结果
+    assert not profiler.active
+    await profiler.flush()
+    assert profiler.last_output is not None and os.path.exists(profiler.last_output)
+    await channel.close()
+
+
+def test_admin_profile_requires_token(monkeypatch, tmp_path):
+    """测试管理接口需要令牌，开启分析后可以提前结束"""
+    monkeypatch.setattr(tracing.default_profiler, "output_dir", str(tmp_path))
+    with TestClient(app) as client:
+        assert client.post("/admin/profile?commands=1").status_code == 404
+
+        monkeypatch.setattr(admin, "ADMIN_TOKEN", "secret")
+        assert client.post("/admin/profile?commands=1", headers={"X-Admin-Token": "wrong"}).status_code == 403
+
+        headers = {"X-Admin-Token": "secret"}
+        assert client.post("/admin/profile", headers=headers).status_code == 400
+        assert client.post("/admin/profile?seconds=60", headers=headers).json()["active"] is True
+        assert client.post("/admin/profile?seconds=60", headers=headers).status_code == 409
+        output = client.delete("/admin/profile", headers=headers).json()["output"]
+        assert os.path.exists(output)
+        assert client.get("/admin/profile", headers=headers).json()["active"] is False
+
+
+def test_span_sink_requires_export():
+    """测试追踪输出必须实现 export"""
+    class NoExport(tracing.SpanSink):
+        pass
+
+    with pytest.raises(TypeError):
+        NoExport()
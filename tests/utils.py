@@ -0,0 +1,40 @@
+import asyncio
+import json
+from typing import List, Optional, Union
+
+
+class FakeWebSocket:
+    """测试用的 WebSocket，incoming 中放入 None 表示客户端断开"""
+    def __init__(self):
+        self.sent: List[Union[str, bytes]] = []
+        self.incoming: asyncio.Queue = asyncio.Queue()
+        self.closed = False
+        self._sent_event = asyncio.Event()
+
+    async def accept(self, subprotocol: Optional[str] = None) -> None:
+        pass
+
+    async def send_text(self, data: str) -> None:
+        self.sent.append(data)
+        self._sent_event.set()
+
+    async def send_bytes(self, data: bytes) -> None:
+        self.sent.append(data)
+        self._sent_event.set()
+
+    async def receive(self) -> dict:
+        data = await self.incoming.get()
+        if data is None:
+            return {"type": "websocket.disconnect", "code": 1000}
+        key = "bytes" if isinstance(data, bytes) else "text"
+        return {"type": "websocket.receive", key: data}
+
+    async def close(self, code: int = 1000) -> None:
+        self.closed = True
+
+    async def wait_sent(self, count: int) -> List[dict]:
+        """等待至少发送了 count 条文本消息，返回解析后的消息"""
+        while len(self.sent) < count:
+            self._sent_event.clear()
+            await asyncio.wait_for(self._sent_event.wait(), 1)
+        return [json.loads(item) for item in self.sent]